@@ -1,29 +1,59 @@
-import warnings
+import os
+import json
 import uuid
 import logging
+import warnings
+import requests
 import streamlit as st
 from dotenv import load_dotenv
-from langchain_core.messages import AIMessage, HumanMessage
-from app.services.llm_service import LLM
-from app.services.embedding_service import Embedding
-from app.services.agentic_workflow_service import IPAgenticWorkflow
 
 logging.getLogger().setLevel(level=logging.INFO)
 
 warnings.filterwarnings("ignore")
 load_dotenv()
 
-llm_obj = LLM(model_name="gemini-2.5-flash")
-embedding_obj = Embedding()
-flow_obj = IPAgenticWorkflow(llm=llm_obj.get_llm(),
-                             embedding=embedding_obj.create_embeddings(embedding_model="models/text-embedding-004"))
-flow = flow_obj.compile_workflow()
+API_URL = os.getenv("IP_TUTOR_API_URL", "http://localhost:8000")
+
+
+def iter_sse(lines):
+    event, data = None, []
+    for line in lines:
+        if not line:
+            if event:
+                yield event, json.loads("\n".join(data))
+            event, data = None, []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
 
-my_uuid = uuid.uuid4()
+def stream_answer(question, user_id, message_id, placeholder):
+    """
+    Render the answer streamed by the /chat/stream endpoint and return its final text
+    """
+    text = ""
+    with requests.post(f"{API_URL}/chat/stream", json={"user_id": user_id, "query": question,
+                                                       "message_id": message_id},
+                       stream=True, timeout=300) as rsp:
+        rsp.raise_for_status()
+        for event, data in iter_sse(rsp.iter_lines(decode_unicode=True)):
+            if event == "token":
+                text += data["text"]
+            elif event == "restart":
+                text = ""
+            elif event in ("final", "correction"):
+                text = data["content"][0]["text"]
+            elif event == "error":
+                text = data["detail"]
+            placeholder.markdown(text)
+    return text
 
-# Convert the UUID object to a string (hexadecimal representation without dashes)
-user_id = f"user_id_{my_uuid.hex}"
-msg_id = 0
+
+if "user_id" not in st.session_state:
+    # Convert the UUID object to a string (hexadecimal representation without dashes)
+    st.session_state.user_id = f"user_id_{uuid.uuid4().hex}"
+    st.session_state.msg_id = 0
 
 st.header("""Intellectual Property Tutor:
 Gen-AI powered Tutor for Indian Intellectual Property Laws Tutor""")
@@ -48,31 +78,19 @@ if user_question := st.chat_input("What do you want to learn about today?"):
         st.markdown(user_question)
 
     with st.chat_message("assistant"):
+        st.session_state.msg_id += 1
+        message_id = str(st.session_state.msg_id).zfill(4)
+        placeholder = st.empty()
+
+        try:
+            txt = stream_answer(question=user_question, user_id=st.session_state.user_id, message_id=message_id,
+                                placeholder=placeholder)
+        except Exception as err_msg:
+            logging.error(str(err_msg))
+            txt = "Unable to process request right now. Please try after some time."
+            placeholder.markdown(txt)
+
         if "bye" in user_question.lower() or "exit" in user_question.lower() or "quit" in user_question.lower():
-            st.write_stream(["Bye! have a great day ahead!!"])
-            flow_obj.end_langgraph_session()
             st.session_state.clear()
-
         else:
-            msg_id += 1
-            message_id = str(msg_id).zfill(4)
-
-            try:
-                for event in flow.stream(
-                        {"messages": [
-                            {"role": "user",
-                             "content": user_question}]},
-                        flow_obj.config,
-                        stream_mode="values"
-                ):
-                    response = flow_obj.interact(response=event, user_id=user_id, message_id=message_id)
-                    txt = response["content"][0]["text"]
-                    flow_obj.chat_history.extend(
-                        [HumanMessage(user_question), AIMessage(txt)])
-
-                response = st.write_stream([txt])
-            except Exception as err_msg:
-                logging.error(str(err_msg))
-                response = st.write_stream(["Unable to process request right now. Please try after some time."])
-
             st.session_state.messages.append({"role": "assistant", "content": txt})
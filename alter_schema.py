@@ -1,8 +1,7 @@
-from pymilvus import Collection, MilvusClient, DataType
+from app.core.milvus_registry import get_milvus_registry
 
-client = MilvusClient("./milvus_db.db")
-
-# Assuming 'client' is an initialized MilvusClient instance
+# Client of the Milvus instance of IP_TUTOR_MILVUS_URI
+client = get_milvus_registry().get_client()
 
 # Altering a field's property (e.g., setting a default value)
 client.alter_collection_field(
@@ -0,0 +1,371 @@
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from langgraph.checkpoint.base import WRITES_IDX_MAP, BaseCheckpointSaver, CheckpointTuple, get_checkpoint_id, \
+    get_checkpoint_metadata
+from langgraph.checkpoint.memory import InMemorySaver
+
+CHECKPOINTER_BACKENDS = ("memory", "sqlite")
+DEFAULT_CHECKPOINT_DB = "checkpoints.db"
+
+
+def create_checkpointer(backend="memory", path=DEFAULT_CHECKPOINT_DB, max_threads=1000, ttl_seconds=3600,
+                        max_checkpoints_per_thread=5, metrics_hook=None):
+    """
+    Build the checkpointer the conversation graph is compiled with
+
+    Args:
+        backend (str): "memory" keeps threads in process, "sqlite" persists them to path across restarts
+        max_threads (int): Threads kept in memory before the least recently used one is evicted
+        ttl_seconds (int): Idle time after which a thread is evicted, None disables expiry
+        max_checkpoints_per_thread (int): Checkpoints kept per thread, older ones are compacted away
+        metrics_hook (callable): Called with the saver stats after every checkpoint write
+
+    Returns:
+        BaseCheckpointSaver: Checkpointer for StateGraph.compile
+    """
+    if backend not in CHECKPOINTER_BACKENDS:
+        raise ValueError(f"Unsupported checkpointer backend {backend}, expected one of {CHECKPOINTER_BACKENDS}")
+    if backend == "sqlite":
+        return SqliteCheckpointSaver(path=path, ttl_seconds=ttl_seconds,
+                                     max_checkpoints_per_thread=max_checkpoints_per_thread,
+                                     metrics_hook=metrics_hook)
+    return BoundedInMemorySaver(max_threads=max_threads, ttl_seconds=ttl_seconds,
+                                max_checkpoints_per_thread=max_checkpoints_per_thread, metrics_hook=metrics_hook)
+
+
+class BoundedInMemorySaver(InMemorySaver):
+    """
+    InMemorySaver which evicts idle threads and compacts the checkpoint history of every thread.
+
+    Threads are kept in LRU order of their last read or write. The least recently used thread is evicted once
+    max_threads is exceeded, and threads idle for more than ttl_seconds are evicted on the next write. Only the latest
+    max_checkpoints_per_thread checkpoints of a thread are kept, together with the channel blobs and pending writes
+    they reference.
+    """
+
+    def __init__(self, max_threads=1000, ttl_seconds=3600, max_checkpoints_per_thread=5, metrics_hook=None,
+                 **kwargs):
+        super().__init__(**kwargs)
+        if max_checkpoints_per_thread is not None and max_checkpoints_per_thread < 2:
+            # A running graph reads the checkpoint it started from while writing the next one
+            raise ValueError("max_checkpoints_per_thread must be at least 2")
+        self.max_threads = max_threads
+        self.ttl_seconds = ttl_seconds
+        self.max_checkpoints_per_thread = max_checkpoints_per_thread
+        self.metrics_hook = metrics_hook
+        self.last_access = OrderedDict()
+        self.thread_bytes = {}
+        self.lock = threading.RLock()
+        self.counters = {"evictions": 0, "expirations": 0, "compacted_checkpoints": 0}
+
+    def _touch(self, thread_id):
+        self.last_access[thread_id] = time.monotonic()
+        self.last_access.move_to_end(thread_id)
+
+    def _add_bytes(self, thread_id, size):
+        self.thread_bytes[thread_id] = self.thread_bytes.get(thread_id, 0) + size
+
+    def _drop_checkpoints(self, thread_id, checkpoint_ns, checkpoint_ids, keep_versions=()):
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        freed = 0
+        for checkpoint_id in checkpoint_ids:
+            checkpoint, metadata, _ = checkpoints.pop(checkpoint_id)
+            freed += len(checkpoint[1]) + len(metadata[1])
+            for _, _, value, _ in self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), {}).values():
+                freed += len(value[1])
+            for channel, version in self.serde.loads_typed(checkpoint)["channel_versions"].items():
+                if (channel, version) not in keep_versions:
+                    blob = self.blobs.pop((thread_id, checkpoint_ns, channel, version), None)
+                    freed += len(blob[1]) if blob else 0
+        self._add_bytes(thread_id, -freed)
+
+    def compact(self, thread_id, checkpoint_ns):
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if self.max_checkpoints_per_thread is None or len(checkpoints) <= self.max_checkpoints_per_thread:
+            return
+        checkpoint_ids = sorted(checkpoints)
+        keep_versions = set()
+        for checkpoint_id in checkpoint_ids[-self.max_checkpoints_per_thread:]:
+            keep_versions.update(self.serde.loads_typed(checkpoints[checkpoint_id][0])["channel_versions"].items())
+        dropped = checkpoint_ids[:-self.max_checkpoints_per_thread]
+        self._drop_checkpoints(thread_id, checkpoint_ns, dropped, keep_versions=keep_versions)
+        self.counters["compacted_checkpoints"] += len(dropped)
+
+    def _delete_thread(self, thread_id):
+        for checkpoint_ns in list(self.storage.get(thread_id, {})):
+            self._drop_checkpoints(thread_id, checkpoint_ns, list(self.storage[thread_id][checkpoint_ns]))
+        self.storage.pop(thread_id, None)
+        self.last_access.pop(thread_id, None)
+        self.thread_bytes.pop(thread_id, None)
+
+    def evict(self, current_thread_id=None):
+        """
+        Evict expired threads and, above max_threads, the least recently used ones
+        """
+        with self.lock:
+            now = time.monotonic()
+            while self.last_access:
+                thread_id, last_access = next(iter(self.last_access.items()))
+                if thread_id == current_thread_id:
+                    break
+                if self.ttl_seconds is not None and now - last_access > self.ttl_seconds:
+                    self.counters["expirations"] += 1
+                elif self.max_threads is not None and len(self.last_access) > self.max_threads:
+                    self.counters["evictions"] += 1
+                else:
+                    break
+                logging.info(f"Evicting idle thread {thread_id} from the checkpointer")
+                self._delete_thread(thread_id)
+
+    def get_tuple(self, config):
+        with self.lock:
+            thread_id = config["configurable"]["thread_id"]
+            if thread_id in self.storage:
+                self._touch(thread_id)
+            tup = super().get_tuple(config)
+            if thread_id not in self.last_access:
+                # get_tuple goes through the defaultdict, do not keep an empty entry for unknown threads
+                self.storage.pop(thread_id, None)
+            return tup
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        with self.lock:
+            items = list(super().list(config, filter=filter, before=before, limit=limit))
+        yield from items
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self.lock:
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"]["checkpoint_ns"]
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            saved, saved_metadata, _ = self.storage[thread_id][checkpoint_ns][checkpoint["id"]]
+            self._add_bytes(thread_id, len(saved[1]) + len(saved_metadata[1]) + sum(
+                len(self.blobs[(thread_id, checkpoint_ns, channel, version)][1])
+                for channel, version in new_versions.items()))
+            self._touch(thread_id)
+            self.compact(thread_id, checkpoint_ns)
+            self.evict(current_thread_id=thread_id)
+            stats = self.stats()
+        if self.metrics_hook is not None:
+            self.metrics_hook(stats)
+        return next_config
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with self.lock:
+            thread_id = config["configurable"]["thread_id"]
+            key = (thread_id, config["configurable"].get("checkpoint_ns", ""),
+                   config["configurable"]["checkpoint_id"])
+            before = sum(len(value[1]) for _, _, value, _ in self.writes.get(key, {}).values())
+            super().put_writes(config, writes, task_id, task_path)
+            self._add_bytes(thread_id, sum(len(value[1]) for _, _, value, _ in self.writes[key].values()) - before)
+            self._touch(thread_id)
+
+    def delete_thread(self, thread_id):
+        with self.lock:
+            self._delete_thread(thread_id)
+
+    def stats(self):
+        with self.lock:
+            return {"backend": "memory",
+                    "threads": len(self.last_access),
+                    "checkpoints": sum(len(checkpoints) for namespaces in self.storage.values()
+                                       for checkpoints in namespaces.values()),
+                    "bytes": sum(self.thread_bytes.values()),
+                    **self.counters}
+
+
+class SqliteCheckpointSaver(BaseCheckpointSaver):
+    """
+    Checkpointer persisting threads to a local SQLite file, usable from both the sync and the async graph APIs.
+
+    Every checkpoint is stored with its channel values, only the latest max_checkpoints_per_thread checkpoints of a
+    thread are kept, and threads idle for more than ttl_seconds are purged, at most once per purge_interval seconds.
+    """
+
+    def __init__(self, path=DEFAULT_CHECKPOINT_DB, ttl_seconds=None, max_checkpoints_per_thread=5,
+                 purge_interval=60, metrics_hook=None, serde=None):
+        super().__init__(serde=serde)
+        if max_checkpoints_per_thread is not None and max_checkpoints_per_thread < 2:
+            raise ValueError("max_checkpoints_per_thread must be at least 2")
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_checkpoints_per_thread = max_checkpoints_per_thread
+        self.purge_interval = purge_interval
+        self.metrics_hook = metrics_hook
+        self.last_purge = 0.0
+        self.lock = threading.Lock()
+        self.counters = {"expirations": 0, "compacted_checkpoints": 0}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS checkpoints (
+                thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL,
+                parent_checkpoint_id TEXT, type TEXT, checkpoint BLOB, metadata_type TEXT, metadata BLOB,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id))""")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS writes (
+                thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL,
+                task_id TEXT NOT NULL, idx INTEGER NOT NULL, channel TEXT NOT NULL, type TEXT, value BLOB,
+                task_path TEXT, PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx))""")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS threads (
+                thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)""")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _row_to_tuple(self, row):
+        thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type_, checkpoint, metadata_type, metadata = row
+        writes = self.conn.execute(
+            "SELECT task_id, channel, type, value FROM writes WHERE thread_id = ? AND checkpoint_ns = ? "
+            "AND checkpoint_id = ? ORDER BY task_id, idx", (thread_id, checkpoint_ns, checkpoint_id)).fetchall()
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": checkpoint_id}},
+            checkpoint=self.serde.loads_typed((type_, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=({"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                             "checkpoint_id": parent_checkpoint_id}}
+                           if parent_checkpoint_id else None),
+            pending_writes=[(task_id, channel, self.serde.loads_typed((value_type, value)))
+                            for task_id, channel, value_type, value in writes])
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        query = "SELECT * FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?"
+        params = [thread_id, checkpoint_ns]
+        if checkpoint_id := get_checkpoint_id(config):
+            query += " AND checkpoint_id = ?"
+            params.append(checkpoint_id)
+        else:
+            query += " ORDER BY checkpoint_id DESC LIMIT 1"
+        with self.lock:
+            row = self.conn.execute(query, params).fetchone()
+            return self._row_to_tuple(row) if row else None
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        query = "SELECT * FROM checkpoints"
+        clauses, params = [], []
+        if config:
+            clauses.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                clauses.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                clauses.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_checkpoint_id := get_checkpoint_id(before)):
+            clauses.append("checkpoint_id < ?")
+            params.append(before_checkpoint_id)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY checkpoint_id DESC"
+        with self.lock:
+            items = []
+            for row in self.conn.execute(query, params).fetchall():
+                if limit is not None and len(items) >= limit:
+                    break
+                if filter:
+                    metadata = self.serde.loads_typed((row[6], row[7]))
+                    if not all(metadata.get(key) == value for key, value in filter.items()):
+                        continue
+                items.append(self._row_to_tuple(row))
+        yield from items
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        type_, serialized = self.serde.dumps_typed(checkpoint)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              (thread_id, checkpoint_ns, checkpoint["id"],
+                               config["configurable"].get("checkpoint_id"), type_, serialized, metadata_type,
+                               serialized_metadata))
+            self.conn.execute("INSERT OR REPLACE INTO threads VALUES (?, ?)", (thread_id, time.time()))
+            self.compact(thread_id, checkpoint_ns)
+            self.purge_expired(current_thread_id=thread_id)
+        if self.metrics_hook is not None:
+            self.metrics_hook(self.stats())
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                 "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        # Special channels are overwritten, regular writes of a task are only stored once
+        statement = "INSERT OR REPLACE" if all(channel in WRITES_IDX_MAP for channel, _ in writes) else \
+            "INSERT OR IGNORE"
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, serialized = self.serde.dumps_typed(value)
+            rows.append((thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel,
+                         type_, serialized, task_path))
+        with self.lock, self.conn:
+            self.conn.executemany(f"{statement} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def compact(self, thread_id, checkpoint_ns):
+        if self.max_checkpoints_per_thread is None:
+            return
+        stale = [row[0] for row in self.conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+            (thread_id, checkpoint_ns, self.max_checkpoints_per_thread)).fetchall()]
+        for table in ("checkpoints", "writes"):
+            self.conn.executemany(f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                                  [(thread_id, checkpoint_ns, checkpoint_id) for checkpoint_id in stale])
+        self.counters["compacted_checkpoints"] += len(stale)
+
+    def _delete_thread(self, thread_id):
+        for table in ("checkpoints", "writes", "threads"):
+            self.conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+
+    def purge_expired(self, current_thread_id=None):
+        now = time.time()
+        if self.ttl_seconds is None or now - self.last_purge < self.purge_interval:
+            return
+        self.last_purge = now
+        expired = [row[0] for row in self.conn.execute(
+            "SELECT thread_id FROM threads WHERE updated_at < ? AND thread_id != ?",
+            (now - self.ttl_seconds, current_thread_id or "")).fetchall()]
+        for thread_id in expired:
+            logging.info(f"Purging idle thread {thread_id} from the checkpointer")
+            self._delete_thread(thread_id)
+        self.counters["expirations"] += len(expired)
+
+    def delete_thread(self, thread_id):
+        with self.lock, self.conn:
+            self._delete_thread(thread_id)
+
+    def stats(self):
+        with self.lock:
+            threads = self.conn.execute("SELECT COUNT(*) FROM threads").fetchone()[0]
+            checkpoints = self.conn.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+            page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+            return {"backend": "sqlite", "threads": threads, "checkpoints": checkpoints,
+                    "bytes": page_count * page_size, **self.counters}
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        return await asyncio.to_thread(self.delete_thread, thread_id)
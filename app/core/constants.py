@@ -380,6 +380,57 @@ Finding context of the question from the chat history as priority.
 Do NOT answer the question,
 just reformulate it if needed and otherwise return it as is."""
 
+TRIAGE_PROMPT = """You are an expert at triaging the messages received by an Indian Intellectual Property Laws tutor.
+Classify the latest user message, enclosed in the human turn, in the context of the existing conversation history and set
+every flag of the Triage schema:
+- "generate_quiz": True if the message asks to quiz the user or to generate questions on a topic, otherwise False.
+- "valid_question": True if the message is related to Indian Intellectual Property Laws or is a follow-up of such a
+conversation (for example "Can you explain in greater detail?"), otherwise False.
+- "valid_quiz_topic": True if the requested quiz topic, or the conversation it refers to, is related to Indian
+Intellectual Property Laws, otherwise False. Set it to False when no quiz is requested.
+- "web_search_required": True ONLY if the message is related to Indian Intellectual Property Laws and asks for recent
+information (latest amendments, news, current fees) that is unlikely to be present in the official IP manuals,
+otherwise False. Never request web-search for questions unrelated to Indian Intellectual Property Laws.
+- "send_email": True if the user asks to send or email the generated quiz, typically providing an email address,
+otherwise False.
+
+IMPORTANT :Return the flags as a properly structured JSON matching the Triage schema with no preamble or explanation."""
+
+CONVERSATION_SUMMARY_PROMPT = """You are summarizing the earlier part of a conversation between a student and an Indian
+Intellectual Property Laws tutor. Extend the existing summary with the new messages.
+Keep the topics, acts, sections and any facts the student asked about, drop greetings and repetition.
+Keep the summary under {max_words} words and return only the summary with no preamble.
+
+Existing summary:
+{summary}
+
+New messages:
+{messages}"""
+
+TARGET_COLLECTIONS = ["ip_laws", "ip_laws_extended", "ip_laws_hindi"]
+
+COLLECTION_VERSIONS_FILE = "collection_versions.json"
+
+# Index type, build params and search params of the dense field of every collection, written by create_collection.py
+# and data_load.py and read by the retrievers
+INDEX_CONFIG_FILE = "index_config.json"
+DEFAULT_INDEX_TYPE = "IVF_FLAT"
+# Build and search params per dense index type, IVF_PQ requires m to divide the embedding dimension (768)
+INDEX_PRESETS = {
+    "FLAT": {"index_params": {}, "search_params": {}},
+    "IVF_FLAT": {"index_params": {"nlist": 128}, "search_params": {"nprobe": 16}},
+    "IVF_SQ8": {"index_params": {"nlist": 128}, "search_params": {"nprobe": 16}},
+    "IVF_PQ": {"index_params": {"nlist": 128, "m": 16, "nbits": 8}, "search_params": {"nprobe": 16}},
+    "HNSW": {"index_params": {"M": 16, "efConstruction": 200}, "search_params": {"ef": 64}},
+}
+
+# US dollars per million input and output tokens, used to estimate the cost of the LLM calls of a request
+MODEL_PRICING = {
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-pro": (1.25, 10.00),
+}
+
 MAIL_SUBJECT = "Generated Quiz"
 MAIL_BODY = """
 Hi,
@@ -0,0 +1,184 @@
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.core.settings import get_settings
+from app.core.constants import TARGET_COLLECTIONS
+from app.core.milvus_registry import get_milvus_registry
+from app.services.mail_service import get_mail_dispatcher
+from app.services.artifact_service import get_artifact_store
+
+CONTAINER_STATES = ("created", "starting", "ready", "failed")
+STARTUP_MODES = ("background", "blocking")
+
+_SERVICE_CONTAINER = None
+_SERVICE_CONTAINER_LOCK = threading.Lock()
+
+
+class ServiceContainer:
+    """
+    Builds and owns the services behind the chat API.
+
+    Nothing is built on import. start() builds the independent components concurrently (LLM, embeddings, reranking
+    model, checkpointer and the Milvus warm-up), then the workflow which depends on them, and finally runs the
+    configured warm-up queries through retrieval and reranking so the first user request does not hit cold clients.
+    A failed start leaves the container in the failed state with its error, the app keeps serving its health
+    endpoints instead of failing to start.
+    """
+
+    def __init__(self, settings=None, milvus_registry=None, mail_dispatcher=None, artifact_store=None):
+        self.settings = settings or get_settings()
+        self.milvus_registry = milvus_registry or get_milvus_registry()
+        self.mail_dispatcher = mail_dispatcher or get_mail_dispatcher()
+        self.artifact_store = artifact_store or get_artifact_store()
+        self.state = "created"
+        self.error = None
+        self.timings = {}
+        self.lock = threading.Lock()
+        self.llm = None
+        self.embedding = None
+        self.semantic_cache = None
+        self.checkpointer = None
+        self.session_manager = None
+        self.flow_obj = None
+        self.flow = None
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def _timed(self, name, func, *args, **kwargs):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        with self.lock:
+            self.timings[name] = time.perf_counter() - started
+        return result
+
+    def end_session(self, session):
+        if self.flow_obj is not None:
+            self.flow_obj.end_langgraph_session(thread_id=session.thread_id)
+
+    def build(self):
+        # Imported here, importing the services pulls in the LLM, Milvus and reranking libraries
+        from app.services.llm_service import LLM
+        from app.services.embedding_service import Embedding
+        from app.services.cache_service import SemanticCache
+        from app.services.rerank_service import get_ranker
+        from app.core.checkpointer import create_checkpointer
+        from app.core.session_manager import SessionManager
+        from app.utils.utility import read_index_config
+        from app.services.agentic_workflow_service import IPAgenticWorkflow
+
+        settings = self.settings
+        with ThreadPoolExecutor(max_workers=5, thread_name_prefix="startup") as executor:
+            llm = executor.submit(self._timed, "llm", lambda: LLM(model_name="gemini-2.0-flash").get_llm())
+            embedding = executor.submit(self._timed, "embedding", Embedding().create_embeddings,
+                                        embedding_model="models/text-embedding-004")
+            checkpointer = executor.submit(self._timed, "checkpointer", create_checkpointer,
+                                           backend=settings.checkpointer_backend,
+                                           path=settings.checkpointer_path,
+                                           max_threads=settings.checkpointer_max_threads,
+                                           ttl_seconds=settings.checkpointer_ttl_seconds,
+                                           max_checkpoints_per_thread=settings.checkpointer_max_checkpoints)
+            ranker = executor.submit(self._timed, "reranker", get_ranker)
+            milvus = None
+            if settings.milvus_warm_up:
+                milvus = executor.submit(self._timed, "milvus", self.milvus_registry.warm_up, TARGET_COLLECTIONS,
+                                         settings.milvus_uri)
+
+            self.llm = llm.result()
+            self.embedding = embedding.result()
+            if settings.semantic_cache_enabled:
+                self.semantic_cache = SemanticCache(embedding=self.embedding,
+                                                    threshold=settings.semantic_cache_threshold,
+                                                    max_entries=settings.semantic_cache_max_entries,
+                                                    ttl_seconds=settings.semantic_cache_ttl_seconds)
+            self.checkpointer = checkpointer.result()
+            self.session_manager = SessionManager(idle_ttl_seconds=settings.session_idle_ttl_seconds,
+                                                  max_sessions=settings.session_max_sessions,
+                                                  max_history=settings.session_max_history,
+                                                  on_evict=self.end_session)
+            flow_obj = self._timed("workflow", IPAgenticWorkflow,
+                                   llm=self.llm,
+                                   embedding=self.embedding,
+                                   graph_mode=settings.graph_mode,
+                                   semantic_cache=self.semantic_cache,
+                                   retriever_type=settings.retriever_type,
+                                   search_mode=settings.search_mode,
+                                   ranker_type=settings.hybrid_ranker,
+                                   rerank_mode=settings.rerank_mode,
+                                   rerank_top_n=settings.rerank_top_n,
+                                   grading_mode=settings.grading_mode,
+                                   speculative_min_documents=settings.speculative_min_documents,
+                                   speculative_score_threshold=settings.speculative_score_threshold,
+                                   context_max_tokens=settings.context_max_tokens,
+                                   history_window=settings.context_history_window,
+                                   checkpointer=self.checkpointer,
+                                   session_manager=self.session_manager,
+                                   dedupe_threshold=settings.retrieval_dedupe_threshold,
+                                   index_config=read_index_config(index_config_file=settings.index_config_file),
+                                   milvus_uri=settings.milvus_uri,
+                                   mail_dispatcher=self.mail_dispatcher,
+                                   artifact_store=self.artifact_store)
+            self.flow = self._timed("graph", flow_obj.compile_workflow)
+            self.flow_obj = flow_obj
+            ranker.result()
+            if milvus is not None:
+                milvus.result()
+
+    def warm_up(self):
+        """
+        Run the warm-up queries through retrieval and reranking, which opens the embedding and Milvus connections and
+        the reranking session, without calling the LLM
+        """
+        for query in self.settings.warm_up_queries:
+            documents = self.flow_obj.retriever.invoke(query)
+            if documents:
+                self.flow_obj.compressor.compress_documents(documents, query)
+
+    def start(self):
+        """
+        Build the services and run the warm-up queries
+
+        Returns:
+            str: State of the container, "ready" or "failed"
+        """
+        started = time.perf_counter()
+        self.state = "starting"
+        try:
+            self.build()
+            if self.settings.warm_up_queries:
+                self._timed("warm_up_queries", self.warm_up)
+            self.state = "ready"
+        except Exception as err_msg:
+            logging.error(f"Service startup failed: {err_msg}")
+            self.error = str(err_msg)
+            self.state = "failed"
+        with self.lock:
+            self.timings["total"] = time.perf_counter() - started
+        logging.info(f"Services {self.state} in {self.timings['total']:.2f}s ({self.timings})")
+        return self.state
+
+    async def astart(self):
+        return await asyncio.to_thread(self.start)
+
+    def close(self):
+        # Queued emails are delivered before the connections are closed
+        self.mail_dispatcher.close()
+        if self.checkpointer is not None and hasattr(self.checkpointer, "close"):
+            self.checkpointer.close()
+        self.milvus_registry.close()
+
+    def status(self):
+        with self.lock:
+            timings = dict(self.timings)
+        return {"state": self.state, "ready": self.ready, "error": self.error, "timings_seconds": timings}
+
+
+def get_service_container():
+    global _SERVICE_CONTAINER
+    with _SERVICE_CONTAINER_LOCK:
+        if _SERVICE_CONTAINER is None:
+            _SERVICE_CONTAINER = ServiceContainer()
+        return _SERVICE_CONTAINER
@@ -0,0 +1,124 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import Future
+from pymilvus import MilvusClient
+from app.core.settings import get_settings
+
+_MILVUS_REGISTRY = None
+_MILVUS_REGISTRY_LOCK = threading.Lock()
+
+
+class MilvusClientRegistry:
+    """
+    Process-wide registry of Milvus connections and vector stores.
+
+    pymilvus keys its gRPC connections on the URI, so every client built from the same connection args shares one
+    channel. The registry normalizes the URI (a Milvus Lite file opened through a relative and an absolute path would
+    otherwise start two Lite servers on the same file), hands out one MilvusClient per URI for the admin scripts and
+    health checks, and keeps one langchain Milvus store per collection and search settings, so retrievers built for
+    several workflows or requests reuse the same store instead of describing the collection and opening a new async
+    client every time.
+    """
+
+    def __init__(self, settings=None):
+        self.settings = settings or get_settings()
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.stores = {}
+        self.counters = {"store_hits": 0, "store_misses": 0, "warmed_collections": 0}
+        self.warm_up_seconds = None
+
+    def normalize_uri(self, uri=None):
+        uri = uri or self.settings.milvus_uri
+        return uri if "://" in uri else os.path.abspath(uri)
+
+    def connection_args(self, uri=None):
+        connection_args = {"uri": self.normalize_uri(uri)}
+        if self.settings.milvus_token:
+            connection_args["token"] = self.settings.milvus_token
+        if self.settings.milvus_db_name:
+            connection_args["db_name"] = self.settings.milvus_db_name
+        return connection_args
+
+    def get_client(self, uri=None):
+        connection_args = self.connection_args(uri)
+        with self.lock:
+            client = self.clients.get(connection_args["uri"])
+            if client is None:
+                client = MilvusClient(**connection_args)
+                self.clients[connection_args["uri"]] = client
+            return client
+
+    def get_store(self, key, factory):
+        """
+        Shared store for key, built by factory on first use
+
+        The store is built outside the lock, it connects to Milvus and describes the collection. Callers asking for a
+        key which is being built wait on its Future, callers of other keys and stats() do not wait at all.
+        """
+        with self.lock:
+            future = self.stores.get(key)
+            building = future is None
+            if building:
+                self.counters["store_misses"] += 1
+                future = Future()
+                self.stores[key] = future
+            else:
+                self.counters["store_hits"] += 1
+        if not building:
+            return future.result()
+        try:
+            store = factory()
+        except Exception as err_msg:
+            # A failed build is not cached, the next caller retries it
+            with self.lock:
+                self.stores.pop(key, None)
+            future.set_exception(err_msg)
+            raise
+        future.set_result(store)
+        return store
+
+    def warm_up(self, collection_names, uri=None):
+        """
+        Open the connection and load the collections into memory, so the first request pays neither
+
+        Returns:
+            list: Collections which were loaded, missing collections are skipped with a warning
+        """
+        started = time.perf_counter()
+        client = self.get_client(uri)
+        warmed = []
+        for collection_name in collection_names:
+            if not client.has_collection(collection_name=collection_name):
+                logging.warning(f"Collection {collection_name} does not exist, skipping its warm-up")
+                continue
+            client.load_collection(collection_name=collection_name)
+            warmed.append(collection_name)
+        self.warm_up_seconds = time.perf_counter() - started
+        with self.lock:
+            self.counters["warmed_collections"] = len(warmed)
+        logging.info(f"Warmed up {warmed} in {self.warm_up_seconds:.2f}s")
+        return warmed
+
+    def close(self):
+        with self.lock:
+            clients = list(self.clients.values())
+            self.clients.clear()
+            self.stores.clear()
+        for client in clients:
+            client.close()
+
+    def stats(self):
+        with self.lock:
+            return {"clients": len(self.clients), "stores": len(self.stores), "warm_up_seconds": self.warm_up_seconds,
+                    **self.counters}
+
+
+def get_milvus_registry():
+    global _MILVUS_REGISTRY
+    with _MILVUS_REGISTRY_LOCK:
+        if _MILVUS_REGISTRY is None:
+            _MILVUS_REGISTRY = MilvusClientRegistry()
+        return _MILVUS_REGISTRY
@@ -1,34 +1,206 @@
+import time
+import uuid
+import zlib
+import logging
 import threading
+from collections import OrderedDict, deque
 from datetime import datetime, timezone
+from langchain_core.messages import AIMessage, HumanMessage
+
+
+class Message:
+    __slots__ = ("seq", "role", "message_id", "text", "timestamp")
+
+    def __init__(self, seq, role, message_id, text, timestamp):
+        self.seq = seq
+        self.role = role
+        self.message_id = message_id
+        self.text = text
+        self.timestamp = timestamp
+
+    def to_dict(self):
+        return {"role": self.role,
+                "message_id": self.message_id,
+                "text": self.text,
+                "timestamp": datetime.fromtimestamp(self.timestamp, timezone.utc).isoformat()}
+
+    def to_langchain(self, session_key):
+        # The id is stable and unique across sessions, the context builder memoizes summaries on it
+        message_class = HumanMessage if self.role == "user" else AIMessage
+        return message_class(content=self.text, id=f"{session_key}-{self.seq}")
 
 
 class Session:
-    def __init__(self, user_id: str):
+    __slots__ = ("user_id", "thread_id", "key", "history", "lock", "last_access", "next_seq", "summary",
+                 "summarized_seq", "evicted")
+
+    def __init__(self, user_id: str, max_history=50):
         self.user_id = user_id
-        self.history = []
+        self.thread_id = user_id
+        self.key = uuid.uuid4().hex
+        self.history = deque(maxlen=max_history)
         self.lock = threading.Lock()
+        self.last_access = time.monotonic()
+        self.next_seq = 0
+        # Rolling summary of the conversation, covering every message with a seq below summarized_seq. Messages
+        # pushed out of the history before they were summarized wait in evicted, so they are not lost to the summary
+        self.summary = ""
+        self.summarized_seq = 0
+        self.evicted = deque()
 
     def add_message(self, role, message_id, text):
         with self.lock:
-            self.history.append({
-                "role": role,
-                "message_id": message_id,
-                "text": text,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            })
+            if len(self.history) == self.history.maxlen and self.history[0].seq >= self.summarized_seq:
+                self.evicted.append(self.history[0])
+            self.history.append(Message(seq=self.next_seq, role=role, message_id=message_id, text=text,
+                                        timestamp=time.time()))
+            self.next_seq += 1
+            self.last_access = time.monotonic()
 
     def get_history(self):
         with self.lock:
-            return list(self.history)
+            return [message.to_dict() for message in self.history]
+
+    def get_messages(self):
+        """
+        Chat history as LangChain messages, oldest first
+        """
+        with self.lock:
+            return [message.to_langchain(self.key) for message in self.history]
+
+    def pending_summary(self, window):
+        """
+        Rolling summary and the messages which left the window of the latest messages since it was last extended
+
+        Returns:
+            tuple: Summary, the messages to fold into it as LangChain messages, oldest first, and the seq the summary
+            covers once they are folded
+        """
+        with self.lock:
+            boundary = self.next_seq - window
+            pending = [message for message in list(self.evicted) + list(self.history)
+                       if self.summarized_seq <= message.seq < boundary]
+            upto = pending[-1].seq + 1 if pending else self.summarized_seq
+            return self.summary, [message.to_langchain(self.key) for message in pending], upto
+
+    def fold_summary(self, summary, upto):
+        """
+        Replace the rolling summary with one covering every message with a seq below upto
+        """
+        with self.lock:
+            # A concurrent node of the same turn may already have folded the same messages
+            if upto <= self.summarized_seq:
+                return
+            self.summary = summary
+            self.summarized_seq = upto
+            while self.evicted and self.evicted[0].seq < upto:
+                self.evicted.popleft()
+
+    def get_config(self):
+        return {"configurable": {"thread_id": self.thread_id}}
 
 
 class SessionManager:
-    def __init__(self):
-        self.sessions = {}
-        self.lock = threading.Lock()
+    """
+    Per-user session store.
+
+    Sessions are spread over lock stripes by a hash of the user id, so requests of different users rarely contend on
+    the same lock. Every stripe keeps its sessions in LRU order, sessions idle for more than idle_ttl_seconds are
+    evicted and every stripe holds at most its share of max_sessions. on_evict is called with every evicted or
+    removed session, outside of the stripe lock, e.g. to drop its checkpointer thread.
+    """
+
+    def __init__(self, num_stripes=16, idle_ttl_seconds=3600, max_sessions=10000, max_history=50, on_evict=None):
+        self.num_stripes = num_stripes
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_sessions_per_stripe = max(1, -(-max_sessions // num_stripes))
+        self.max_history = max_history
+        self.on_evict = on_evict
+        self.stripes = [(threading.Lock(), OrderedDict()) for _ in range(num_stripes)]
+        self.counters_lock = threading.Lock()
+        self.counters = {"created": 0, "expired": 0, "evicted": 0, "removed": 0}
+
+    def _stripe(self, user_id):
+        return self.stripes[zlib.crc32(user_id.encode("utf-8")) % self.num_stripes]
+
+    def _count(self, key, value=1):
+        if value:
+            with self.counters_lock:
+                self.counters[key] += value
+
+    def _notify(self, sessions):
+        if self.on_evict is None:
+            return
+        for session in sessions:
+            try:
+                self.on_evict(session)
+            except Exception as err_msg:
+                logging.error(f"Error evicting session {session.user_id}: {err_msg}")
+
+    def _expire(self, sessions, now):
+        expired = []
+        while sessions:
+            session = next(iter(sessions.values()))
+            if self.idle_ttl_seconds is None or now - session.last_access <= self.idle_ttl_seconds:
+                break
+            expired.append(sessions.popitem(last=False)[1])
+        return expired
 
     def get_or_create(self, user_id):
-        with self.lock:
-            if user_id not in self.sessions:
-                self.sessions[user_id] = Session(user_id)
-            return self.sessions[user_id]
+        lock, sessions = self._stripe(user_id)
+        now = time.monotonic()
+        evicted = []
+        with lock:
+            expired = self._expire(sessions, now)
+            session = sessions.get(user_id)
+            if session is None:
+                session = Session(user_id, max_history=self.max_history)
+                sessions[user_id] = session
+                self._count("created")
+                while len(sessions) > self.max_sessions_per_stripe:
+                    evicted.append(sessions.popitem(last=False)[1])
+            else:
+                sessions.move_to_end(user_id)
+            session.last_access = now
+        self._count("expired", len(expired))
+        self._count("evicted", len(evicted))
+        self._notify(expired + evicted)
+        return session
+
+    def get(self, user_id):
+        lock, sessions = self._stripe(user_id)
+        with lock:
+            return sessions.get(user_id)
+
+    def get_messages(self, user_id):
+        session = self.get(user_id)
+        return session.get_messages() if session is not None else []
+
+    def remove(self, user_id):
+        lock, sessions = self._stripe(user_id)
+        with lock:
+            session = sessions.pop(user_id, None)
+        if session is not None:
+            self._count("removed")
+            self._notify([session])
+        return session
+
+    def evict_expired(self):
+        """
+        Sweep all stripes for idle sessions, e.g. from a periodic task
+        """
+        now = time.monotonic()
+        expired = []
+        for lock, sessions in self.stripes:
+            with lock:
+                expired.extend(self._expire(sessions, now))
+        self._count("expired", len(expired))
+        self._notify(expired)
+        return len(expired)
+
+    def __len__(self):
+        return sum(len(sessions) for _, sessions in self.stripes)
+
+    def stats(self):
+        with self.counters_lock:
+            return {"sessions": len(self), "stripes": self.num_stripes, **self.counters}
@@ -0,0 +1,96 @@
+from functools import lru_cache
+from typing import List, Optional
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from app.core.constants import INDEX_CONFIG_FILE
+from app.core.checkpointer import DEFAULT_CHECKPOINT_DB
+
+
+class Settings(BaseSettings):
+    """
+    Service configuration, every field is read from the environment variable of the same name in upper case or from
+    the .env file
+    """
+
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+    gemini_api_key: Optional[str] = None
+    email_address: Optional[str] = None
+    email_password: Optional[str] = None
+    # Mail server of the quiz emails, a local stand-in such as aiosmtpd needs smtp_starttls off and no password
+    smtp_host: str = "smtp.gmail.com"
+    smtp_port: int = 587
+    smtp_starttls: bool = True
+    smtp_timeout_seconds: float = 30.0
+    # Jobs sent over one SMTP connection, and how long and how many finished jobs are kept for their status
+    mail_batch_size: int = 20
+    mail_job_ttl_seconds: int = 3600
+    mail_max_jobs: int = 10000
+
+    # In-memory quiz PDFs, served by /chat/quiz and attached to the quiz emails
+    quiz_artifact_max_bytes: int = 5_000_000
+    quiz_artifact_max_total_bytes: int = 256_000_000
+    quiz_artifact_ttl_seconds: int = 3600
+
+    # Model backends, "fake", "hashing" and "lexical" are deterministic local stand-ins for benchmarks and load tests
+    llm_provider: str = "google"
+    embedding_provider: str = "google"
+    rerank_provider: str = "flashrank"
+    fake_llm_latency_seconds: float = 0.0
+    fake_llm_jitter_seconds: float = 0.0
+    hashing_embedding_dimensions: int = 768
+
+    # Milvus Lite file or server URI shared by the API, the ingestion and the admin scripts. Read from
+    # IP_TUTOR_MILVUS_URI, pymilvus reads MILVUS_URI itself on import and only accepts server URIs there
+    milvus_uri: str = Field(default="./milvus_db.db", validation_alias="IP_TUTOR_MILVUS_URI")
+    milvus_token: str = ""
+    milvus_db_name: str = ""
+    milvus_warm_up: bool = True
+    index_config_file: str = INDEX_CONFIG_FILE
+
+    # "background" serves the health endpoints while the services are built, "blocking" builds them before serving
+    startup_mode: str = "background"
+    # Queries run through retrieval and reranking once the services are built, a JSON list in the environment
+    warm_up_queries: List[str] = []
+
+    embedding_cache_max_entries: int = 10000
+    embedding_cache_path: Optional[str] = None
+
+    semantic_cache_enabled: bool = False
+    semantic_cache_threshold: float = 0.95
+    semantic_cache_max_entries: int = 1024
+    semantic_cache_ttl_seconds: int = 3600
+
+    checkpointer_backend: str = "memory"
+    checkpointer_path: str = DEFAULT_CHECKPOINT_DB
+    checkpointer_max_threads: int = 1000
+    checkpointer_ttl_seconds: int = 3600
+    checkpointer_max_checkpoints: int = 5
+
+    session_idle_ttl_seconds: int = 3600
+    session_max_sessions: int = 10000
+    session_max_history: int = 50
+
+    graph_mode: str = "sequential"
+    retriever_type: str = "ensemble"
+    search_mode: str = "hybrid"
+    hybrid_ranker: str = "rrf"
+    rerank_mode: str = "always"
+    rerank_top_n: int = 3
+    grading_mode: str = "serial"
+    # Concurrent grading starts the web search speculatively when fewer documents are retrieved or the top rerank
+    # score is lower than these
+    speculative_min_documents: int = 3
+    speculative_score_threshold: float = 0.5
+    context_max_tokens: int = 6000
+    context_history_window: int = 6
+    retrieval_dedupe_threshold: float = 0.85
+
+    # Upper bounds of a /chat/batch request
+    batch_max_concurrency: int = 8
+    batch_max_questions: int = 1000
+
+
+@lru_cache(maxsize=1)
+def get_settings():
+    return Settings()
@@ -1,9 +1,34 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from app.core.container import get_service_container, STARTUP_MODES
 from app.routers.chat_routes import router as chat_router
+from app.routers.health_routes import router as health_router
+from app.routers.metrics_routes import router as metrics_router
 
-app = FastAPI(title="IP Agent API (Modular)", version="2.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    services = get_service_container()
+    if services.settings.startup_mode not in STARTUP_MODES:
+        raise ValueError(f"Unsupported startup mode {services.settings.startup_mode}, expected one of {STARTUP_MODES}")
+    startup = None
+    if services.settings.startup_mode == "blocking":
+        await services.astart()
+    else:
+        # Served right away, /health/ready reports 503 until the services are built
+        startup = asyncio.create_task(services.astart())
+    yield
+    if startup is not None and not startup.done():
+        await startup
+    services.close()
+
+
+app = FastAPI(title="IP Agent API (Modular)", version="2.0", lifespan=lifespan)
 
 app.include_router(chat_router)
+app.include_router(health_router)
+app.include_router(metrics_router)
 
 
 @app.get("/")
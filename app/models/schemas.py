@@ -28,6 +28,8 @@ class ChatRequest(BaseModel):
     user_id: str
     query: str
     message_id: str
+    # Return the per-node timings, LLM calls, tokens and retriever hits of the request in ChatResponse.timings
+    include_timings: bool = False
 
 
 class SourceDoc(BaseModel):
@@ -61,6 +63,11 @@ class ChatResponse(BaseModel):
     message_id: str
     timestamp: str
     content: List[ContentItem]
+    # Download link of the quiz PDF generated in this turn
+    quiz: Optional[QuizItem] = None
+    # Delivery job of the quiz email queued in this turn, its status is served by /chat/mail/{job_id}
+    mail_job_id: Optional[str] = None
+    timings: Optional[Dict[str, Any]] = None
 
 
 class QuestionValidator(BaseModel):
@@ -73,3 +80,11 @@ class QuizTopicValidator(BaseModel):
 
 class WebSearchRequired(BaseModel):
     web_search_required: bool = Field(description="Flag for marking if web-search is valid or not")
+
+
+class Triage(BaseModel):
+    generate_quiz: bool = Field(description="Flag for marking if the user is asking to generate a quiz")
+    valid_question: bool = Field(description="Flag for marking if question is valid or not")
+    valid_quiz_topic: bool = Field(description="Flag for marking if quiz topic is valid or not")
+    web_search_required: bool = Field(description="Flag for marking if web-search is valid or not")
+    send_email: bool = Field(description="Flag for marking if the user is asking to email the generated quiz")
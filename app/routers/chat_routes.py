@@ -1,42 +1,339 @@
+import json
+import asyncio
 import logging
-from fastapi import APIRouter
-from app.models.schemas import ChatResponse, ChatRequest
-from app.services.llm_service import LLM
-from langchain_core.messages import AIMessage, HumanMessage
-from app.services.embedding_service import Embedding
-from app.services.agentic_workflow_service import IPAgenticWorkflow
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
+from datetime import datetime, timezone
+from fastapi.responses import Response, StreamingResponse
+from app.models.schemas import ChatResponse, ChatRequest, QuizResponse, QuizItem
+from app.core.container import get_service_container
+from app.services.rerank_service import rerank_stats
+from app.services.batch_service import BatchRunner, read_questions
+from app.services.instrumentation_service import InstrumentationHandler
+from app.services.agentic_workflow_service import ANSWER_GENERATION_TAG
 
 logging.getLogger().setLevel(level=logging.INFO)
 
-router = APIRouter(prefix="/chat", tags=["chat"])
-llm_obj = LLM(model_name="gemini-2.0-flash")
-embedding_obj = Embedding()
-flow_obj = IPAgenticWorkflow(llm=llm_obj.get_llm(),
-                             embedding=embedding_obj.create_embeddings(embedding_model="models/text-embedding-004"))
-flow = flow_obj.compile_workflow()
-
-
-def generate_response(query, user_id, message_id):
-    response = {}
-    if "bye" in query.lower() or "exit" in query.lower() or "quit" in query.lower():
-        resp = {"generation": "Bye! have a great day ahead!!"}
-        response = flow_obj.interact(response=resp, user_id=user_id, message_id=message_id)
-        flow_obj.end_langgraph_session()
-    else:
-        for event in flow.stream(
+
+def require_services():
+    if services.state == "failed":
+        raise HTTPException(status_code=503, detail="Service failed to start.")
+    if not services.ready:
+        raise HTTPException(status_code=503, detail="Service is starting, please retry shortly.")
+
+
+router = APIRouter(prefix="/chat", tags=["chat"], dependencies=[Depends(require_services)])
+services = get_service_container()
+
+
+def is_end_of_conversation(query):
+    return "bye" in query.lower() or "exit" in query.lower() or "quit" in query.lower()
+
+
+def end_conversation(session, user_id, message_id):
+    resp = {"generation": "Bye! have a great day ahead!!"}
+    response = services.flow_obj.interact(response=resp, user_id=user_id, message_id=message_id)
+    # Removing the session also clears its checkpointer thread through on_evict
+    services.session_manager.remove(user_id)
+    return response
+
+
+def record_turn(session, query, response, message_id):
+    session.add_message(role="user", message_id=message_id, text=query)
+    session.add_message(role="assistant", message_id=message_id, text=response["content"][0]["text"])
+
+
+def instrumented_config(session, handler):
+    """
+    Session config with the instrumentation handler of the request, which feeds the Prometheus metrics
+    """
+    return {**session.get_config(), "callbacks": [handler]}
+
+
+async def latest_checkpoint_id(config):
+    """
+    Id of the last checkpoint of a session thread, None when the thread has none
+    """
+    snapshot = await services.flow.aget_state(config)
+    return (snapshot.config or {}).get("configurable", {}).get("checkpoint_id")
+
+
+async def correct_response(session, state, user_id, message_id, checkpoint_id):
+    """
+    Grade an answer which was already returned to the user, used with the deferred grading mode
+
+    When the answer is graded as not useful it is regenerated with web results, written back to the checkpointer
+    thread and recorded as a new assistant message of the session. The correction is dropped when the thread moved
+    past the graded turn meanwhile, e.g. the user already sent the next message.
+
+    Args:
+        checkpoint_id (str): Last checkpoint of the thread when the graded turn ended
+
+    Returns:
+        dict: Corrected response, None when the delivered answer stands
+    """
+    config = session.get_config()
+    corrected = await asyncio.to_thread(services.flow_obj.grade_and_correct, state, config)
+    if corrected is None:
+        return None
+    if await latest_checkpoint_id(config) != checkpoint_id:
+        logging.info("---DROPPING CORRECTION, THE CONVERSATION MOVED ON---")
+        return None
+    await services.flow.aupdate_state(config, {"generation": corrected["generation"]})
+    response = services.flow_obj.interact(response=corrected, user_id=user_id, message_id=message_id)
+    session.add_message(role="assistant", message_id=message_id, text=response["content"][0]["text"])
+    return response
+
+
+async def agenerate_response(query, user_id, message_id, background_tasks=None, include_timings=False):
+    """
+    Answer one chat turn
+
+    Every user runs on their own checkpointer thread, so graphs of different users can run concurrently on
+    the same event loop without sharing conversation state.
+    """
+    session = services.session_manager.get_or_create(user_id)
+    if is_end_of_conversation(query):
+        return end_conversation(session=session, user_id=user_id, message_id=message_id)
+
+    handler = InstrumentationHandler()
+    state = await services.flow.ainvoke(
+        {"messages": [
+            {"role": "user",
+             "content": query}]},
+        instrumented_config(session=session, handler=handler)
+    )
+    response = services.flow_obj.interact(response=state, user_id=user_id, message_id=message_id)
+    record_turn(session=session, query=query, response=response, message_id=message_id)
+    if include_timings:
+        response["timings"] = handler.stats()
+    if services.flow_obj.grading_mode == "deferred":
+        checkpoint_id = await latest_checkpoint_id(session.get_config())
+        if background_tasks is not None:
+            background_tasks.add_task(correct_response, session=session, state=state, user_id=user_id,
+                                      message_id=message_id, checkpoint_id=checkpoint_id)
+        else:
+            response = await correct_response(session=session, state=state, user_id=user_id, message_id=message_id,
+                                              checkpoint_id=checkpoint_id) or response
+    return response
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class AnswerStream:
+    """
+    Turns the answer tokens of the generate node into the text shown to the user.
+
+    The RAG prompt makes the model reason first and put the answer after an "Answer:" marker, only the text after
+    the marker is forwarded. A new message id means generate ran again after a failed grading.
+    """
+
+    def __init__(self):
+        self.message_id = None
+        self.buffer = ""
+        self.offset = None
+        self.sent = False
+
+    def feed(self, message_id, token):
+        events = []
+        if message_id != self.message_id:
+            if self.sent:
+                events.append(("restart", {}))
+            self.message_id = message_id
+            self.buffer = ""
+            self.offset = None
+            self.sent = False
+        self.buffer += token
+        if self.offset is None:
+            marker = self.buffer.find("Answer:")
+            if marker == -1:
+                return events
+            self.offset = marker + len("Answer:")
+        text = self.buffer[self.offset:]
+        if not self.sent:
+            text = text.lstrip()
+        if text:
+            self.offset = len(self.buffer)
+            self.sent = True
+            events.append(("token", {"text": text}))
+        return events
+
+
+async def stream_response(query, user_id, message_id, include_timings=False):
+    """
+    Server-sent events for one chat turn
+
+    "token" events carry answer text as it is generated, "restart" tells the client to discard the streamed text
+    because the answer is being regenerated, and the "final" event carries the ChatResponse, whose text is
+    authoritative. With deferred grading the answer is graded after "final" and a "correction" event carrying the
+    regenerated ChatResponse closes the stream when the delivered answer was not useful.
+    """
+    session = services.session_manager.get_or_create(user_id)
+    if is_end_of_conversation(query):
+        response = end_conversation(session=session, user_id=user_id, message_id=message_id)
+        yield format_sse("final", ChatResponse(**response).model_dump(exclude_none=True))
+        return
+
+    answer_stream = AnswerStream()
+    state = {}
+    handler = InstrumentationHandler()
+    try:
+        async for mode, chunk in services.flow.astream(
                 {"messages": [
                     {"role": "user",
                      "content": query}]},
-                flow_obj.config,
-                stream_mode="values"
+                instrumented_config(session=session, handler=handler),
+                stream_mode=["messages", "values"]
         ):
-            response = flow_obj.interact(response=event, user_id=user_id, message_id=message_id)
-            flow_obj.chat_history.extend([HumanMessage(query), AIMessage(response["content"][0]["text"])])
+            if mode == "values":
+                state = chunk
+                continue
+            message, metadata = chunk
+            if ANSWER_GENERATION_TAG not in metadata.get("tags", []):
+                continue
+            for event, data in answer_stream.feed(message.id, message.content):
+                yield format_sse(event, data)
+    except Exception as err_msg:
+        logging.error(f"Error streaming response: {err_msg}")
+        yield format_sse("error", {"detail": "Unable to process request right now. Please try after some time."})
+        return
 
-    return response
+    response = services.flow_obj.interact(response=state, user_id=user_id, message_id=message_id)
+    record_turn(session=session, query=query, response=response, message_id=message_id)
+    if include_timings:
+        response["timings"] = handler.stats()
+    checkpoint_id = None
+    if services.flow_obj.grading_mode == "deferred":
+        # Taken before "final" is sent, the client may send the next message as soon as it gets it
+        checkpoint_id = await latest_checkpoint_id(session.get_config())
+    yield format_sse("final", ChatResponse(**response).model_dump(exclude_none=True))
 
+    if services.flow_obj.grading_mode == "deferred":
+        try:
+            corrected = await correct_response(session=session, state=state, user_id=user_id, message_id=message_id,
+                                               checkpoint_id=checkpoint_id)
+        except Exception as err_msg:
+            logging.error(f"Error grading delivered response: {err_msg}")
+            return
+        if corrected is not None:
+            yield format_sse("correction", ChatResponse(**corrected).model_dump(exclude_none=True))
 
-@router.post("/", response_model=ChatResponse)
-def chat(req: ChatRequest):
-    generated_response = generate_response(query=req.query, user_id=req.user_id, message_id=req.message_id)
+
+@router.post("/", response_model=ChatResponse, response_model_exclude_none=True)
+async def chat(req: ChatRequest, background_tasks: BackgroundTasks):
+    generated_response = await agenerate_response(query=req.query, user_id=req.user_id, message_id=req.message_id,
+                                                  background_tasks=background_tasks,
+                                                  include_timings=req.include_timings)
     return ChatResponse(**generated_response)
+
+
+@router.post("/stream")
+async def chat_stream(req: ChatRequest):
+    return StreamingResponse(stream_response(query=req.query, user_id=req.user_id, message_id=req.message_id,
+                                             include_timings=req.include_timings),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.post("/batch")
+async def chat_batch(request: Request, max_concurrency: int = None):
+    """
+    Answer the questions of a JSONL request body, one {"id", "question"} object per line, as independent
+    conversations. Results are streamed back as JSON lines as soon as each question is answered.
+    """
+    try:
+        questions = read_questions((await request.body()).decode("utf-8").splitlines())
+    except ValueError as err_msg:
+        raise HTTPException(status_code=400, detail=f"Invalid JSONL body: {err_msg}")
+    limit = services.settings.batch_max_questions
+    if len(questions) > limit:
+        raise HTTPException(status_code=413, detail=f"At most {limit} questions per batch.")
+    max_concurrency = min(max_concurrency or services.settings.batch_max_concurrency,
+                          services.settings.batch_max_concurrency)
+    runner = BatchRunner(flow_obj=services.flow_obj, flow=services.flow, max_concurrency=max_concurrency)
+
+    async def results():
+        async for result in runner.astream(questions):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@router.get("/cache/stats")
+def cache_stats():
+    if services.semantic_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **services.semantic_cache.stats()}
+
+
+@router.get("/retriever/stats")
+def retriever_stats():
+    if not hasattr(services.flow_obj.retriever, "latency_stats"):
+        return {"retriever_type": "ensemble"}
+    return {"retriever_type": "fusion", "latency": services.flow_obj.retriever.latency_stats()}
+
+
+@router.get("/rerank/stats")
+def reranker_stats():
+    return rerank_stats()
+
+
+@router.get("/sessions/stats")
+def sessions_stats():
+    return services.session_manager.stats()
+
+
+@router.get("/checkpointer/stats")
+def checkpointer_stats():
+    return services.checkpointer.stats()
+
+
+@router.get("/context/stats")
+def context_stats():
+    return services.flow_obj.context_builder.stats()
+
+
+@router.get("/milvus/stats")
+def milvus_stats():
+    return services.milvus_registry.stats()
+
+
+@router.get("/mail/stats")
+def mail_stats():
+    return services.mail_dispatcher.stats()
+
+
+@router.get("/mail/{job_id}")
+def mail_status(job_id: str):
+    status = services.mail_dispatcher.get_job(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired mail job.")
+    return status
+
+
+@router.get("/artifacts/stats")
+def artifact_stats():
+    return services.artifact_store.stats()
+
+
+@router.get("/quiz/{user_id}", response_model=QuizResponse)
+def latest_quiz(user_id: str):
+    # The conversation thread of a user is its user id, see SessionManager
+    artifact = services.artifact_store.latest(user_id)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="No quiz generated in this conversation.")
+    return QuizResponse(user_id=user_id, message_id=artifact.content_hash,
+                        timestamp=datetime.fromtimestamp(artifact.stored_at, tz=timezone.utc).isoformat(),
+                        content=[QuizItem(status="ready", uri=artifact.uri, meta=artifact.meta())])
+
+
+# Starlette routes on the decoded path, thread ids containing "/" are matched by the path parameter and the hash is
+# always the last segment
+@router.get("/quiz/{thread_id:path}/{quiz_hash}")
+def download_quiz(thread_id: str, quiz_hash: str):
+    artifact = services.artifact_store.get(thread_id, quiz_hash)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired quiz.")
+    return Response(content=artifact.content, media_type=artifact.media_type,
+                    headers={"Content-Disposition": f'attachment; filename="{artifact.filename}"'})
@@ -0,0 +1,17 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.core.container import get_service_container
+
+router = APIRouter(prefix="/health", tags=["health"])
+
+
+@router.get("/live")
+def live():
+    return {"status": "ok"}
+
+
+@router.get("/ready")
+def ready():
+    # 503 until the services are built, load balancers and autoscalers only route traffic to ready instances
+    status = get_service_container().status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics")
+def metrics():
+    # Prometheus text format, node latency, LLM calls, tokens, cost and retriever hits of every graph run
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,15 +1,17 @@
 import json
-import os
 import warnings
 import ast
+import contextvars
 from fpdf import FPDF
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.tools import Tool
 from langchain.agents import create_react_agent, AgentExecutor
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 from app.services.service_interface import GenericAgent
+from app.services.provider_service import get_llm
+from app.services.instrumentation_service import span
+from app.services.artifact_service import get_artifact_store, content_hash
 from app.models.schemas import Quiz, NumQuestions, DifficultyLevel
 from app.core.constants import QUIZ_AGENT_PROMPT, NUM_QUESTIONS_IDENTIFIER_PROMPT, DIFFICULTY_LEVEL_IDENTIFIER_PROMPT, \
     GENERATE_QUIZ_PROMPT
@@ -18,55 +20,72 @@ from app.utils.utility import format_docs
 warnings.filterwarnings("ignore")
 load_dotenv()
 
+# Thread of the conversation the agent is generating a quiz for, read by the create_pdf tool, which only receives
+# the text the LLM passes to it
+QUIZ_THREAD_ID = contextvars.ContextVar("quiz_thread_id", default=None)
+
 
 class IpQuizAgent(GenericAgent):
-    def __init__(self, retriever, model):
+    def __init__(self, retriever, model, artifact_store=None):
         super().__init__()
         self.retriever = retriever
-        self.llm = ChatGoogleGenerativeAI(
-            model=model,
-            reasoning_effort="none",
-            google_api_key=os.getenv('GEMINI_API_KEY')
-
-        )
+        self.artifact_store = artifact_store or get_artifact_store()
+        self.llm = get_llm(model=model, reasoning_effort="none")
         self.prompt = PromptTemplate.from_template(template=QUIZ_AGENT_PROMPT)
         self.retrieval_tool = None
         self.agent_executor = None
         self.generate_quiz_tool = None
         self.write_as_pdf_tool = None
-        self.difficulty_level = None
-        self.num_questions = None
         self.tools = []
         self.create_tools()
         self.create_agent()
 
     @staticmethod
-    def write_to_pdf(text_content):
-        """
-           Tool that can be used by the LLM to generate PDF from the  input text_content.
-        """
-        print(text_content)
-        print(type(text_content))
-
-        script_dir = os.path.dirname(__file__)
-        op_file = '/'.join(script_dir.split("/")[:-2]) + '/' + "outputs/QUIZ.pdf"
+    def parse_quiz(text_content):
         try:
             text_content = ast.literal_eval(text_content)
         except SyntaxError:
             text_content = text_content.split("text_content=")[1]
             text_content = ast.literal_eval(text_content)
+        text_content.pop('output_filename', None)
+        return text_content
+
+    @staticmethod
+    def render_pdf(text_content):
+        """
+        Render the quiz into an in-memory PDF
+
+        Returns:
+            bytes: PDF document
+        """
         pdf = FPDF()
         pdf.add_page()
         pdf.set_font("Arial", size=6)
-        if 'output_filename' in text_content:
-            del text_content['output_filename']
         # Split the text into lines and add each line to the PDF
         for key, value in text_content.items():
             if key == "answer_key":
                 pdf.cell(0, 10, txt=key, ln=True)
             for line in value.split('\n'):
                 pdf.cell(0, 10, txt=line, ln=True)  # 0 for full width, 10 for line height, ln=True for new line
-        pdf.output(op_file)
+        # fpdf 1.7 returns the document as a latin-1 string
+        return pdf.output(dest="S").encode("latin-1")
+
+    def write_to_pdf(self, text_content):
+        """
+           Tool that can be used by the LLM to generate PDF from the  input text_content.
+           The PDF is stored in the artifact store under the thread of the conversation and the hash of the quiz, a
+           quiz already rendered for the thread is not rendered again.
+        """
+        text_content = self.parse_quiz(text_content)
+        thread_id = QUIZ_THREAD_ID.get() or "default"
+        quiz_hash = content_hash(text_content)
+        with span("write_quiz_pdf", thread_id=thread_id, quiz_hash=quiz_hash) as attributes:
+            artifact = self.artifact_store.get(thread_id, quiz_hash)
+            attributes["rendered"] = artifact is None
+            content = artifact.content if artifact is not None else self.render_pdf(text_content)
+            artifact = self.artifact_store.put(thread_id, quiz_hash, content)
+            attributes["bytes"] = artifact.size
+        return f"PDF created, it can be downloaded from {artifact.uri}"
 
     def identify_num_questions(self, query):
         """
@@ -140,14 +159,21 @@ class IpQuizAgent(GenericAgent):
                                                                  handle_parsing_errors=True)
 
     def invoke_agent(self, query, thread_id='1234', documents=None):
-
-        self.num_questions = self.identify_num_questions(query=query)
-        self.difficulty_level = self.identify_difficulty_level(query=query)
+        token = QUIZ_THREAD_ID.set(thread_id)
+        try:
+            return self.run_agent(query=query, thread_id=thread_id, documents=documents)
+        finally:
+            QUIZ_THREAD_ID.reset(token)
+
+    def run_agent(self, query, thread_id, documents=None):
+        # Locals, the agent is shared by concurrent quiz requests
+        num_questions = self.identify_num_questions(query=query)
+        difficulty_level = self.identify_difficulty_level(query=query)
         if documents:
             response = self.agent_executor.invoke(
-                {"input": query, "docs": format_docs(documents), "num_questions": self.num_questions,
-                 "difficulty_level": self.difficulty_level, "thread_id": thread_id})
+                {"input": query, "docs": format_docs(documents), "num_questions": num_questions,
+                 "difficulty_level": difficulty_level, "thread_id": thread_id})
         else:
-            response = self.agent_executor.invoke({"input": query, "num_questions": self.num_questions,
-                                                   "difficulty_level": self.difficulty_level, "thread_id": thread_id})
+            response = self.agent_executor.invoke({"input": query, "num_questions": num_questions,
+                                                   "difficulty_level": difficulty_level, "thread_id": thread_id})
         return response["output"]
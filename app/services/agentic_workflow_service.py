@@ -1,21 +1,17 @@
-import os
 import re
 import json
+import time
 import logging
 import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from typing_extensions import TypedDict
 from typing import List, Annotated
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.graph import END, StateGraph
 from langchain_core.prompts import MessagesPlaceholder
-from langgraph.checkpoint.memory import InMemorySaver
-from langchain_core.runnables import RunnablePassthrough
+from operator import itemgetter
+from langchain_core.runnables import RunnablePassthrough, RunnableParallel, RunnableLambda
 from langchain_core.messages import AnyMessage
 from langgraph.graph.message import add_messages
 from langchain_tavily import TavilySearch
@@ -24,21 +20,30 @@ from langchain_core.output_parsers import StrOutputParser
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.prompts import PromptTemplate
 from langchain_core.prompts import ChatPromptTemplate, FewShotChatMessagePromptTemplate
-from langchain_community.document_compressors import FlashrankRerank
 from langchain.retrievers import ContextualCompressionRetriever
+from langchain.retrievers.document_compressors import DocumentCompressorPipeline
 from app.models.schemas import QuestionValidator, QuizTopicValidator, WebSearchRequired, RelevantDocsExists, \
-    GenerateContextualizedQuiz
+    GenerateContextualizedQuiz, Triage
 from app.utils.utility import get_interim_retrievers, format_docs
 from app.core.constants import EXAMPLES, RETRIEVER_PROMPT, HALLUCINATION_GRADER_PROMPT, ANSWER_GRADER_PROMPT, \
     QUESTION_VALIDATOR_PROMPT, QUIZ_VALIDATOR_PROMPT, QUESTION_ROUTER_PROMPT, QUIZ_ROUTER_PROMPT, \
-    CONTEXTUALIZE_QUESTION_PROMPT, RELEVANT_DOC_CHECKER_PROMPT, MAIL_SUBJECT, MAIL_BODY, QUIZ_TYPE_EVALUATOR_PROMPT
+    CONTEXTUALIZE_QUESTION_PROMPT, RELEVANT_DOC_CHECKER_PROMPT, MAIL_SUBJECT, MAIL_BODY, QUIZ_TYPE_EVALUATOR_PROMPT, \
+    TRIAGE_PROMPT, TARGET_COLLECTIONS
 from app.services.agent_service import IpQuizAgent
+from app.services.provider_service import get_llm
+from app.services.instrumentation_service import span
+from app.services.mail_service import get_mail_dispatcher
+from app.services.rag_service import FusionRetriever
+from app.services.rerank_service import SharedRerank, score_pairs
+from app.services.context_service import ContextBuilder
+from app.utils.chunking import NearDuplicateCompressor
+from app.core.checkpointer import create_checkpointer
 from app.services.service_interface import GenericAgentWorkflow
 
-SMTP_SERVER = 'smtp.gmail.com'
-SMTP_PORT = 587
-EMAIL_ADDRESS = os.getenv('EMAIL_ADDRESS')
-EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
+ANSWER_GENERATION_TAG = "answer_generation"
+GRAPH_MODES = ("sequential", "parallel", "triage")
+RETRIEVER_TYPES = ("ensemble", "fusion")
+GRADING_MODES = ("serial", "concurrent", "deferred")
 
 
 class GraphState(TypedDict):
@@ -56,35 +61,77 @@ class GraphState(TypedDict):
     generate_quiz: bool
     relevant_docs_exist: bool
     generate_contextualized_quiz: bool
+    send_email: bool
+    mail_job_id: str
+    quiz_uri: str
+    cache_hit: bool
+    answered_by_rag: bool
+    weak_retrieval: bool
+    standalone_question: str
     documents: List[str]
 
 
+# Per-turn fields, cleared by the entry node of every graph so a turn never reports the quiz, email or RAG answer of
+# an earlier turn restored from the checkpointer
+TURN_STATE_RESET = {"answered_by_rag": False, "quiz_uri": None, "mail_job_id": None, "weak_retrieval": False}
+
+
 class IPAgenticWorkflow(GenericAgentWorkflow):
-    def __init__(self, embedding, llm, agent_model="gemini-2.5-pro", weights=[0.7, 0.2, 0.1]):
+    def __init__(self, embedding, llm, agent_model="gemini-2.5-pro", weights=[0.7, 0.2, 0.1], graph_mode="sequential",
+                 semantic_cache=None, retriever_type="ensemble", search_mode="hybrid", ranker_type="rrf",
+                 ranker_params=None, rerank_mode="always", rerank_top_n=3, grading_mode="serial",
+                 context_max_tokens=6000, history_window=6, checkpointer=None, session_manager=None,
+                 dedupe_threshold=0.85, index_config=None, milvus_uri=None, mail_dispatcher=None,
+                 artifact_store=None, speculative_min_documents=3, speculative_score_threshold=0.5):
         super().__init__()
+        if graph_mode not in GRAPH_MODES:
+            raise ValueError(f"Unsupported graph mode {graph_mode}, expected one of {GRAPH_MODES}")
+        if retriever_type not in RETRIEVER_TYPES:
+            raise ValueError(f"Unsupported retriever type {retriever_type}, expected one of {RETRIEVER_TYPES}")
+        if grading_mode not in GRADING_MODES:
+            raise ValueError(f"Unsupported grading mode {grading_mode}, expected one of {GRADING_MODES}")
+        self.grading_mode = grading_mode
+        # A retrieval leaving fewer documents or a lower top rerank score is weak, its answer likely fails grading and
+        # the web search is started speculatively in concurrent grading mode
+        self.speculative_min_documents = speculative_min_documents
+        self.speculative_score_threshold = speculative_score_threshold
+        self.graph_mode = graph_mode
+        self.semantic_cache = semantic_cache
         self.embedding = embedding
-        self.retriever = EnsembleRetriever(
-            retrievers=get_interim_retrievers(ip_embedding=embedding),
-            weights=weights
-        )
-        self.agent = IpQuizAgent(retriever=self.retriever, model=agent_model)
+        interim_retrievers = get_interim_retrievers(ip_embedding=embedding, target_collections=TARGET_COLLECTIONS,
+                                                    search_mode=search_mode, ranker_type=ranker_type,
+                                                    ranker_params=ranker_params, index_config=index_config,
+                                                    uri=milvus_uri)
+        if retriever_type == "fusion":
+            self.retriever = FusionRetriever(
+                retrievers=list(interim_retrievers),
+                names=TARGET_COLLECTIONS,
+                weights=weights
+            )
+        else:
+            self.retriever = EnsembleRetriever(
+                retrievers=interim_retrievers,
+                weights=weights
+            )
+        # Quiz PDFs are kept in memory per conversation thread, the agent renders them and send_email attaches them
+        self.agent = IpQuizAgent(retriever=self.retriever, model=agent_model, artifact_store=artifact_store)
+        self.artifact_store = self.agent.artifact_store
         examples = EXAMPLES
         example_prompt = ChatPromptTemplate.from_messages([
             ("human", "{question}"),
             ("ai", "{answer}")
         ])
-        self.compressor = FlashrankRerank()
+        # Near-duplicate passages, e.g. overlapping chunks or the same passage found in several collections, are
+        # dropped before they reach the reranker and the prompts
+        self.near_duplicate_filter = NearDuplicateCompressor(threshold=dedupe_threshold) if dedupe_threshold else None
+        self.compressor = SharedRerank(top_n=rerank_top_n, rerank_mode=rerank_mode)
         few_shot_prompt = FewShotChatMessagePromptTemplate(
             example_prompt=example_prompt,
             examples=examples
         )
         self.llm = llm
-        self.expert_llm = ChatGoogleGenerativeAI(
-            model=agent_model,
-            reasoning_effort="none",
-            google_api_key=os.getenv('GEMINI_API_KEY'))
-        self.compression_retriever = ContextualCompressionRetriever(base_compressor=self.compressor,
-                                                                    base_retriever=self.retriever)
+        self.expert_llm = get_llm(model=agent_model, reasoning_effort="none")
+        self.compression_retriever = None
 
         self.prompt = ChatPromptTemplate.from_messages([("system", RETRIEVER_PROMPT
                                                          ), ("placeholder", "{chat_history}"), few_shot_prompt,
@@ -108,6 +155,8 @@ class IPAgenticWorkflow(GenericAgentWorkflow):
 
         self.answer_grader = answer_grader_prompt | self.llm | JsonOutputParser()
 
+        self.parallel_graders = RunnableParallel(hallucination=self.hallucination_grader, answer=self.answer_grader)
+
         question_validator_prompt = PromptTemplate(template=QUESTION_VALIDATOR_PROMPT, input_variables=["question"])
 
         self.question_validator = question_validator_prompt | self.llm | JsonOutputParser(
@@ -147,19 +196,49 @@ class IPAgenticWorkflow(GenericAgentWorkflow):
         self.relevant_doc_checker = relevant_doc_checker_prompt | self.llm | JsonOutputParser(
             pydantic_object=RelevantDocsExists)
 
+        # Classifiers which only depend on the incoming question and the state of the previous turn.
+        # Used by the parallel graph to run them, together with the vector retrieval, in a single fan-out.
+        self.parallel_classifier = RunnableParallel(
+            generate_quiz=self.quiz_router,
+            valid_question=self.question_validator,
+            relevant_docs_exist=RunnableLambda(self.check_relevant_docs),
+            retrieved_documents=itemgetter("question") | self.retriever,
+        )
+
+        # Single structured-output call replacing quiz_router, question_validator, quiz_topic_validator and
+        # question_router in the triage graph.
+        triage_prompt = ChatPromptTemplate.from_messages(
+            [("system", TRIAGE_PROMPT), ("placeholder", "{chat_history}"), ("human", "{question}")])
+
+        self.triage_classifier = triage_prompt | self.llm.with_structured_output(Triage)
+
         self.web_search_tool = TavilySearch(
             max_results=5,
             topic="general",
         )
+        # Web searches started speculatively while the answer is being generated and graded, keyed on thread id and
+        # question so a search left over from an earlier turn is never used for another question
+        self.background_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="speculative_web_search")
+        self.speculative_searches = {}
+        self.speculative_searches_lock = threading.Lock()
         thread_id = uuid.uuid4()
         self.thread_id = str(thread_id)
-        self.checkpointer = InMemorySaver()
+        # Bounded in-memory saver unless the caller provides one, e.g. the SQLite backed saver
+        self.checkpointer = checkpointer if checkpointer is not None else create_checkpointer()
         self.config = {"configurable": {"thread_id": self.thread_id}}
         self.workflow = None
         self.history_chain = None
         self.rag_chain = None
         self.history_aware_retriever = None
-        self.chat_history = []
+        # Per-user chat history is read from the session store, the graph messages only hold the user questions
+        self.session_manager = session_manager
+        # Background delivery of the quiz emails, shared by the workflows of the process unless one is provided
+        self.mail_dispatcher = mail_dispatcher or get_mail_dispatcher()
+        self.context_builder = ContextBuilder(llm=self.llm, max_tokens=context_max_tokens,
+                                              history_window=history_window)
+        # The RAG chain is immutable once built and shared by all concurrent requests, per-request data such as the
+        # question and chat history only flows through the chain inputs.
+        self.build_rag_chain()
 
     def build_history_aware_rag_chain(self):
         contextualize_q_prompt = ChatPromptTemplate.from_messages(
@@ -173,23 +252,64 @@ class IPAgenticWorkflow(GenericAgentWorkflow):
         self.history_chain = contextualize_q_prompt | self.llm | StrOutputParser()
 
     def build_rag_chain(self):
-        self.compression_retriever = ContextualCompressionRetriever(base_compressor=self.compressor,
+        compressor = self.compressor
+        if self.near_duplicate_filter is not None:
+            compressor = DocumentCompressorPipeline(transformers=[self.near_duplicate_filter, self.compressor])
+        self.compression_retriever = ContextualCompressionRetriever(base_compressor=compressor,
                                                                     base_retriever=self.retriever)
         self.build_history_aware_rag_chain()
         self.rag_chain = (
                 RunnablePassthrough.assign(
                     context=self.contextualized_question | self.compression_retriever | format_docs)
                 | self.prompt
-                | self.llm
+                # Tagged so that streaming consumers can tell answer tokens apart from classifier and grader calls
+                | self.llm.with_config(tags=[ANSWER_GENERATION_TAG])
                 | StrOutputParser()
         )
+        return self.rag_chain
 
     def contextualized_question(self, ip: dict):
+        if ip.get("standalone_question"):
+            return ip["standalone_question"]
         if ip.get("chat_history") or ip.get("context"):
             return self.history_chain
         else:
             return ip["question"]
 
+    def get_history(self, state, config=None):
+        """
+        Chat history preceding the current question
+
+        Both sides of the conversation are read from the user's session when there is one, the questions stored in
+        the graph state are the fallback, e.g. for threads restored by a persistent checkpointer.
+        """
+        if self.session_manager is not None:
+            messages = self.session_manager.get_messages(self.get_thread_id(config))
+            if messages:
+                return messages
+        return state["messages"][:-1]
+
+    def get_context(self, state, config=None):
+        """
+        Bounded context of the current turn, shared by all nodes through the memoized ContextBuilder
+
+        Args:
+            state (dict): The current graph state
+            config (dict): Runnable config of the run, identifying the user's session
+
+        Returns:
+            dict: chat_history, documents and their combination, within the token budget
+        """
+        session = None
+        if self.session_manager is not None:
+            session = self.session_manager.get(self.get_thread_id(config))
+        messages = session.get_messages() if session is not None else []
+        if not messages:
+            # Threads without a session history, e.g. restored by a persistent checkpointer
+            session = None
+            messages = self.get_history(state, config)
+        return self.context_builder.build(messages=messages, documents=state.get("documents", []), session=session)
+
     def validate_question(self, state):
         logging.info("--VALIDATE QUESTION--")
         question = state["messages"][-1]
@@ -215,6 +335,11 @@ class IPAgenticWorkflow(GenericAgentWorkflow):
         #         "generate_contextualized_quiz": generate_contextualized_quiz.get('generate_contextualized_quiz')}
         return state
 
+    def remove_near_duplicates(self, documents, question):
+        if self.near_duplicate_filter is None:
+            return documents
+        return self.near_duplicate_filter.compress_documents(documents, question)
+
     def retrieve(self, state):
         """
         Retrieve documents from vectorstore
@@ -230,13 +355,35 @@ class IPAgenticWorkflow(GenericAgentWorkflow):
         question = question.content
 
         # Retrieval
-        documents = self.retriever.invoke(question)
-        documents = [doc.page_content for doc in documents]
+        retrieved_documents = self.remove_near_duplicates(self.retriever.invoke(question), question)
+        documents = [doc.page_content for doc in retrieved_documents]
 
-        documents = state.get("documents", []) + state["messages"][:-1] + documents
-        return {"documents": documents}
+        documents = self.context_builder.merge_documents(state.get("documents", []), documents)
+        return {"documents": documents, "weak_retrieval": self.is_weak_retrieval(retrieved_documents, question)}
 
-    def generate(self, state):
+    def is_weak_retrieval(self, documents, question):
+        """
+        Whether the retrieved documents are unlikely to answer the question, only checked in concurrent grading mode,
+        the only one starting speculative web searches
+
+        Args:
+            documents (list): Retrieved documents left after near-duplicate removal
+            question (str): Question of the turn
+
+        Returns:
+            bool: True when too few documents are left or the best of the top reranked ones scores low
+        """
+        if self.grading_mode != "concurrent":
+            return False
+        if len(documents) < self.speculative_min_documents:
+            return True
+        # The scores are cached, the reranker of the RAG chain reuses them for the same question
+        scores = score_pairs(query=question, texts=[doc.page_content for doc in documents[:self.compressor.top_n]],
+                             model_name=self.compressor.model_name, batch_size=self.compressor.batch_size,
+                             cache_size=self.compressor.cache_size)
+        return max(scores) < self.speculative_score_threshold
+
+    def generate(self, state, config=None):
         """
         Generate answer using RAG on retrieved documents
 
@@ -249,13 +396,75 @@ class IPAgenticWorkflow(GenericAgentWorkflow):
         logging.info("---GENERATE---")
         question = state["messages"][-1]
         question = question.content
-        documents = state.get("documents", []) + state["messages"][:-1]
-        # RAG generation
-        self.build_rag_chain()
-        generation = self.rag_chain.invoke({"chat_history": documents, "question": question})
-        return {**state, "generation": generation}
+        documents = self.get_context(state, config)["combined"]
+        thread_id = self.get_thread_id(config)
+        try:
+            # RAG generation
+            if self.semantic_cache is None:
+                if self.is_borderline(state):
+                    self.start_speculative_search(question=question, thread_id=thread_id)
+                generation = self.rag_chain.invoke({"chat_history": documents, "question": question})
+                return {**state, "generation": generation, "answered_by_rag": True}
+
+            standalone_question = question
+            if documents:
+                standalone_question = self.history_chain.invoke({"chat_history": documents, "question": question})
+            cached = self.semantic_cache.lookup(standalone_question)
+            if cached:
+                # The source documents of the response are the passages the cached answer was built from
+                return {**state, "generation": cached["generation"], "documents": cached["documents"],
+                        "cache_hit": True, "answered_by_rag": True, "standalone_question": standalone_question}
+            # A cached answer is never graded, the web search is only worth starting on a miss
+            if self.is_borderline(state):
+                self.start_speculative_search(question=question, thread_id=thread_id)
+            generation = self.rag_chain.invoke({"chat_history": documents, "question": question,
+                                                "standalone_question": standalone_question})
+            return {**state, "generation": generation, "cache_hit": False, "answered_by_rag": True,
+                    "standalone_question": standalone_question}
+        except Exception:
+            # The graph stops here, the speculative search would never be consumed
+            self.pop_speculative_search(thread_id, question)
+            raise
+
+    def is_borderline(self, state):
+        """
+        An answer generated from a weak retrieval of this turn, without web results, is the one most likely to be
+        graded as not useful and sent through web_search
+        """
+        return (self.grading_mode == "concurrent" and state.get("weak_retrieval", False)
+                and not state.get("web_search_required"))
+
+    def start_speculative_search(self, question, thread_id):
+        with self.speculative_searches_lock:
+            if (thread_id, question) not in self.speculative_searches:
+                logging.info("---STARTING SPECULATIVE WEB SEARCH---")
+                self.speculative_searches[(thread_id, question)] = self.background_executor.submit(
+                    self.web_search_tool.invoke, {"query": question})
 
-    def web_search(self, state):
+    def pop_speculative_search(self, thread_id, question):
+        with self.speculative_searches_lock:
+            return self.speculative_searches.pop((thread_id, question), None)
+
+    def drop_speculative_searches(self, thread_id):
+        """
+        Cancel the speculative searches left by earlier turns of a thread, e.g. when their graph run raised or was
+        cancelled before web_search or the grading consumed them
+        """
+        with self.speculative_searches_lock:
+            stale = [key for key in self.speculative_searches if key[0] == thread_id]
+            futures = [self.speculative_searches.pop(key) for key in stale]
+        for future in futures:
+            future.cancel()
+        return len(futures)
+
+    def start_turn(self, config=None):
+        """
+        Per-turn state reset returned by the entry node of every graph
+        """
+        self.drop_speculative_searches(self.get_thread_id(config))
+        return TURN_STATE_RESET
+
+    def web_search(self, state, config=None):
         """
         Web search based on the question
 
@@ -269,20 +478,25 @@ class IPAgenticWorkflow(GenericAgentWorkflow):
         logging.info("---WEB SEARCH---")
         question = state["messages"][-1]
         question = question.content
-        documents = state.get("documents", []) + state["messages"][:-1]
 
-        # Web search
-        docs = self.web_search_tool.invoke({"query": question})
-        print(docs)
+        # Web search, reusing the search started speculatively during generation when there is one
+        thread_id = self.get_thread_id(config)
+        with span("web_search", thread_id=thread_id) as attributes:
+            speculative_search = self.pop_speculative_search(thread_id, question)
+            attributes["speculative"] = speculative_search is not None
+            if speculative_search is not None:
+                docs = speculative_search.result()
+            else:
+                docs = self.web_search_tool.invoke({"query": question})
+            attributes["results"] = len(docs["results"])
+            attributes["urls"] = [d.get("url") for d in docs["results"]]
         web_results = "\n".join([d["content"] for d in docs["results"]])
         # web_results = Document(page_content=web_results)
-        if documents is not None:
-            documents.append(web_results)
-        else:
-            documents = [web_results]
-        return {"documents": documents, "question": question}
+        documents = self.context_builder.merge_documents(state.get("documents", []), [web_results])
+        # Marks the documents as already holding web results, the regenerated answer is not borderline any more
+        return {"documents": documents, "question": question, "web_search_required": True}
 
-    def route_question(self, state):
+    def route_question(self, state, config=None):
         """
         Route question to web search or RAG.
 
@@ -292,33 +506,40 @@ class IPAgenticWorkflow(GenericAgentWorkflow):
         Returns:
             str: Next node to call
         """
-        documents = state.get("documents", []) + state["messages"][:-1]
+        documents = self.get_context(state, config)["combined"]
         question = state["messages"][-1]
         question = question.content
         is_web_search_required = self.question_router.invoke({"question": question, "documents": documents})
         return {**state, "web_search_required": is_web_search_required.get('web_search_required')}
 
-    def grade_generation_v_documents_and_question(self, state):
+    def grade_generation(self, state, config=None):
         """
-        Determines whether the generation is grounded in the document and answers question.
+        Grade the generation against the documents and the question
+
+        The hallucination and answer graders run one after the other in serial mode and concurrently otherwise.
 
         Args:
             state (dict): The current graph state
 
         Returns:
-            str: Decision for next node to call
+            str: useful, not useful or not supported
         """
-
         logging.info("---CHECK HALLUCINATIONS---")
 
         question = state["messages"][-1]
         question = question.content
-        documents = state.get("documents", []) + state["messages"][:-1]
+        documents = self.get_context(state, config)["combined"]
         generation = state["generation"]
 
-        score = self.hallucination_grader.invoke(
-            {"documents": documents, "generation": generation}
-        )
+        if self.grading_mode == "serial":
+            score = self.hallucination_grader.invoke(
+                {"documents": documents, "generation": generation}
+            )
+            answer_score = None
+        else:
+            scores = self.parallel_graders.invoke({"documents": documents, "generation": generation,
+                                                   "question": question})
+            score, answer_score = scores["hallucination"], scores["answer"]
         grade = score["score"]
 
         # Check hallucination
@@ -326,10 +547,14 @@ class IPAgenticWorkflow(GenericAgentWorkflow):
             logging.info("---DECISION: GENERATION IS GROUNDED IN DOCUMENTS---")
             # Check question-answering
             logging.info("---GRADE GENERATION vs QUESTION---")
-            score = self.answer_grader.invoke({"question": question, "generation": generation})
-            grade = score["score"]
+            if answer_score is None:
+                answer_score = self.answer_grader.invoke({"question": question, "generation": generation})
+            grade = answer_score["score"]
             if grade == "yes":
                 logging.info("---DECISION: GENERATION ADDRESSES QUESTION---")
+                if self.semantic_cache is not None:
+                    self.semantic_cache.store(state.get("standalone_question") or question, generation,
+                                              state.get("documents", []))
                 return "useful"
             else:
                 logging.info("---DECISION: GENERATION DOES NOT ADDRESS QUESTION---")
@@ -338,33 +563,90 @@ class IPAgenticWorkflow(GenericAgentWorkflow):
             logging.info("---DECISION: GENERATION IS NOT GROUNDED IN DOCUMENTS, RE-TRY---")
             return "not supported"
 
-    def choose_initial_path(self, state):
+    def grade_generation_v_documents_and_question(self, state, config=None):
+        """
+        Determines whether the generation is grounded in the document and answers question.
+
+        Args:
+            state (dict): The current graph state
+
+        Returns:
+            str: Decision for next node to call
+        """
+
+        if state.get("cache_hit"):
+            logging.info("---DECISION: ANSWER SERVED FROM SEMANTIC CACHE---")
+            return "useful"
+
+        if self.grading_mode == "deferred":
+            logging.info("---DECISION: GRADING DEFERRED UNTIL THE ANSWER IS DELIVERED---")
+            return "useful"
+
+        decision = None
+        try:
+            decision = self.grade_generation(state, config)
+        finally:
+            if decision != "not useful":
+                # The speculative search is only consumed by web_search, drop it when the graph ends here or the
+                # grading raised
+                self.pop_speculative_search(self.get_thread_id(config), state["messages"][-1].content)
+        return decision
+
+    def grade_and_correct(self, state, config=None):
+        """
+        Grade an answer which was already delivered to the user, used with the deferred grading mode
+
+        Only turns which ended at generate are graded, quizzes, refusals and email replies are delivered as they are.
+
+        Args:
+            state (dict): Final graph state of the turn
+
+        Returns:
+            state (dict): Corrected state when the answer was graded as not useful, None otherwise
+        """
+        if not state.get("answered_by_rag") or state.get("cache_hit") or not state.get("generation"):
+            return None
+        if self.grade_generation(state, config) != "not useful":
+            return None
+        logging.info("---CORRECTING DELIVERED ANSWER---")
+        state = {**state, **self.web_search(state, config)}
+        return self.generate(state, config)
+
+    def choose_initial_path(self, state, config=None):
         question = state["messages"][-1]
 
         is_generate_quiz = self.quiz_router.invoke({"question": question.content})
-        return {**state, "generate_quiz": is_generate_quiz.get("generate_quiz", False)}
+        return {**state, "generate_quiz": is_generate_quiz.get("generate_quiz", False), **self.start_turn(config)}
 
-    def make_contextual_quiz(self, state):
+    def quiz_uri(self, thread_id, since):
+        # Download URI of the quiz PDF the agent stored during this run, None when it did not create one
+        artifact = self.artifact_store.latest(thread_id, since=since)
+        return artifact.uri if artifact is not None else None
+
+    def make_contextual_quiz(self, state, config):
         logging.info("---STARTING CONTEXTUAL QUIZ GENERATION---")
         question = state["messages"][-1]
-        documents = state.get("documents", [])
-        print(documents)
-        rsp = self.agent.invoke_agent(query=question.content, documents=documents,
-                                      thread_id=self.config.get("thread_id", "1234"))
+        documents = self.get_context(state, config)["combined"]
+        thread_id = self.get_thread_id(config)
+        started = time.time()
+        with span("contextual_quiz_agent", thread_id=thread_id, context_items=len(documents)):
+            rsp = self.agent.invoke_agent(query=question.content, documents=documents, thread_id=thread_id)
         rsp = rsp.strip()
-        return {**state, "generation": rsp}
+        return {**state, "generation": rsp, "quiz_uri": self.quiz_uri(thread_id, since=started)}
 
-    def make_quiz(self, state):
+    def make_quiz(self, state, config):
         logging.info("---STARTING QUIZ GENERATION---")
         question = state["messages"][-1]
-        rsp = self.agent.invoke_agent(query=question.content, thread_id=self.config.get("thread_id", "1234"))
+        thread_id = self.get_thread_id(config)
+        started = time.time()
+        rsp = self.agent.invoke_agent(query=question.content, thread_id=thread_id)
         rsp = rsp.strip()
-        return {**state, "generation": rsp}
+        return {**state, "generation": rsp, "quiz_uri": self.quiz_uri(thread_id, since=started)}
 
-    def check_relevant_doc_exists(self, state):
+    def check_relevant_doc_exists(self, state, config=None):
         is_relevant_docs_exist = {}
         logging.info("---CHECK RELEVANT DOCUMENTS EXIST---")
-        documents = state.get("documents", []) + state["messages"][:-1]
+        documents = self.get_context(state, config)["combined"]
         question = state["messages"][-1]
         if documents:
             logging.info("---DOCUMENTS EXIST---")
@@ -372,63 +654,92 @@ class IPAgenticWorkflow(GenericAgentWorkflow):
             logging.info(is_relevant_docs_exist)
         return {**state, "relevant_docs_exist": is_relevant_docs_exist.get('relevant_docs_exist', False)}
 
-    @staticmethod
-    def send_email(data):
-        """
-        Tool to be used by LLM to send email to user with generated quiz PDF file
+    def triage(self, state, config=None):
         """
-        try:
-            email_regex = r'[\w\.-]+@[\w\.-]+\.\w+'
-
-            emails = []
-
-            for msg in data["messages"]:
-                found = re.findall(email_regex, msg.content)
-                emails.extend(found)
+        Classify the question with a single structured-output LLM call
 
-            print(emails)
-
-            logging.info("---Sending EMAIL---")
-            subject = MAIL_SUBJECT
-            body = MAIL_BODY
-            for recipient_email in emails:
-                msg = MIMEMultipart()
-                msg['From'] = EMAIL_ADDRESS
-                msg['To'] = recipient_email
-                msg['Subject'] = subject
-
-                msg.attach(MIMEText(body, 'plain'))
-                script_dir = os.path.dirname(__file__)
-                filename = '/'.join(script_dir.split("/")[:-2]) + '/' + "outputs/QUIZ.pdf"
+        Args:
+            state (dict): The current graph state
 
-                # Construct the full path using os.path.join for platform independence
-                # filename = os.path.join(script_dir, relative_file_path)
-                attachment = open(filename, "rb")
-                attachment_name = filename.split("/")[-1]
+        Returns:
+            state (dict): generate_quiz, valid_question, valid_quiz_topic, web_search_required and send_email flags
+        """
+        logging.info("---TRIAGE---")
+        question = state["messages"][-1]
+        question = question.content
+        triage = self.triage_classifier.invoke({"question": question,
+                                                "chat_history": self.get_context(state, config)["chat_history"]})
+        return {**triage.model_dump(), **self.start_turn(config)}
 
-                # instance of MIMEBase and named as p
-                p = MIMEBase('application', 'octet-stream')
+    def check_relevant_docs(self, ip: dict):
+        if ip["documents"]:
+            return self.relevant_doc_checker.invoke(ip)
+        return {}
 
-                # To change the payload into encoded form
-                p.set_payload(attachment.read())
-                encoders.encode_base64(p)
+    def classify_in_parallel(self, state, config=None):
+        """
+        Run the quiz router, question validator, relevant document checker and the vector retrieval concurrently
 
-                p.add_header('Content-Disposition', "attachment; filename= %s" % attachment_name)
+        Args:
+            state (dict): The current graph state
 
-                # attach the instance 'p' to instance 'msg'
-                msg.attach(p)
+        Returns:
+            state (dict): Classifier flags and, when the existing documents are not sufficient, the retrieved documents
+        """
+        logging.info("---CLASSIFY IN PARALLEL---")
+        question = state["messages"][-1]
+        question = question.content
+        documents = self.get_context(state, config)["combined"]
+        results = self.parallel_classifier.invoke({"question": question, "documents": documents})
+
+        update = {"generate_quiz": results["generate_quiz"].get("generate_quiz", False),
+                  "valid_question": results["valid_question"].get("valid_question"),
+                  "relevant_docs_exist": results["relevant_docs_exist"].get("relevant_docs_exist", False),
+                  **self.start_turn(config)}
+        # Retrieved documents are only merged when the sequential graph would have reached the retrieve node
+        if update["valid_question"] and not update["relevant_docs_exist"]:
+            retrieved_documents = self.remove_near_duplicates(results["retrieved_documents"], question)
+            update["documents"] = self.context_builder.merge_documents(
+                state.get("documents", []), [doc.page_content for doc in retrieved_documents])
+            update["weak_retrieval"] = self.is_weak_retrieval(retrieved_documents, question)
+        return update
+
+    def send_email(self, state, config=None):
+        """
+        Queue the last quiz PDF generated in the conversation for delivery to the email addresses found in it
 
-                with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                    server.starttls()
-                    server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-                    server.sendmail(EMAIL_ADDRESS, recipient_email, msg.as_string())
+        The mail dispatcher delivers it in the background, the node returns right away with the id of the mail job,
+        whose delivery status is served by /chat/mail/{job_id}.
 
-                logging.info(f"Email sent successfully to {recipient_email}")
+        Args:
+            state (dict): The current graph state
 
+        Returns:
+            state (dict): Generation telling the user the email was queued, and the mail job id
+        """
+        email_regex = r'[\w\.-]+@[\w\.-]+\.\w+'
+        emails = []
+        for msg in state["messages"]:
+            emails.extend(re.findall(email_regex, msg.content))
+        # Addresses repeated across the conversation get the quiz once
+        emails = list(dict.fromkeys(emails))
+        if not emails:
+            return {"generation": "Answer:Please share the email address the quiz should be sent to."}
+
+        artifact = self.artifact_store.latest(self.get_thread_id(config))
+        if artifact is None:
+            return {"generation": "Answer:Please generate a quiz before asking to email it."}
+
+        logging.info("---QUEUEING EMAIL---")
+        try:
+            job_id = self.mail_dispatcher.submit(recipients=emails, subject=MAIL_SUBJECT, body=MAIL_BODY,
+                                                 attachment=artifact.content, attachment_name=artifact.filename)
         except Exception as err_msg:
             logging.error(f"Error sending mail:{err_msg}")
             raise err_msg
-        return {"generation": "Email sent successfully to all recipients"}
+        return {"generation": f"Answer:The quiz is being emailed to {', '.join(emails)}. Delivery status: "
+                              f"/chat/mail/{job_id}",
+                "mail_job_id": job_id}
 
     @staticmethod
     def generate_invalid_question_response(state):
@@ -479,6 +790,31 @@ class IPAgenticWorkflow(GenericAgentWorkflow):
             else:
                 return "validate_question"
 
+    @staticmethod
+    def route_parallel_classification(state):
+        if state["generate_quiz"]:
+            return "validate_quiz_topic"
+        question = state["messages"][-1]
+        if "send" in question.content.lower() or "email" in question.content.lower() or "@" in question.content.lower():
+            return "send_email"
+        if not state["valid_question"]:
+            return "generate_invalid_question_response"
+        if state["relevant_docs_exist"]:
+            return "generate"
+        return "route_question"
+
+    @staticmethod
+    def route_triage(state):
+        if state["generate_quiz"]:
+            if state["valid_quiz_topic"]:
+                return "get_quiz_type"
+            return "generate_invalid_quiz_topic_response"
+        if state["send_email"]:
+            return "send_email"
+        if state["valid_question"]:
+            return "check_relevant_doc_exists"
+        return "generate_invalid_question_response"
+
     @staticmethod
     def is_quiz_contextual(state):
         logging.info("--VALIDATE CONTEXTUALIZED QUIZ GENERATION--")
@@ -513,16 +849,22 @@ class IPAgenticWorkflow(GenericAgentWorkflow):
                    }
               ]
               }
+        if response.get("quiz_uri"):
+            op["quiz"] = {"status": "ready", "uri": response["quiz_uri"]}
+        if response.get("mail_job_id"):
+            op["mail_job_id"] = response["mail_job_id"]
         return op
 
     def create_workflow(self):
-        self.workflow = StateGraph(GraphState)
+        if self.graph_mode == "parallel":
+            return self.create_parallel_workflow()
+        if self.graph_mode == "triage":
+            return self.create_triage_workflow()
+        return self.create_sequential_workflow()
 
-        self.workflow.add_node("choose_initial_path", self.choose_initial_path)
+    def add_common_nodes(self):
         self.workflow.add_node("generate_invalid_question_response", self.generate_invalid_question_response)
-        self.workflow.add_node("retrieve", self.retrieve)
         self.workflow.add_node("route_question", self.route_question)
-        self.workflow.add_node("validate_question", self.validate_question)
         self.workflow.add_node("validate_quiz_topic", self.validate_quiz_topic)
         self.workflow.add_node("web_search", self.web_search)
         self.workflow.add_node("generate", self.generate)
@@ -530,16 +872,7 @@ class IPAgenticWorkflow(GenericAgentWorkflow):
         self.workflow.add_node("make_contextual_quiz", self.make_contextual_quiz)
         self.workflow.add_node("generate_invalid_quiz_topic_response", self.generate_invalid_quiz_topic_response)
         self.workflow.add_node("get_quiz_type", self.get_quiz_type)
-        self.workflow.add_node("check_relevant_doc_exists", self.check_relevant_doc_exists)
         self.workflow.add_node("send_email", self.send_email)
-
-        self.workflow.set_entry_point("choose_initial_path")
-        self.workflow.add_conditional_edges("choose_initial_path",
-                                            self.should_generate_quiz,
-                                            {"validate_question": "validate_question",
-                                             "validate_quiz_topic": "validate_quiz_topic",
-                                             "send_email": "send_email"
-                                             })
         self.workflow.add_edge("send_email", END)
 
         self.workflow.add_conditional_edges("validate_quiz_topic",
@@ -558,19 +891,7 @@ class IPAgenticWorkflow(GenericAgentWorkflow):
 
         self.workflow.add_edge("make_quiz", END)
 
-        self.workflow.add_conditional_edges("validate_question",
-                                            self.is_valid_question,
-                                            {
-                                                "generate_invalid_question_response":
-                                                    "generate_invalid_question_response",
-                                                "check_relevant_doc_exists": "check_relevant_doc_exists"
-                                            }
-                                            )
-        self.workflow.add_conditional_edges("check_relevant_doc_exists",
-                                            self.is_relevant_docs_exist,
-                                            {"retrieve": "retrieve", "generate": "generate"})
         self.workflow.add_edge("generate_invalid_question_response", END)
-        self.workflow.add_edge("retrieve", "route_question")
         self.workflow.add_conditional_edges("route_question",
                                             self.is_web_search_required,
                                             {"web_search": "web_search", "generate": "generate"})
@@ -585,12 +906,103 @@ class IPAgenticWorkflow(GenericAgentWorkflow):
             },
         )
 
+    def create_sequential_workflow(self):
+        self.workflow = StateGraph(GraphState)
+        self.add_common_nodes()
+
+        self.workflow.add_node("choose_initial_path", self.choose_initial_path)
+        self.workflow.add_node("validate_question", self.validate_question)
+        self.workflow.add_node("check_relevant_doc_exists", self.check_relevant_doc_exists)
+        self.workflow.add_node("retrieve", self.retrieve)
+
+        self.workflow.set_entry_point("choose_initial_path")
+        self.workflow.add_conditional_edges("choose_initial_path",
+                                            self.should_generate_quiz,
+                                            {"validate_question": "validate_question",
+                                             "validate_quiz_topic": "validate_quiz_topic",
+                                             "send_email": "send_email"
+                                             })
+        self.workflow.add_conditional_edges("validate_question",
+                                            self.is_valid_question,
+                                            {
+                                                "generate_invalid_question_response":
+                                                    "generate_invalid_question_response",
+                                                "check_relevant_doc_exists": "check_relevant_doc_exists"
+                                            }
+                                            )
+        self.workflow.add_conditional_edges("check_relevant_doc_exists",
+                                            self.is_relevant_docs_exist,
+                                            {"retrieve": "retrieve", "generate": "generate"})
+        self.workflow.add_edge("retrieve", "route_question")
+
+    def create_parallel_workflow(self):
+        self.workflow = StateGraph(GraphState)
+        self.add_common_nodes()
+
+        self.workflow.add_node("classify_in_parallel", self.classify_in_parallel)
+
+        self.workflow.set_entry_point("classify_in_parallel")
+        self.workflow.add_conditional_edges("classify_in_parallel",
+                                            self.route_parallel_classification,
+                                            {"validate_quiz_topic": "validate_quiz_topic",
+                                             "send_email": "send_email",
+                                             "generate_invalid_question_response":
+                                                 "generate_invalid_question_response",
+                                             "generate": "generate",
+                                             "route_question": "route_question"
+                                             })
+
+    def create_triage_workflow(self):
+        self.workflow = StateGraph(GraphState)
+        self.add_common_nodes()
+
+        self.workflow.add_node("triage", self.triage)
+        self.workflow.add_node("check_relevant_doc_exists", self.check_relevant_doc_exists)
+        self.workflow.add_node("retrieve", self.retrieve)
+
+        self.workflow.set_entry_point("triage")
+        self.workflow.add_conditional_edges("triage",
+                                            self.route_triage,
+                                            {"get_quiz_type": "get_quiz_type",
+                                             "generate_invalid_quiz_topic_response":
+                                                 "generate_invalid_quiz_topic_response",
+                                             "send_email": "send_email",
+                                             "check_relevant_doc_exists": "check_relevant_doc_exists",
+                                             "generate_invalid_question_response":
+                                                 "generate_invalid_question_response"
+                                             })
+        self.workflow.add_conditional_edges("check_relevant_doc_exists",
+                                            self.is_relevant_docs_exist,
+                                            {"retrieve": "retrieve", "generate": "generate"})
+        # web_search_required was already decided by the triage call, route_question is skipped
+        self.workflow.add_conditional_edges("retrieve",
+                                            self.is_web_search_required,
+                                            {"web_search": "web_search", "generate": "generate"})
+
     def compile_workflow(self):
         # Compile
         self.create_workflow()
         return self.workflow.compile(checkpointer=self.checkpointer)
 
-    def end_langgraph_session(self):
+    def get_config(self, thread_id=None):
+        """
+        Build the checkpointer config for a conversation thread.
+
+        Args:
+            thread_id (str): Thread to run the graph on, defaults to the workflow's own thread
+
+        Returns:
+            dict: Runnable config keyed on the thread id
+        """
+        return {"configurable": {"thread_id": thread_id or self.thread_id}}
+
+    def get_thread_id(self, config=None):
+        if config:
+            return config.get("configurable", {}).get("thread_id", self.thread_id)
+        return self.thread_id
+
+    def end_langgraph_session(self, thread_id=None):
         # This deletes all checkpoints associated with the given thread_id
-        self.checkpointer.delete_thread(self.thread_id)
-        print(f"Session/thread {self.thread_id} state has been cleared from the checkpointer.")
+        thread_id = thread_id or self.thread_id
+        self.checkpointer.delete_thread(thread_id)
+        logging.info(f"Session/thread {thread_id} state has been cleared from the checkpointer.")
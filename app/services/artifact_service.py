@@ -0,0 +1,154 @@
+import json
+import time
+import hashlib
+import threading
+from urllib.parse import quote
+from collections import OrderedDict
+from app.core.settings import get_settings
+
+_ARTIFACT_STORE = None
+_ARTIFACT_STORE_LOCK = threading.Lock()
+
+
+def content_hash(content):
+    """
+    Hash of a quiz, stable across key order, the key of its artifact within a thread
+    """
+    if not isinstance(content, (bytes, str)):
+        content = json.dumps(content, sort_keys=True, ensure_ascii=False)
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()[:32]
+
+
+class Artifact:
+    __slots__ = ("thread_id", "content_hash", "content", "filename", "media_type", "created_at", "stored_at",
+                 "expires_at")
+
+    def __init__(self, thread_id, content_hash, content, filename, media_type, ttl_seconds):
+        self.thread_id = thread_id
+        self.content_hash = content_hash
+        self.content = content
+        self.filename = filename
+        self.media_type = media_type
+        self.created_at = time.time()
+        # Last time the artifact was generated, the same quiz can be generated again later in the thread
+        self.stored_at = self.created_at
+        self.expires_at = self.created_at + ttl_seconds
+
+    @property
+    def size(self):
+        return len(self.content)
+
+    @property
+    def uri(self):
+        return f"/chat/quiz/{quote(self.thread_id, safe='')}/{self.content_hash}"
+
+    def meta(self):
+        return {"filename": self.filename, "media_type": self.media_type, "size": self.size,
+                "created_at": self.created_at, "expires_at": self.expires_at}
+
+
+class ArtifactStore:
+    """
+    In-memory store of the files generated for a conversation, e.g. quiz PDFs.
+
+    Artifacts are keyed by (thread_id, content hash), so concurrent conversations never overwrite each other's files
+    and the same quiz generated twice in a thread is stored once. Artifacts expire after ttl_seconds, artifacts larger
+    than max_artifact_bytes are rejected and the least recently used ones are evicted once the store holds more than
+    max_total_bytes.
+    """
+
+    def __init__(self, max_artifact_bytes=5_000_000, max_total_bytes=256_000_000, ttl_seconds=3600):
+        self.max_artifact_bytes = max_artifact_bytes
+        self.max_total_bytes = max_total_bytes
+        self.ttl_seconds = ttl_seconds
+        self.artifacts = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.counters = {"stored": 0, "deduplicated": 0, "hits": 0, "misses": 0, "expired": 0, "evicted": 0,
+                         "rejected": 0}
+
+    def _drop(self, key, counter):
+        artifact = self.artifacts.pop(key)
+        self.total_bytes -= artifact.size
+        self.counters[counter] += 1
+
+    def _evict(self, now):
+        for key, artifact in list(self.artifacts.items()):
+            if artifact.expires_at <= now:
+                self._drop(key, "expired")
+        while self.total_bytes > self.max_total_bytes and self.artifacts:
+            self._drop(next(iter(self.artifacts)), "evicted")
+
+    def put(self, thread_id, content_hash, content, filename="QUIZ.pdf", media_type="application/pdf"):
+        """
+        Store an artifact of a thread, an artifact already stored under the same key is kept and refreshed
+
+        Returns:
+            Artifact: Stored artifact
+        """
+        if len(content) > self.max_artifact_bytes:
+            with self.lock:
+                self.counters["rejected"] += 1
+            raise ValueError(f"Artifact of {len(content)} bytes exceeds the limit of {self.max_artifact_bytes} bytes")
+        key = (thread_id, content_hash)
+        with self.lock:
+            now = time.time()
+            if key in self.artifacts:
+                self.artifacts.move_to_end(key)
+                artifact = self.artifacts[key]
+                artifact.stored_at = now
+                artifact.expires_at = now + self.ttl_seconds
+                self.counters["deduplicated"] += 1
+                return artifact
+            artifact = Artifact(thread_id=thread_id, content_hash=content_hash, content=bytes(content),
+                                filename=filename, media_type=media_type, ttl_seconds=self.ttl_seconds)
+            self.artifacts[key] = artifact
+            self.total_bytes += artifact.size
+            self.counters["stored"] += 1
+            self._evict(now)
+            return artifact
+
+    def get(self, thread_id, content_hash):
+        """
+        Artifact of a thread, None when it is unknown, expired or evicted
+        """
+        key = (thread_id, content_hash)
+        with self.lock:
+            artifact = self.artifacts.get(key)
+            if artifact is not None and artifact.expires_at <= time.time():
+                self._drop(key, "expired")
+                artifact = None
+            if artifact is None:
+                self.counters["misses"] += 1
+                return None
+            self.artifacts.move_to_end(key)
+            self.counters["hits"] += 1
+            return artifact
+
+    def latest(self, thread_id, since=None):
+        """
+        Most recently stored artifact of a thread, optionally only if stored at or after the since timestamp
+        """
+        now = time.time()
+        with self.lock:
+            artifacts = [artifact for artifact in self.artifacts.values()
+                         if artifact.thread_id == thread_id and artifact.expires_at > now
+                         and (since is None or artifact.stored_at >= since)]
+        return max(artifacts, key=lambda artifact: artifact.stored_at) if artifacts else None
+
+    def stats(self):
+        with self.lock:
+            return {"artifacts": len(self.artifacts), "bytes": self.total_bytes, **self.counters}
+
+
+def get_artifact_store():
+    global _ARTIFACT_STORE
+    with _ARTIFACT_STORE_LOCK:
+        if _ARTIFACT_STORE is None:
+            settings = get_settings()
+            _ARTIFACT_STORE = ArtifactStore(max_artifact_bytes=settings.quiz_artifact_max_bytes,
+                                            max_total_bytes=settings.quiz_artifact_max_total_bytes,
+                                            ttl_seconds=settings.quiz_artifact_ttl_seconds)
+        return _ARTIFACT_STORE
@@ -0,0 +1,137 @@
+import json
+import asyncio
+import uuid
+import logging
+from app.services.instrumentation_service import InstrumentationHandler
+
+QUESTION_FIELDS = ("question", "query")
+ID_FIELDS = ("id", "question_id", "message_id")
+
+
+def read_questions(lines, question_field=None, id_field=None):
+    """
+    Questions of a JSONL file, one object per line
+
+    Args:
+        lines (iterable): Lines of the file
+        question_field (str): Field holding the question, "question" or "query" by default
+        id_field (str): Field holding the question id, "id", "question_id" or "message_id" by default, the line
+            number otherwise
+
+    Returns:
+        list: {"id", "question"} dicts
+    """
+    questions = []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        if not isinstance(item, dict):
+            raise ValueError(f"Line {number} is not a JSON object")
+        question = item.get(question_field) if question_field else next(
+            (item[field] for field in QUESTION_FIELDS if field in item), None)
+        if not question:
+            raise ValueError(f"Line {number} has no question field")
+        item_id = item.get(id_field) if id_field else next((item[field] for field in ID_FIELDS if field in item),
+                                                            None)
+        questions.append({"id": str(item_id if item_id is not None else number), "question": question})
+    return questions
+
+
+class BatchRunner:
+    """
+    Runs independent questions through the compiled graph with bounded concurrency.
+
+    Every question gets its own checkpointer thread, which is dropped once it is answered, so questions of a batch
+    share neither chat history nor state. Results carry the answer, the source documents, the per-node latency, the
+    LLM calls, tokens and estimated cost and the error of questions which failed, a failed question does not fail the batch.
+    """
+
+    def __init__(self, flow_obj, flow, max_concurrency=8):
+        self.flow_obj = flow_obj
+        self.flow = flow
+        self.max_concurrency = max_concurrency
+
+    def prepare(self, questions, max_concurrency=None):
+        batch_id = uuid.uuid4().hex[:12]
+        handlers = [InstrumentationHandler() for _ in questions]
+        inputs = [{"messages": [{"role": "user", "content": item["question"]}]} for item in questions]
+        configs = [{"configurable": {"thread_id": f"batch-{batch_id}-{index}"},
+                    "callbacks": [handler],
+                    "max_concurrency": max_concurrency or self.max_concurrency,
+                    "run_name": "batch_question"}
+                   for index, handler in enumerate(handlers)]
+        return inputs, configs, handlers
+
+    def to_result(self, item, output, handler):
+        stats = handler.stats()
+        result = {"id": item["id"], "question": item["question"], "answer": None, "source_docs": [],
+                  "latency_ms": stats["total_ms"], "node_latency": stats["nodes"], "llm_calls": stats["llm_calls"],
+                  "input_tokens": stats["input_tokens"], "output_tokens": stats["output_tokens"],
+                  "cost_usd": stats["cost_usd"], "error": None}
+        if isinstance(output, Exception):
+            result["error"] = f"{type(output).__name__}: {output}"
+            return result
+        response = self.flow_obj.interact(response=output, message_id=item["id"])
+        result["answer"] = response["content"][0]["text"]
+        result["source_docs"] = response["content"][0]["source_docs"]
+        return result
+
+    def release(self, config):
+        try:
+            self.flow_obj.end_langgraph_session(thread_id=config["configurable"]["thread_id"])
+        except Exception as err_msg:
+            logging.error(f"Error clearing batch thread: {err_msg}")
+
+    def run(self, questions, max_concurrency=None):
+        """
+        Answer questions with the sync graph API
+
+        Returns:
+            list: Results in input order
+        """
+        inputs, configs, handlers = self.prepare(questions, max_concurrency=max_concurrency)
+        try:
+            outputs = self.flow.batch(inputs, configs, return_exceptions=True)
+            return [self.to_result(item, output, handler)
+                    for item, output, handler in zip(questions, outputs, handlers)]
+        finally:
+            for config in configs:
+                self.release(config)
+
+    async def astream(self, questions, max_concurrency=None):
+        """
+        Answer questions with the async graph API, yielding every result as soon as it is ready
+
+        When the consumer stops early, e.g. the /chat/batch client disconnected, the questions still running are
+        cancelled and the checkpointer threads of every question are released.
+        """
+        inputs, configs, handlers = self.prepare(questions, max_concurrency=max_concurrency)
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+
+        async def answer(index):
+            async with semaphore:
+                try:
+                    return index, await self.flow.ainvoke(inputs[index], configs[index])
+                except Exception as err_msg:
+                    return index, err_msg
+
+        # Tasks are managed here rather than by abatch_as_completed, which leaves them running when it is closed
+        tasks = [asyncio.ensure_future(answer(index)) for index in range(len(inputs))]
+        released = set()
+        try:
+            for completed in asyncio.as_completed(tasks):
+                index, output = await completed
+                try:
+                    result = self.to_result(questions[index], output, handlers[index])
+                finally:
+                    self.release(configs[index])
+                    released.add(index)
+                yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for index, config in enumerate(configs):
+                if index not in released:
+                    self.release(config)
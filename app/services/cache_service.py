@@ -0,0 +1,155 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from app.core.constants import COLLECTION_VERSIONS_FILE, TARGET_COLLECTIONS
+from app.utils.utility import read_collection_versions
+
+
+class CacheEntry:
+    __slots__ = ("key", "question", "generation", "documents", "created_at", "slot")
+
+    def __init__(self, key, question, generation, documents, created_at, slot):
+        self.key = key
+        self.question = question
+        self.generation = generation
+        self.documents = documents
+        self.created_at = created_at
+        self.slot = slot
+
+
+class SemanticCache:
+    """
+    Answer cache keyed on the embedding of the contextualized question.
+
+    Vectors live in a pre-allocated matrix, a lookup is a single matrix-vector product over the occupied slots.
+    Entries are evicted in LRU order once max_entries is reached and expire after ttl_seconds. The whole cache is
+    invalidated as soon as one of the source collections is reloaded by data_load.py.
+    """
+
+    def __init__(self, embedding, threshold=0.95, max_entries=1024, ttl_seconds=3600,
+                 source_collections=TARGET_COLLECTIONS,
+                 versions_file=COLLECTION_VERSIONS_FILE):
+        self.embedding = embedding
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.source_collections = tuple(source_collections)
+        self.versions_file = versions_file
+        self.entries = OrderedDict()
+        self.slot_keys = [None] * max_entries
+        self.free_slots = list(range(max_entries - 1, -1, -1))
+        self.matrix = None
+        self.active = np.zeros(max_entries, dtype=bool)
+        self.lock = threading.Lock()
+        self.versions_mtime = None
+        self.versions = {}
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        self.refresh_versions()
+
+    def embed(self, question):
+        vector = np.asarray(self.embedding.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def refresh_versions(self):
+        """
+        Invalidate the cache when the versions file written by data_load.py changed for one of the source collections
+        """
+        try:
+            mtime = os.stat(self.versions_file).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.versions_mtime:
+            return
+        versions = read_collection_versions(versions_file=self.versions_file)
+        changed = [name for name in self.source_collections if versions.get(name) != self.versions.get(name)]
+        self.versions_mtime = mtime
+        self.versions = versions
+        if changed and self.entries:
+            logging.info(f"Collections {changed} were reloaded, invalidating semantic cache")
+            self.invalidate()
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.slot_keys = [None] * self.max_entries
+            self.free_slots = list(range(self.max_entries - 1, -1, -1))
+            self.active[:] = False
+            self.counters["invalidations"] += 1
+
+    def _remove(self, entry):
+        del self.entries[entry.key]
+        self.active[entry.slot] = False
+        self.slot_keys[entry.slot] = None
+        self.free_slots.append(entry.slot)
+
+    def _is_expired(self, entry, now):
+        return self.ttl_seconds is not None and now - entry.created_at > self.ttl_seconds
+
+    def lookup(self, question):
+        """
+        Find a cached answer for a near-duplicate question
+
+        Args:
+            question (str): Contextualized question
+
+        Returns:
+            dict: generation and documents of the cached answer, None on a miss
+        """
+        self.refresh_versions()
+        vector = self.embed(question)
+        now = time.monotonic()
+        with self.lock:
+            if self.matrix is None or not self.active.any():
+                self.counters["misses"] += 1
+                return None
+            scores = self.matrix @ vector
+            scores[~self.active] = -1.0
+            slot = int(np.argmax(scores))
+            entry = self.entries[self.slot_keys[slot]]
+            if self._is_expired(entry, now):
+                self._remove(entry)
+                self.counters["expirations"] += 1
+                self.counters["misses"] += 1
+                return None
+            if scores[slot] < self.threshold:
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(entry.key)
+            self.counters["hits"] += 1
+            logging.info(f"Semantic cache hit with similarity {scores[slot]:.3f} for: {entry.question}")
+            return {"generation": entry.generation, "documents": list(entry.documents)}
+
+    def store(self, question, generation, documents):
+        vector = self.embed(question)
+        now = time.monotonic()
+        with self.lock:
+            if self.matrix is None:
+                self.matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            for entry in [entry for entry in self.entries.values() if self._is_expired(entry, now)]:
+                self._remove(entry)
+                self.counters["expirations"] += 1
+            if not self.free_slots:
+                _, oldest = next(iter(self.entries.items()))
+                self._remove(oldest)
+                self.counters["evictions"] += 1
+            slot = self.free_slots.pop()
+            key = uuid.uuid4().hex
+            self.matrix[slot] = vector
+            self.active[slot] = True
+            self.slot_keys[slot] = key
+            documents = tuple(getattr(doc, "content", doc) for doc in documents)
+            self.entries[key] = CacheEntry(key=key, question=question, generation=generation, documents=documents,
+                                           created_at=now, slot=slot)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {**self.counters,
+                    "size": len(self.entries),
+                    "max_entries": self.max_entries,
+                    "hit_rate": self.counters["hits"] / lookups if lookups else 0.0}
@@ -0,0 +1,173 @@
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from app.core.constants import CONVERSATION_SUMMARY_PROMPT
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text, good enough for budgeting prompts
+    return len(text) // 4 + 1
+
+
+def message_text(message):
+    return message if isinstance(message, str) else str(getattr(message, "content", message))
+
+
+def message_key(message):
+    message_id = getattr(message, "id", None)
+    return message_id if message_id else chunk_hash(message_text(message))
+
+
+def chunk_hash(text):
+    return hashlib.sha1(re.sub(r"\s+", " ", text).strip().lower().encode("utf-8")).hexdigest()
+
+
+def dedupe_chunks(chunks):
+    """
+    Drop chunks whose whitespace and case normalized text was already seen, keeping the latest occurrence
+    """
+    seen = set()
+    unique = []
+    for chunk in reversed(chunks):
+        key = chunk_hash(chunk)
+        if key not in seen:
+            seen.add(key)
+            unique.append(chunk)
+    return unique[::-1]
+
+
+class ContextBuilder:
+    """
+    Assembles the bounded context handed to the classifier, grader and generation prompts.
+
+    The latest history_window messages are kept verbatim and older turns are folded into a running summary, kept on
+    the user's session when there is one so only the messages which just left the window are summarized. Document
+    chunks are deduplicated and the most recent ones are kept until max_tokens is reached. Contexts and summaries are
+    memoized on message ids and chunk hashes, so the nodes of a turn share a single computation.
+    """
+
+    def __init__(self, llm=None, max_tokens=6000, history_window=6, summary_max_words=150, max_documents=30,
+                 cache_size=256):
+        self.max_tokens = max_tokens
+        self.history_window = history_window
+        self.summary_max_words = summary_max_words
+        self.max_documents = max_documents
+        self.cache_size = cache_size
+        self.summary_chain = None
+        if llm is not None:
+            self.summary_chain = PromptTemplate.from_template(CONVERSATION_SUMMARY_PROMPT) | llm | StrOutputParser()
+        self.contexts = OrderedDict()
+        self.summaries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "summaries": 0}
+
+    def merge_documents(self, documents, new_documents):
+        """
+        Documents to keep in the graph state, deduplicated and capped to the max_documents most recent chunks
+        """
+        return dedupe_chunks([message_text(doc) for doc in list(documents) + list(new_documents)])[
+               -self.max_documents:]
+
+    def _remember(self, cache, key, value):
+        with self.lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+    def summarize(self, messages):
+        """
+        Running summary of the messages which left the history window
+
+        The summary of the longest already summarized prefix is extended with the remaining messages only, so every
+        turn summarizes the messages that just left the window instead of the whole conversation.
+        """
+        if not messages or self.summary_chain is None:
+            return ""
+        keys = tuple(message_key(message) for message in messages)
+        summary, start = "", 0
+        with self.lock:
+            for end in range(len(keys), 0, -1):
+                if keys[:end] in self.summaries:
+                    self.summaries.move_to_end(keys[:end])
+                    summary, start = self.summaries[keys[:end]], end
+                    break
+        if start == len(keys):
+            return summary
+        summary = self.extend_summary(summary, messages[start:])
+        self._remember(self.summaries, keys, summary)
+        return summary
+
+    def extend_summary(self, summary, messages):
+        logging.info("---SUMMARIZING OLDER CONVERSATION TURNS---")
+        new_messages = "\n".join(message_text(message) for message in messages)
+        summary = self.summary_chain.invoke({"summary": summary or "None", "messages": new_messages,
+                                             "max_words": self.summary_max_words}).strip()
+        with self.lock:
+            self.counters["summaries"] += 1
+        return summary
+
+    def summarize_session(self, session):
+        """
+        Rolling summary of a session, extended with the messages which left the history window since the last turn
+
+        Messages the session's bounded history dropped before they were summarized are included, so the summary keeps
+        the whole conversation while each turn only summarizes the few messages which just left the window.
+        """
+        summary, pending, upto = session.pending_summary(self.history_window)
+        if not pending:
+            return summary
+        if self.summary_chain is not None:
+            summary = self.extend_summary(summary, pending)
+        session.fold_summary(summary, upto)
+        return summary
+
+    def build(self, messages, documents, session=None):
+        """
+        Bounded context of a turn
+
+        Args:
+            messages (list): Conversation messages preceding the current question
+            documents (list): Document chunks accumulated in the graph state
+            session (Session): Session the messages were read from, holding the rolling summary of older messages
+
+        Returns:
+            dict: chat_history (summary and recent messages), documents (chunks within the token budget) and
+            combined, the documents followed by the chat history, in the shape the prompts used to receive
+        """
+        key = (tuple(message_key(message) for message in messages),
+               tuple(chunk_hash(message_text(doc)) for doc in documents))
+        with self.lock:
+            if key in self.contexts:
+                self.contexts.move_to_end(key)
+                self.counters["hits"] += 1
+                return self.contexts[key]
+            self.counters["misses"] += 1
+
+        split = max(len(messages) - self.history_window, 0)
+        summary = self.summarize_session(session) if session is not None else self.summarize(messages[:split])
+        chat_history = ([SUMMARY_PREFIX + summary] if summary else []) + list(messages[split:])
+        budget = self.max_tokens - sum(estimate_tokens(message_text(message)) for message in chat_history)
+
+        selected = []
+        for chunk in reversed(dedupe_chunks([message_text(doc) for doc in documents])):
+            tokens = estimate_tokens(chunk)
+            if tokens > budget:
+                break
+            budget -= tokens
+            selected.append(chunk)
+        selected.reverse()
+
+        context = {"chat_history": chat_history, "documents": selected, "combined": selected + chat_history}
+        self._remember(self.contexts, key, context)
+        return context
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "cached_contexts": len(self.contexts), "cached_summaries": len(self.summaries)}
@@ -1,14 +1,184 @@
 import logging
-import os
+import re
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
 from dotenv import load_dotenv
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from langchain_core.embeddings import Embeddings
 from langchain_milvus import Milvus, BM25BuiltInFunction
 from app.services.service_interface import GenericEmbedder
 from app.data_load.data_access_objects import PdfDAO
+from app.core.constants import DEFAULT_INDEX_TYPE
+from app.core.settings import get_settings
+from app.core.milvus_registry import get_milvus_registry
+from app.utils.utility import get_dense_index_param
+from app.services.provider_service import get_embeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 load_dotenv()
 
+_EMBEDDING_CACHES = {}
+SPARSE_INDEX_PARAM = {
+    "metric_type": "BM25",
+    "index_type": "SPARSE_INVERTED_INDEX",
+}
+_EMBEDDING_CACHES_LOCK = threading.Lock()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Memoizing wrapper around an embeddings model.
+
+    Vectors are kept in a bounded in-process LRU and, when store_path is given, in a SQLite file so that they survive
+    restarts. Keys are built from (model, task, text): Gemini embeds queries and documents with different task types, so
+    a query vector must not be served for a document or vice versa. Concurrent requests for the same key wait for the
+    first caller instead of issuing duplicate remote calls.
+    """
+
+    def __init__(self, embedding, model, max_entries=10000, store_path=None):
+        self.embedding = embedding
+        self.model = model
+        self.max_entries = max_entries
+        self.store_path = store_path
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.store = None
+        self.hits = 0
+        self.misses = 0
+        if store_path:
+            self.store = sqlite3.connect(store_path, check_same_thread=False)
+            self.store.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self.store.commit()
+
+    def _key(self, task, text):
+        return hashlib.sha256(f"{self.model}\x00{task}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        self.entries[key] = vector
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _lookup(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        if self.store is not None:
+            row = self.store.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row:
+                vector = array("f", row[0]).tolist()
+                self._remember(key, vector)
+                return vector
+        return None
+
+    def _persist(self, items):
+        if self.store is not None and items:
+            self.store.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                                   [(key, array("f", vector).tobytes()) for key, vector in items])
+            self.store.commit()
+
+    def _embed(self, task, texts, embed_fn):
+        keys = [self._key(task, text) for text in texts]
+        vectors = {}
+        waiting = {}
+        owned = {}
+        with self.lock:
+            for key, text in zip(keys, texts):
+                if key in vectors or key in waiting or key in owned:
+                    continue
+                vector = self._lookup(key)
+                if vector is not None:
+                    vectors[key] = vector
+                    self.hits += 1
+                elif key in self.pending:
+                    waiting[key] = self.pending[key]
+                    self.hits += 1
+                else:
+                    owned[key] = text
+                    self.pending[key] = Future()
+                    self.misses += 1
+
+        if owned:
+            try:
+                computed = embed_fn(list(owned.values()))
+            except Exception as err_msg:
+                with self.lock:
+                    for key in owned:
+                        self.pending.pop(key).set_exception(err_msg)
+                raise err_msg
+            with self.lock:
+                for key, vector in zip(owned, computed):
+                    self._remember(key, vector)
+                    vectors[key] = vector
+                    self.pending.pop(key).set_result(vector)
+                self._persist(list(zip(owned, computed)))
+
+        for key, future in waiting.items():
+            vectors[key] = future.result()
+        return [vectors[key] for key in keys]
+
+    def embed_documents(self, texts):
+        return self._embed("document", texts, self.embedding.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed("query", [text], lambda texts: [self.embedding.embed_query(texts[0])])[0]
+
+    def stats(self):
+        with self.lock:
+            return {"model": self.model, "size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic, offline embeddings from hashed word unigrams and bigrams.
+
+    Far weaker than a neural model, but needs no network or API quota, which makes it suitable for benchmarks and
+    local runs comparing chunking or index settings against each other.
+    """
+
+    def __init__(self, dimensions=384):
+        self.dimensions = dimensions
+
+    def _embed(self, text):
+        words = re.findall(r"\w+", text.lower())
+        vector = [0.0] * self.dimensions
+        for feature in words + [f"{first} {second}" for first, second in zip(words, words[1:])]:
+            digest = hashlib.md5(feature.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = sum(value * value for value in vector) ** 0.5
+        return [value / norm for value in vector] if norm else vector
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def get_cached_embeddings(model, max_entries=None, store_path=None):
+    """
+    Process wide CachedEmbeddings for an embedding model of the configured provider, shared by every retriever and
+    the ingestion code
+    """
+    settings = get_settings()
+    max_entries = max_entries or settings.embedding_cache_max_entries
+    store_path = store_path or settings.embedding_cache_path
+    provider = settings.embedding_provider
+    # Vectors of other providers are cached under the provider name, a persisted cache never mixes them with Gemini's
+    cache_model = model if provider == "google" else f"{provider}:{model}"
+    with _EMBEDDING_CACHES_LOCK:
+        if (cache_model, store_path) not in _EMBEDDING_CACHES:
+            embedding = get_embeddings(model=model, provider=provider)
+            _EMBEDDING_CACHES[(cache_model, store_path)] = CachedEmbeddings(embedding=embedding, model=cache_model,
+                                                                            max_entries=max_entries,
+                                                                            store_path=store_path)
+        return _EMBEDDING_CACHES[(cache_model, store_path)]
+
 
 class PdfEmbeder(GenericEmbedder, PdfDAO):
     def __init__(self, chunk_size=2500, chunk_overlap=1400):
@@ -28,7 +198,7 @@ class PdfEmbeder(GenericEmbedder, PdfDAO):
         return self.docs
 
     def create_embeddings(self, **kwargs):
-        self.embedding = GoogleGenerativeAIEmbeddings(model=kwargs["model"], google_api_key=os.getenv('GEMINI_API_KEY'))
+        self.embedding = get_cached_embeddings(model=kwargs["model"])
         return self.embedding
 
     def chunk(self, docs):
@@ -46,32 +216,45 @@ class VectorStore:
         self.vectorstore = None
 
     def insert_into_vector_store(self, **kwargs):
-        dense_index_param = {
-            "metric_type": "COSINE",
-            "index_type": "IVF_FLAT",
-        }
-        sparse_index_param = {
-            "metric_type": "BM25",
-            "index_type": "SPARSE_INVERTED_INDEX",
-        }
         self.vectorstore = Milvus.from_documents(
             documents=kwargs["texts"],
             embedding=kwargs["embedding"],
             builtin_function=BM25BuiltInFunction(),
             vector_field=["dense", "sparse"],
-            connection_args={"uri": kwargs["milvus_uri"]},
+            connection_args=get_milvus_registry().connection_args(kwargs.get("milvus_uri")),
             collection_name=kwargs["target_collection"],
             drop_old=kwargs.get("drop_old", False),
-            index_params=[dense_index_param, sparse_index_param],
+            index_params=[get_dense_index_param(index_type=kwargs.get("index_type", DEFAULT_INDEX_TYPE),
+                                                index_params=kwargs.get("index_params")),
+                          SPARSE_INDEX_PARAM],
             partition_key_field=kwargs["partition_key"]
         )
         logging.info("Embeddings written to Vector Store")
 
+    def get_ingestion_store(self, **kwargs):
+        """
+        Store for the ingestion pipeline, which inserts pre-computed embeddings batch by batch
+        """
+        self.vectorstore = Milvus(
+            kwargs["embedding"],
+            builtin_function=BM25BuiltInFunction(),
+            vector_field=["dense", "sparse"],
+            connection_args=get_milvus_registry().connection_args(kwargs.get("milvus_uri")),
+            collection_name=kwargs["target_collection"],
+            drop_old=kwargs.get("drop_old", False),
+            index_params=[get_dense_index_param(index_type=kwargs.get("index_type", DEFAULT_INDEX_TYPE),
+                                                index_params=kwargs.get("index_params")),
+                          SPARSE_INDEX_PARAM],
+            partition_key_field=kwargs["partition_key"],
+            auto_id=True
+        )
+        return self.vectorstore
+
     def get_vector_store(self, **kwargs):
         self.vectorstore = Milvus(
             kwargs["embedding"],
             builtin_function=BM25BuiltInFunction(),
-            connection_args={"uri": kwargs["milvus_uri"]},
+            connection_args=get_milvus_registry().connection_args(kwargs.get("milvus_uri")),
             collection_name=kwargs["target_collection"],
             partition_key_field=kwargs["partition_key"],
             vector_field=["dense", "sparse"],
@@ -84,4 +267,4 @@ class Embedding(GenericEmbedder):
         super().__init__()
 
     def create_embeddings(self, **kwargs):
-        return GoogleGenerativeAIEmbeddings(model=kwargs["embedding_model"], google_api_key=os.getenv('GEMINI_API_KEY'))
+        return get_cached_embeddings(model=kwargs["embedding_model"])
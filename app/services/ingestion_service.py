@@ -0,0 +1,291 @@
+import glob
+import os
+import json
+import time
+import hashlib
+import random
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from langchain_core.documents import Document
+from langchain_community.document_loaders.parsers.pdf import _purge_metadata
+from app.utils.chunking import NearDuplicateFilter, get_splitter
+
+
+def expand_pdf_paths(path):
+    """
+    PDF files for a file path, a directory (searched recursively) or a glob pattern, in a stable order
+    """
+    if os.path.isdir(path):
+        paths = glob.glob(os.path.join(path, "**", "*.pdf"), recursive=True)
+    elif glob.has_magic(path):
+        paths = glob.glob(path, recursive=True)
+    else:
+        paths = [path]
+    paths = sorted(paths)
+    if not paths:
+        raise FileNotFoundError(f"No PDF files found for {path}")
+    return paths
+
+
+def count_pages(pdf_path):
+    from pypdf import PdfReader
+    return len(PdfReader(pdf_path).pages)
+
+
+def parse_page_range(pdf_path, start, end):
+    """
+    Parse pages [start, end) of a PDF, run in the worker processes of the ingestion pipeline
+
+    The documents carry the same metadata as the ones produced by PyPDFLoader, so chunks ingested by the pipeline fit
+    the collections created by the previous loader.
+    """
+    from pypdf import PdfReader
+    reader = PdfReader(pdf_path)
+    metadata = _purge_metadata({"producer": "PyPDF", "creator": "PyPDF", "creationdate": ""}
+                               | dict(reader.metadata or {})
+                               | {"source": pdf_path, "total_pages": len(reader.pages)})
+    return [Document(page_content=reader.pages[page].extract_text().strip(),
+                     metadata=metadata | {"page": page, "page_label": reader.page_labels[page]})
+            for page in range(start, min(end, len(reader.pages)))]
+
+
+class IngestionPipeline:
+    """
+    Streaming PDF ingestion into a Milvus collection.
+
+    Page ranges are parsed in a process pool and chunked as they arrive, chunks are embedded in batches by a bounded
+    number of concurrent requests with retry and exponential backoff, and every embedded batch is inserted while the
+    next ones are being embedded. At most parse_workers * 2 page ranges and embed_concurrency + 1 batches are held at
+    any time, so memory stays flat regardless of the size of the corpus.
+    """
+
+    def __init__(self, embedding, chunk_size=None, chunk_overlap=None, pages_per_task=8, parse_workers=None,
+                 embed_batch_size=64, embed_concurrency=4, max_retries=5, backoff_seconds=1.0, chunker="legal",
+                 dedupe_threshold=None):
+        self.embedding = embedding
+        self.splitter = get_splitter(chunker=chunker, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        # Near-duplicate chunks of the whole run, e.g. boilerplate repeated in every chapter, are only embedded once
+        self.dedupe_threshold = dedupe_threshold
+        self.pages_per_task = pages_per_task
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.metadata_template = None
+        self.stats = {"files": 0, "pages": 0, "chunks": 0, "duplicates": 0, "batches": 0, "retries": 0}
+
+    def iter_pages(self, pdf_paths):
+        """
+        Page documents of all PDFs, in order, with a bounded number of page ranges in flight
+        """
+        # Spawned, forking is unsafe once the Milvus gRPC client has started its threads
+        with ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=multiprocessing.get_context("spawn")) \
+                as executor:
+            tasks = ((pdf_path, start, start + self.pages_per_task)
+                     for pdf_path in pdf_paths
+                     for start in range(0, count_pages(pdf_path), self.pages_per_task))
+            in_flight = deque()
+            for task in tasks:
+                in_flight.append(executor.submit(parse_page_range, *task))
+                if len(in_flight) >= self.parse_workers * 2:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
+
+    def iter_chunks(self, pages):
+        near_duplicates = NearDuplicateFilter(threshold=self.dedupe_threshold) if self.dedupe_threshold else None
+        for page in pages:
+            self.stats["pages"] += 1
+            for chunk in self.splitter.split_documents([page]):
+                if near_duplicates is not None and near_duplicates.is_duplicate(chunk.page_content):
+                    self.stats["duplicates"] += 1
+                    continue
+                self.stats["chunks"] += 1
+                yield chunk
+
+    def iter_batches(self, chunks):
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) == self.embed_batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def embed_with_retry(self, texts):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.embedding.embed_documents(texts)
+            except Exception as err_msg:
+                if attempt == self.max_retries:
+                    raise err_msg
+                delay = self.backoff_seconds * 2 ** attempt * (1 + random.random())
+                logging.warning(f"Embedding batch failed ({err_msg}), retrying in {delay:.1f}s")
+                self.stats["retries"] += 1
+                time.sleep(delay)
+
+    def conform_metadata(self, metadata):
+        # Milvus fixes the scalar fields when the collection is created, PDFs with other metadata keys are aligned
+        # with the first chunk of the run
+        if self.metadata_template is None:
+            self.metadata_template = {key: type(value)() for key, value in metadata.items()}
+        return {key: metadata.get(key, default) for key, default in self.metadata_template.items()}
+
+    def insert_batch(self, vector_store, batch, vectors, on_inserted=None):
+        pks = vector_store.add_embeddings(texts=[chunk.page_content for chunk in batch], embeddings=vectors,
+                                          metadatas=[self.conform_metadata(chunk.metadata) for chunk in batch])
+        self.stats["batches"] += 1
+        if on_inserted is not None:
+            on_inserted(batch, pks)
+
+    def embed_and_insert(self, batches, vector_store, on_inserted=None):
+        """
+        Embed batches with bounded concurrency and insert them in order, on_inserted is called with every inserted
+        batch and its primary keys from the insert thread
+        """
+        with ThreadPoolExecutor(max_workers=self.embed_concurrency, thread_name_prefix="embed") as embedder, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix="insert") as inserter:
+            pending = deque()
+            insert = None
+            for batch in batches:
+                pending.append((batch, embedder.submit(self.embed_with_retry, [chunk.page_content for chunk in batch])))
+                if len(pending) < self.embed_concurrency:
+                    continue
+                insert = self.insert_next(vector_store, pending, inserter, insert, on_inserted)
+            while pending:
+                insert = self.insert_next(vector_store, pending, inserter, insert, on_inserted)
+            if insert is not None:
+                insert.result()
+
+    def insert_next(self, vector_store, pending, inserter, previous_insert, on_inserted=None):
+        batch, vectors = pending.popleft()
+        vectors = vectors.result()
+        # Batches are inserted one at a time and in order, the previous insert overlaps with the embedding requests
+        if previous_insert is not None:
+            previous_insert.result()
+        return inserter.submit(self.insert_batch, vector_store, batch, vectors, on_inserted)
+
+    def run(self, pdf_paths, vector_store):
+        """
+        Ingest PDFs into the vector store
+
+        Args:
+            pdf_paths (list): PDF files to ingest
+            vector_store (Milvus): Store the embedded chunks are inserted into
+
+        Returns:
+            dict: Number of files, pages, chunks and batches ingested and embedding retries
+        """
+        started = time.perf_counter()
+        self.stats["files"] = len(pdf_paths)
+        self.embed_and_insert(self.iter_batches(self.iter_chunks(self.iter_pages(pdf_paths))), vector_store)
+        logging.info(f"Ingested {self.stats} in {time.perf_counter() - started:.1f}s")
+        return dict(self.stats)
+
+    def sync(self, pdf_paths, vector_store, manifest):
+        """
+        Bring the vector store in line with the PDFs, embedding only new or changed chunks
+
+        Chunks are identified by their location (source, page, start_index) and compared on a hash of their location
+        and text. Changed chunks are re-inserted and their previous version deleted, chunks of the manifest which
+        were not seen any more, e.g. from removed pages or files, are deleted.
+
+        Args:
+            pdf_paths (list): PDF files the collection must reflect
+            vector_store (Milvus): Store the chunks are synced to
+            manifest (IngestionManifest): Chunk hashes and primary keys of the previous sync
+
+        Returns:
+            dict: Number of added, updated, removed and unchanged chunks
+        """
+        started = time.perf_counter()
+        self.stats["files"] = len(pdf_paths)
+        counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        seen = set()
+        replaced = {}
+
+        def changed_chunks():
+            for chunk in self.iter_chunks(self.iter_pages(pdf_paths)):
+                key = manifest.chunk_key(chunk)
+                digest = manifest.chunk_hash(chunk)
+                seen.add(key)
+                entry = manifest.get(key)
+                if entry is not None and entry["hash"] == digest:
+                    counts["unchanged"] += 1
+                    continue
+                counts["updated" if entry is not None else "added"] += 1
+                if entry is not None:
+                    replaced[key] = entry["pk"]
+                yield chunk
+
+        def on_inserted(batch, pks):
+            stale = []
+            for chunk, pk in zip(batch, pks):
+                key = manifest.chunk_key(chunk)
+                if key in replaced:
+                    stale.append(replaced.pop(key))
+                manifest.set(key, digest=manifest.chunk_hash(chunk), pk=pk)
+            # The previous version of an updated chunk is only deleted once its replacement is stored
+            if stale:
+                vector_store.delete(ids=stale)
+
+        try:
+            self.embed_and_insert(self.iter_batches(changed_chunks()), vector_store, on_inserted=on_inserted)
+            orphans = [key for key in manifest.keys() if key not in seen]
+            if orphans:
+                vector_store.delete(ids=[manifest.get(key)["pk"] for key in orphans])
+                for key in orphans:
+                    manifest.remove(key)
+            counts["removed"] = len(orphans)
+        finally:
+            # Saved on failure too, the manifest then matches the chunks which actually reached the store
+            manifest.save()
+        logging.info(f"Synced {counts} ({self.stats}) in {time.perf_counter() - started:.1f}s")
+        return counts
+
+
+class IngestionManifest:
+    """
+    Sidecar JSON file recording, for every chunk of a collection, the hash of its content and its primary key
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.exists = os.path.exists(path)
+        if self.exists:
+            with open(path, "r") as file:
+                self.entries = json.load(file)["chunks"]
+
+    @staticmethod
+    def chunk_key(chunk):
+        return json.dumps([chunk.metadata.get("source"), chunk.metadata.get("page"),
+                           chunk.metadata.get("start_index")])
+
+    @staticmethod
+    def chunk_hash(chunk):
+        return hashlib.sha256(f"{IngestionManifest.chunk_key(chunk)}\x00{chunk.page_content}".encode("utf-8")) \
+            .hexdigest()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, digest, pk):
+        self.entries[key] = {"hash": digest, "pk": pk}
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+
+    def keys(self):
+        return list(self.entries)
+
+    def save(self):
+        tmp_file = f"{self.path}.tmp"
+        with open(tmp_file, "w") as file:
+            json.dump({"chunks": self.entries}, file)
+        os.replace(tmp_file, self.path)
+        self.exists = True
@@ -0,0 +1,199 @@
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import Counter, Histogram
+from app.core.constants import MODEL_PRICING
+
+# Label of LLM and retriever runs made outside of a graph node, e.g. by the deferred grading
+NO_NODE = "none"
+REQUEST_COUNTERS = ("llm_calls", "input_tokens", "output_tokens", "retriever_calls", "retrieved_documents")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+GRAPH_LATENCY = Histogram("ip_tutor_graph_latency_seconds", "Wall time of a graph run", ["status"],
+                          buckets=LATENCY_BUCKETS)
+NODE_LATENCY = Histogram("ip_tutor_node_latency_seconds", "Wall time of a graph node run", ["node"],
+                         buckets=LATENCY_BUCKETS)
+LLM_LATENCY = Histogram("ip_tutor_llm_latency_seconds", "Wall time of an LLM call", ["node", "model"],
+                        buckets=LATENCY_BUCKETS)
+LLM_CALLS = Counter("ip_tutor_llm_calls_total", "LLM calls", ["node", "model"])
+LLM_TOKENS = Counter("ip_tutor_llm_tokens_total", "LLM tokens", ["node", "model", "direction"])
+LLM_COST = Counter("ip_tutor_llm_cost_usd_total", "Estimated LLM cost in US dollars", ["node", "model"])
+RETRIEVER_CALLS = Counter("ip_tutor_retriever_calls_total", "Retriever calls", ["node"])
+RETRIEVED_DOCUMENTS = Counter("ip_tutor_retrieved_documents_total", "Documents returned by retrievers", ["node"])
+SPAN_LATENCY = Histogram("ip_tutor_span_latency_seconds", "Wall time of a span", ["span"], buckets=LATENCY_BUCKETS)
+
+
+def estimate_cost(model, input_tokens, output_tokens):
+    """
+    Cost in US dollars of an LLM call, 0 for models without a price in MODEL_PRICING
+    """
+    input_price, output_price = MODEL_PRICING.get(model.split("/")[-1], (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def token_usage(response):
+    """
+    Input and output tokens of an LLMResult, from the usage metadata of its messages
+    """
+    input_tokens = 0
+    output_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            input_tokens += usage.get("input_tokens", 0)
+            output_tokens += usage.get("output_tokens", 0)
+    return input_tokens, output_tokens
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a block of code and log it as one JSON record with its attributes, attributes can be added to the yielded
+    dict inside the block
+
+    Args:
+        name (str): Span name, also the label of its latency histogram
+        **attributes: Attributes logged with the span, e.g. the thread id
+    """
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield attributes
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        SPAN_LATENCY.labels(span=name).observe(duration)
+        logging.info(json.dumps({"span": name, "status": status, "ms": round(duration * 1000, 3), **attributes},
+                                default=str))
+
+
+class InstrumentationHandler(BaseCallbackHandler):
+    """
+    Per-request instrumentation of a graph run.
+
+    Records the wall time of every graph node, the LLM calls, tokens and estimated cost and the retriever calls and
+    returned documents made inside each node, for the request through stats() and for the process through the
+    Prometheus metrics. Nodes which ran several times, e.g. generate after a failed grading, are summed and counted.
+    Only the outermost retriever of a nested retriever, e.g. the compression retriever around the ensemble, is counted.
+    """
+
+    # Called on the event loop, so the timings do not include the executor hop of non-inline handlers
+    run_inline = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nodes = {}
+        self.llm_runs = {}
+        self.retriever_runs = {}
+        self.latency_ms = defaultdict(float)
+        self.counts = defaultdict(lambda: defaultdict(int))
+        self.cost_usd = 0.0
+        self.total_ms = None
+        self.root = None
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        with self.lock:
+            if parent_run_id is None:
+                self.root = (run_id, time.perf_counter())
+            elif node is not None and kwargs.get("name") == node:
+                self.nodes[run_id] = (node, time.perf_counter())
+
+    def _finish_chain(self, run_id, status):
+        with self.lock:
+            if run_id in self.nodes:
+                node, started = self.nodes.pop(run_id)
+                duration = time.perf_counter() - started
+                self.latency_ms[node] += duration * 1000
+                self.counts[node]["calls"] += 1
+            elif self.root is not None and self.root[0] == run_id:
+                duration = time.perf_counter() - self.root[1]
+                self.total_ms = duration * 1000
+                GRAPH_LATENCY.labels(status=status).observe(duration)
+                return
+            else:
+                return
+        NODE_LATENCY.labels(node=node).observe(duration)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish_chain(run_id, "ok")
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish_chain(run_id, "error")
+
+    def _start_llm(self, run_id, metadata):
+        metadata = metadata or {}
+        with self.lock:
+            self.llm_runs[run_id] = (metadata.get("langgraph_node", NO_NODE), metadata.get("ls_model_name", "unknown"),
+                                     time.perf_counter())
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._start_llm(run_id, metadata)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self._start_llm(run_id, metadata)
+
+    def _finish_llm(self, run_id, response=None):
+        with self.lock:
+            if run_id not in self.llm_runs:
+                return
+            node, model, started = self.llm_runs.pop(run_id)
+            input_tokens, output_tokens = token_usage(response) if response is not None else (0, 0)
+            cost = estimate_cost(model, input_tokens, output_tokens)
+            self.counts[node]["llm_calls"] += 1
+            self.counts[node]["input_tokens"] += input_tokens
+            self.counts[node]["output_tokens"] += output_tokens
+            self.cost_usd += cost
+        LLM_LATENCY.labels(node=node, model=model).observe(time.perf_counter() - started)
+        LLM_CALLS.labels(node=node, model=model).inc()
+        LLM_TOKENS.labels(node=node, model=model, direction="input").inc(input_tokens)
+        LLM_TOKENS.labels(node=node, model=model, direction="output").inc(output_tokens)
+        LLM_COST.labels(node=node, model=model).inc(cost)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish_llm(run_id, response)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish_llm(run_id)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        with self.lock:
+            # Nested retrievers are tracked to be skipped, their parent already counts the call
+            nested = parent_run_id in self.retriever_runs
+            self.retriever_runs[run_id] = None if nested else (metadata or {}).get("langgraph_node", NO_NODE)
+
+    def _finish_retriever(self, run_id, documents=()):
+        with self.lock:
+            node = self.retriever_runs.pop(run_id, None)
+            if node is None:
+                return
+            self.counts[node]["retriever_calls"] += 1
+            self.counts[node]["retrieved_documents"] += len(documents)
+        RETRIEVER_CALLS.labels(node=node).inc()
+        RETRIEVED_DOCUMENTS.labels(node=node).inc(len(documents))
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._finish_retriever(run_id, documents)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._finish_retriever(run_id)
+
+    def stats(self):
+        """
+        Timings and counters of the request, in total and per node
+
+        Returns:
+            dict: total_ms, cost_usd, the summed counters and a nodes dict of ms and counters per node
+        """
+        with self.lock:
+            nodes = {node: {"ms": round(self.latency_ms.get(node, 0.0), 3), "calls": counts["calls"],
+                            **{key: counts[key] for key in REQUEST_COUNTERS}}
+                     for node, counts in self.counts.items()}
+            totals = {key: sum(counts[key] for counts in self.counts.values()) for key in REQUEST_COUNTERS}
+            return {"total_ms": self.total_ms, "cost_usd": round(self.cost_usd, 8), **totals, "nodes": nodes}
@@ -1,30 +1,25 @@
-import os
 import warnings
 from dotenv import load_dotenv
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 from langchain.retrievers import ContextualCompressionRetriever
-from langchain_community.document_compressors import FlashrankRerank
 from langchain_core.prompts import MessagesPlaceholder
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate, FewShotChatMessagePromptTemplate
 from app.services.service_interface import GenericLLM
 from app.core.constants import RETRIEVER_PROMPT, EXAMPLES, CONTEXTUALIZE_QUESTION_PROMPT
 from app.utils.utility import format_docs
+from app.services.rerank_service import SharedRerank
+from app.services.provider_service import get_llm
 
 warnings.filterwarnings("ignore")
 load_dotenv()
 
 
 class IpExpertLLM(GenericLLM):
-    def __init__(self, retriever, model, temperature=0):
+    def __init__(self, retriever, model, temperature=0, llm=None, compressor=None):
         super().__init__(model=model, temperature=temperature, retriever=retriever)
-        self.llm = ChatGoogleGenerativeAI(
-            model=model,  # Or another Gemma-based Gemini model like "gemma-3-27b-it"
-            reasoning_effort="none",
-            google_api_key=os.getenv('GEMINI_API_KEY')
-
-        )
+        # Or another Gemma-based Gemini model like "gemma-3-27b-it"
+        self.llm = llm or get_llm(model=model, reasoning_effort="none")
         self.query = None
         self.compression_retriever = None
         self.examples = EXAMPLES
@@ -42,7 +37,7 @@ class IpExpertLLM(GenericLLM):
              ("human", "{question}")
              ])
         self.prompt.input_variables = ["context", "question"]
-        self.compressor = FlashrankRerank()
+        self.compressor = compressor or SharedRerank()
         self.retriever = retriever
         self.rag_chain = None
         self.history_chain = None
@@ -52,6 +47,8 @@ class IpExpertLLM(GenericLLM):
         self.history_aware_retriever = None
         # self.chat_history = ConversationBufferMemory(k=10, return_messages=True)
         self.chat_history = []
+        # Built once, the chain holds no per-request state and can be shared across concurrent requests
+        self.build_rag_chain()
 
     def contextualized_question(self, ip: dict):
         if ip.get("chat_history"):
@@ -70,6 +67,7 @@ class IpExpertLLM(GenericLLM):
                 | self.llm
                 | StrOutputParser()
         )
+        return self.rag_chain
 
     def build_history_aware_rag_chain(self):
         contextualize_q_prompt = ChatPromptTemplate.from_messages(
@@ -82,15 +80,15 @@ class IpExpertLLM(GenericLLM):
 
         self.history_chain = contextualize_q_prompt | self.llm | StrOutputParser()
 
-    def invoke_llm(self, query):
-        self.query = query
-        self.build_rag_chain()
-        return self.rag_chain.invoke({"question": self.query, "chat_history": self.chat_history})
+    def invoke_llm(self, query, chat_history=None):
+        if chat_history is None:
+            chat_history = self.chat_history
+        return self.rag_chain.invoke({"question": query, "chat_history": chat_history})
 
 
 class LLM:
-    def __init__(self, model_name):
-        self.llm = ChatGoogleGenerativeAI(model=model_name, google_api_key=os.getenv('GEMINI_API_KEY'))
+    def __init__(self, model_name, provider=None):
+        self.llm = get_llm(model=model_name, provider=provider)
 
     def get_llm(self):
         return self.llm
@@ -0,0 +1,248 @@
+import time
+import uuid
+import queue
+import logging
+import smtplib
+import threading
+from collections import OrderedDict
+from email import encoders
+from email.mime.base import MIMEBase
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from app.core.settings import get_settings
+from app.services.instrumentation_service import span
+
+MAIL_JOB_STATES = ("queued", "sending", "sent", "partial", "failed")
+DEFAULT_SENDER = "ip-tutor@localhost"
+
+_MAIL_DISPATCHER = None
+_MAIL_DISPATCHER_LOCK = threading.Lock()
+
+
+def build_message(sender, subject, body, attachment=None, attachment_name=None):
+    """
+    Multipart message with an optional attachment, encoded once and reused for every recipient
+
+    Args:
+        sender (str): From address
+        subject (str): Subject line
+        body (str): Plain text body
+        attachment (bytes): Attachment content
+        attachment_name (str): File name of the attachment
+
+    Returns:
+        MIMEMultipart: Message without a To header
+    """
+    message = MIMEMultipart()
+    message["From"] = sender
+    message["Subject"] = subject
+    message.attach(MIMEText(body, "plain"))
+    if attachment is not None:
+        part = MIMEBase("application", "octet-stream")
+        part.set_payload(attachment)
+        encoders.encode_base64(part)
+        part.add_header("Content-Disposition", f"attachment; filename= {attachment_name}")
+        message.attach(part)
+    return message
+
+
+class MailJob:
+    """
+    One email sent to one or more recipients, with its delivery status
+    """
+
+    def __init__(self, recipients, message):
+        self.id = uuid.uuid4().hex
+        self.recipients = recipients
+        self.message = message
+        self.state = "queued"
+        self.sent = []
+        self.failed = {}
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def finish(self, error=None):
+        if error is not None:
+            self.error = error
+            for recipient in self.recipients:
+                if recipient not in self.sent:
+                    self.failed.setdefault(recipient, error)
+        self.state = "sent" if not self.failed else "partial" if self.sent else "failed"
+        self.finished_at = time.time()
+        # The encoded attachment is not needed any more once the job is done
+        self.message = None
+
+    def status(self):
+        return {"job_id": self.id, "state": self.state, "recipients": self.recipients, "sent": list(self.sent),
+                "failed": dict(self.failed), "error": self.error, "created_at": self.created_at,
+                "finished_at": self.finished_at}
+
+
+class MailDispatcher:
+    """
+    Background delivery of emails through one SMTP connection per batch.
+
+    submit() only queues the job and returns its id, so the graph step which sends the quiz does not wait on the mail
+    server. A worker thread takes the queued jobs in batches of up to mail_batch_size, opens one connection, runs
+    STARTTLS and logs in once for the whole batch and sends every recipient of every job over it. A recipient refused
+    by the server fails alone, a broken connection fails the rest of the batch. Finished jobs are kept for
+    mail_job_ttl_seconds so their status can be looked up.
+    """
+
+    def __init__(self, settings=None):
+        self.settings = settings or get_settings()
+        self.queue = queue.Queue()
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.worker = None
+        self.closed = False
+        self.counters = {"jobs": 0, "sent": 0, "failed": 0, "batches": 0, "connections": 0}
+
+    def start(self):
+        with self.lock:
+            if self.worker is None and not self.closed:
+                self.worker = threading.Thread(target=self.run, name="mail_dispatcher", daemon=True)
+                self.worker.start()
+
+    def submit(self, recipients, subject, body, attachment=None, attachment_name=None):
+        """
+        Queue an email
+
+        Returns:
+            str: Job id, to look up its delivery status with get_job
+        """
+        if self.closed:
+            raise RuntimeError("Mail dispatcher is closed")
+        sender = self.settings.email_address or DEFAULT_SENDER
+        job = MailJob(recipients=list(recipients),
+                      message=build_message(sender=sender, subject=subject, body=body, attachment=attachment,
+                                            attachment_name=attachment_name))
+        with self.lock:
+            self.jobs[job.id] = job
+            self.counters["jobs"] += 1
+            self.prune()
+        self.start()
+        self.queue.put(job)
+        return job.id
+
+    def connect(self):
+        settings = self.settings
+        server = smtplib.SMTP(settings.smtp_host, settings.smtp_port, timeout=settings.smtp_timeout_seconds)
+        try:
+            if settings.smtp_starttls:
+                server.starttls()
+            if settings.email_address and settings.email_password:
+                server.login(settings.email_address, settings.email_password)
+        except Exception:
+            server.close()
+            raise
+        with self.lock:
+            self.counters["connections"] += 1
+        return server
+
+    def next_batch(self):
+        """
+        Block until a job is queued, then take the jobs queued meanwhile up to the batch size
+
+        Returns:
+            list: Jobs of the batch, None once the dispatcher is closed
+        """
+        job = self.queue.get()
+        if job is None:
+            return None
+        batch = [job]
+        while len(batch) < self.settings.mail_batch_size:
+            try:
+                job = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                # Deliver what was taken, the worker stops on the next call
+                self.queue.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def send(self, server, job):
+        job.state = "sending"
+        for recipient in job.recipients:
+            del job.message["To"]
+            job.message["To"] = recipient
+            try:
+                server.sendmail(job.message["From"], [recipient], job.message.as_string())
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError) as err_msg:
+                logging.error(f"Email to {recipient} refused: {err_msg}")
+                job.failed[recipient] = str(err_msg)
+                continue
+            job.sent.append(recipient)
+            logging.info(f"Email sent successfully to {recipient}")
+
+    def deliver(self, batch):
+        recipients = sum(len(job.recipients) for job in batch)
+        with span("smtp_batch", jobs=len(batch), recipients=recipients) as attributes:
+            try:
+                with self.connect() as server:
+                    for job in batch:
+                        self.send(server, job)
+                        job.finish()
+            except Exception as err_msg:
+                logging.error(f"Error sending mail:{err_msg}")
+                attributes["error"] = str(err_msg)
+                for job in batch:
+                    if job.finished_at is None:
+                        job.finish(error=str(err_msg))
+        with self.lock:
+            self.counters["batches"] += 1
+            for job in batch:
+                self.counters["sent"] += len(job.sent)
+                self.counters["failed"] += len(job.failed)
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            self.deliver(batch)
+
+    def get_job(self, job_id):
+        """
+        Delivery status of a job, None when it is unknown or expired
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job.status() if job is not None else None
+
+    def prune(self):
+        # Called with the lock held, finished jobs are dropped after their TTL and the oldest beyond mail_max_jobs
+        expiry = time.time() - self.settings.mail_job_ttl_seconds
+        for job_id, job in list(self.jobs.items()):
+            if job.finished_at is not None and (job.finished_at < expiry
+                                                or len(self.jobs) > self.settings.mail_max_jobs):
+                del self.jobs[job_id]
+
+    def close(self, timeout=30):
+        """
+        Deliver the queued jobs and stop the worker
+        """
+        with self.lock:
+            self.closed = True
+            worker = self.worker
+        if worker is not None:
+            self.queue.put(None)
+            worker.join(timeout=timeout)
+
+    def stats(self):
+        with self.lock:
+            states = {state: 0 for state in MAIL_JOB_STATES}
+            for job in self.jobs.values():
+                states[job.state] += 1
+            return {**self.counters, "queued": self.queue.qsize(), "tracked_jobs": len(self.jobs), "states": states}
+
+
+def get_mail_dispatcher():
+    global _MAIL_DISPATCHER
+    with _MAIL_DISPATCHER_LOCK:
+        if _MAIL_DISPATCHER is None:
+            _MAIL_DISPATCHER = MailDispatcher()
+        return _MAIL_DISPATCHER
@@ -0,0 +1,229 @@
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatResult, ChatGeneration
+from langchain_core.output_parsers import PydanticOutputParser
+from app.core.settings import get_settings
+
+_LLM_PROVIDERS = {}
+_EMBEDDING_PROVIDERS = {}
+_RANKER_PROVIDERS = {}
+_PROVIDERS_LOCK = threading.Lock()
+
+# Replies of the fake model per output schema, keyed on the schema name. The flags steer the graph down the plain
+# retrieval path: valid question, no quiz, no web search, documents judged relevant
+CANNED_OUTPUTS = {
+    "Triage": {"generate_quiz": False, "valid_question": True, "valid_quiz_topic": True,
+               "web_search_required": False, "send_email": False},
+    "QuestionValidator": {"valid_question": True},
+    "QuizTopicValidator": {"valid_quiz_topic": True},
+    "WebSearchRequired": {"web_search_required": False},
+    "RelevantDocsExists": {"relevant_docs_exist": True},
+    "GenerateContextualizedQuiz": {"generate_contextualized_quiz": True},
+    "NumQuestions": {"num_questions": 5},
+    "DifficultyLevel": {"difficulty_level": "MEDIUM"},
+    "Quiz": {"questions": "1. Which section of the Patents Act, 1970 defines an invention?",
+             "answer_key": "1. Section 2(1)(j)"},
+    "Grade": {"score": "yes"},
+}
+# Keys the prompts ask for, used to pick the reply when the schema is only described in the prompt text. Checked in
+# order, the first key found in the prompt wins
+PROMPT_KEYS = [('"score"', "Grade"),
+               ("generate_quiz", "Triage"),
+               ("valid_question", "QuestionValidator"),
+               ("valid_quiz_topic", "QuizTopicValidator"),
+               ("generate_contextualized_quiz", "GenerateContextualizedQuiz"),
+               ("relevant_docs_exist", "RelevantDocsExists"),
+               ("web_search_required", "WebSearchRequired"),
+               ("answer_key", "Quiz"),
+               ("num_questions", "NumQuestions"),
+               ("difficulty_level", "DifficultyLevel")]
+# ReAct prompts of the quiz agent end their format description with this line, the agent is answered right away
+REACT_FINAL_ANSWER = "Final Answer:"
+FAKE_ANSWER = "Answer: Under Section 2(1)(j) of the Patents Act, 1970 an invention is a new product or process " \
+              "involving an inventive step and capable of industrial application."
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic local stand-in for the Gemini chat model.
+
+    Replies with the canned JSON of the schema a prompt asks for, or with a fixed answer otherwise, after a configurable
+    latency. The jitter is derived from the prompt, so a given prompt always takes the same time and runs are
+    repeatable. Meant for benchmarks and load tests of the graph and the API without network access or API quota.
+    """
+
+    model: str = "fake"
+    latency_seconds: float = 0.0
+    jitter_seconds: float = 0.0
+    canned_outputs: dict = CANNED_OUTPUTS
+
+    @property
+    def _llm_type(self):
+        return "fake"
+
+    @property
+    def _identifying_params(self):
+        return {"model": self.model, "latency_seconds": self.latency_seconds, "jitter_seconds": self.jitter_seconds}
+
+    def with_structured_output(self, schema, **kwargs):
+        return self.bind(output_schema=schema.__name__) | PydanticOutputParser(pydantic_object=schema)
+
+    def reply(self, text, output_schema=None):
+        if output_schema is None and REACT_FINAL_ANSWER in text:
+            return f"Thought: I now know the final answer\n{REACT_FINAL_ANSWER} {CANNED_OUTPUTS['Quiz']['questions']}"
+        schema_name = output_schema or next((name for key, name in PROMPT_KEYS if key in text), None)
+        if schema_name is None:
+            return FAKE_ANSWER
+        output = self.canned_outputs.get(schema_name)
+        if output is None:
+            logging.warning(f"No canned output for schema {schema_name}, replying with an empty object")
+            output = {}
+        return json.dumps(output)
+
+    def delay(self, text):
+        if not self.jitter_seconds:
+            return self.latency_seconds
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+        return self.latency_seconds + random.Random(seed).uniform(0, self.jitter_seconds)
+
+    def _result(self, text, output_schema):
+        content = self.reply(text, output_schema)
+        # Words stand in for tokens, which keeps the token counters of the instrumentation meaningful in load tests
+        usage = {"input_tokens": len(text.split()), "output_tokens": len(content.split())}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content, usage_metadata=usage))])
+
+    def _generate(self, messages: List[Any], stop: Optional[List[str]] = None, run_manager=None, **kwargs):
+        text = "\n".join(str(message.content) for message in messages)
+        delay = self.delay(text)
+        if delay:
+            time.sleep(delay)
+        return self._result(text, kwargs.get("output_schema"))
+
+    async def _agenerate(self, messages: List[Any], stop: Optional[List[str]] = None, run_manager=None, **kwargs):
+        text = "\n".join(str(message.content) for message in messages)
+        delay = self.delay(text)
+        if delay:
+            await asyncio.sleep(delay)
+        return self._result(text, kwargs.get("output_schema"))
+
+
+class LexicalRanker:
+    """
+    Offline stand-in for the flashrank cross-encoder, scores passages on their word overlap with the query
+    """
+
+    def rerank(self, request):
+        query_words = set(request.query.lower().split())
+        for passage in request.passages:
+            passage["score"] = len(query_words & set(passage["text"].lower().split())) / (1 + len(query_words))
+        return sorted(request.passages, key=lambda passage: passage["score"], reverse=True)
+
+
+def google_llm(model, **kwargs):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model=model, google_api_key=get_settings().gemini_api_key, **kwargs)
+
+
+def fake_llm(model, **kwargs):
+    settings = get_settings()
+    return FakeChatModel(model=model, latency_seconds=settings.fake_llm_latency_seconds,
+                         jitter_seconds=settings.fake_llm_jitter_seconds)
+
+
+def google_embeddings(model):
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(model=model, google_api_key=get_settings().gemini_api_key)
+
+
+def hashing_embeddings(model):
+    from app.services.embedding_service import HashingEmbeddings
+    return HashingEmbeddings(dimensions=get_settings().hashing_embedding_dimensions)
+
+
+def flashrank_ranker(model_name):
+    from flashrank import Ranker
+    return Ranker(model_name=model_name)
+
+
+def lexical_ranker(model_name):
+    return LexicalRanker()
+
+
+def register_llm_provider(name, factory):
+    """
+    Register a chat model provider, factory(model, **kwargs) returns a langchain chat model
+    """
+    with _PROVIDERS_LOCK:
+        _LLM_PROVIDERS[name] = factory
+
+
+def register_embedding_provider(name, factory):
+    """
+    Register an embedding provider, factory(model) returns a langchain Embeddings
+    """
+    with _PROVIDERS_LOCK:
+        _EMBEDDING_PROVIDERS[name] = factory
+
+
+def register_ranker_provider(name, factory):
+    """
+    Register a reranking provider, factory(model_name) returns an object with a flashrank style rerank(request)
+    """
+    with _PROVIDERS_LOCK:
+        _RANKER_PROVIDERS[name] = factory
+
+
+def _get_factory(providers, name, kind):
+    with _PROVIDERS_LOCK:
+        if name not in providers:
+            raise ValueError(f"Unsupported {kind} provider {name}, expected one of {sorted(providers)}")
+        return providers[name]
+
+
+def get_llm(model, provider=None, **kwargs):
+    """
+    Chat model of the configured provider
+
+    Args:
+        model (str): Model name, ignored by the fake provider
+        provider (str): Provider name, the llm_provider setting by default
+        **kwargs: Provider specific model options, e.g. reasoning_effort for Gemini
+
+    Returns:
+        BaseChatModel: Chat model
+    """
+    provider = provider or get_settings().llm_provider
+    return _get_factory(_LLM_PROVIDERS, provider, "LLM")(model, **kwargs)
+
+
+def get_embeddings(model, provider=None):
+    """
+    Embedding model of the configured provider, the embedding_provider setting by default
+    """
+    provider = provider or get_settings().embedding_provider
+    return _get_factory(_EMBEDDING_PROVIDERS, provider, "embedding")(model)
+
+
+def get_ranker_model(model_name, provider=None):
+    """
+    Reranking model of the configured provider, the rerank_provider setting by default
+    """
+    provider = provider or get_settings().rerank_provider
+    return _get_factory(_RANKER_PROVIDERS, provider, "reranking")(model_name)
+
+
+register_llm_provider("google", google_llm)
+register_llm_provider("fake", fake_llm)
+register_embedding_provider("google", google_embeddings)
+register_embedding_provider("hashing", hashing_embeddings)
+register_ranker_provider("flashrank", flashrank_ranker)
+register_ranker_provider("lexical", lexical_ranker)
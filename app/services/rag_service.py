@@ -1,5 +1,26 @@
+import time
+import asyncio
+import hashlib
 import logging
+import threading
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from pydantic import PrivateAttr
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
 from app.services.service_interface import GenericRAG
+from app.utils.utility import get_search_kwargs
+
+_RETRIEVAL_EXECUTOR = None
+_RETRIEVAL_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_retrieval_executor(max_workers=16):
+    global _RETRIEVAL_EXECUTOR
+    with _RETRIEVAL_EXECUTOR_LOCK:
+        if _RETRIEVAL_EXECUTOR is None:
+            _RETRIEVAL_EXECUTOR = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retrieval")
+        return _RETRIEVAL_EXECUTOR
 
 
 class IpRAG(GenericRAG):
@@ -9,7 +30,95 @@ class IpRAG(GenericRAG):
         self.compression_retriever = None
 
     def get_retrieved_document(self, **kwargs):
-        return self.retriever.as_retriever(
+        self.relevant_doc = self.retriever.as_retriever(
             search_type="similarity",
-            k=kwargs.get("top_k", 10),
+            search_kwargs=get_search_kwargs(search_mode=kwargs.get("search_mode", "hybrid"),
+                                            num_docs=kwargs.get("top_k", 10),
+                                            ranker_type=kwargs.get("ranker_type", "rrf"),
+                                            ranker_params=kwargs.get("ranker_params")),
         )
+        return self.relevant_doc
+
+
+class FusionRetriever(BaseRetriever):
+    """
+    Searches all collections concurrently and fuses the results with weighted reciprocal rank fusion.
+
+    Identical chunks returned by several collections (the extended and Hindi corpora repeat parts of the manual) are
+    merged into a single document. Every fused document carries the collections and ranks it was found at in its
+    metadata, and per-collection latencies are available through latency_stats().
+    """
+
+    retrievers: List[BaseRetriever]
+    names: List[str]
+    weights: List[float]
+    c: int = 60
+    top_k: Optional[int] = None
+    _latency: dict = PrivateAttr(default_factory=dict)
+    _latency_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @staticmethod
+    def chunk_key(text):
+        return hashlib.sha1(" ".join(text.split()).casefold().encode("utf-8")).hexdigest()
+
+    def record_latency(self, name, elapsed):
+        with self._latency_lock:
+            stats = self._latency.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0})
+            stats["count"] += 1
+            stats["total_ms"] += elapsed * 1000
+            stats["last_ms"] = elapsed * 1000
+            stats["max_ms"] = max(stats["max_ms"], elapsed * 1000)
+
+    def latency_stats(self):
+        with self._latency_lock:
+            return {name: {"count": stats["count"],
+                           "mean_ms": stats["total_ms"] / stats["count"],
+                           "max_ms": stats["max_ms"],
+                           "last_ms": stats["last_ms"]}
+                    for name, stats in self._latency.items()}
+
+    def fuse(self, results):
+        fused = {}
+        for name, weight, documents in zip(self.names, self.weights, results):
+            for rank, doc in enumerate(documents):
+                key = self.chunk_key(doc.page_content)
+                if key not in fused:
+                    fused[key] = {"doc": doc, "score": 0.0, "ranks": {}}
+                fused[key]["score"] += weight / (self.c + rank + 1)
+                fused[key]["ranks"].setdefault(name, rank)
+
+        ranked = sorted(fused.values(), key=lambda item: item["score"], reverse=True)
+        if self.top_k:
+            ranked = ranked[:self.top_k]
+        return [Document(page_content=item["doc"].page_content,
+                         metadata={**item["doc"].metadata,
+                                   "fusion_score": item["score"],
+                                   "retrieval_ranks": item["ranks"],
+                                   "retrieval_collections": list(item["ranks"])})
+                for item in ranked]
+
+    def timed_invoke(self, name, retriever, query, config):
+        start = time.perf_counter()
+        documents = retriever.invoke(query, config=config)
+        self.record_latency(name, time.perf_counter() - start)
+        return documents
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        config = {"callbacks": run_manager.get_child()}
+        futures = [get_retrieval_executor().submit(self.timed_invoke, name, retriever, query, config)
+                   for name, retriever in zip(self.names, self.retrievers)]
+        results = [future.result() for future in futures]
+        logging.info(f"Retrieval latency per collection: {self.latency_stats()}")
+        return self.fuse(results)
+
+    async def timed_ainvoke(self, name, retriever, query, config):
+        start = time.perf_counter()
+        documents = await retriever.ainvoke(query, config=config)
+        self.record_latency(name, time.perf_counter() - start)
+        return documents
+
+    async def _aget_relevant_documents(self, query, *, run_manager):
+        config = {"callbacks": run_manager.get_child()}
+        results = await asyncio.gather(*[self.timed_ainvoke(name, retriever, query, config)
+                                         for name, retriever in zip(self.names, self.retrievers)])
+        return self.fuse(results)
@@ -0,0 +1,148 @@
+import hashlib
+import logging
+import threading
+from itertools import combinations
+from collections import OrderedDict
+from typing import Optional, Sequence
+from pydantic import ConfigDict, field_validator
+from langchain_core.callbacks.manager import Callbacks
+from langchain_core.documents import BaseDocumentCompressor, Document
+from app.services.provider_service import get_ranker_model
+
+DEFAULT_RERANK_MODEL = "ms-marco-MultiBERT-L-12"
+RERANK_MODES = ("always", "on_disagreement")
+
+_RANKERS = {}
+_RANKERS_LOCK = threading.Lock()
+_SCORE_CACHE = OrderedDict()
+_SCORE_CACHE_LOCK = threading.Lock()
+_SCORE_CACHE_STATS = {"hits": 0, "misses": 0, "skipped": 0}
+
+
+def get_ranker(model_name=DEFAULT_RERANK_MODEL):
+    """
+    Cross-encoder of the configured reranking provider for the given model, loaded once per process
+    """
+    with _RANKERS_LOCK:
+        if model_name not in _RANKERS:
+            logging.info(f"Loading reranking model {model_name}")
+            _RANKERS[model_name] = get_ranker_model(model_name=model_name)
+        return _RANKERS[model_name]
+
+
+def _text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def score_pairs(query, texts, model_name=DEFAULT_RERANK_MODEL, batch_size=32, cache_size=4096):
+    """
+    Cross-encoder scores for (query, passage) pairs
+
+    Pairs scored recently are served from a process wide LRU, the remaining ones are scored in batches of batch_size
+    with a single forward pass per batch.
+
+    Args:
+        query (str): Search query
+        texts (list): Passages to score
+
+    Returns:
+        list: Relevance score of every passage, in input order
+    """
+    query_hash = _text_hash(query)
+    keys = [(model_name, query_hash, _text_hash(text)) for text in texts]
+    scores = {}
+    with _SCORE_CACHE_LOCK:
+        for key in keys:
+            if key in _SCORE_CACHE:
+                _SCORE_CACHE.move_to_end(key)
+                scores[key] = _SCORE_CACHE[key]
+                _SCORE_CACHE_STATS["hits"] += 1
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in scores:
+            missing.setdefault(key, text)
+    if missing:
+        from flashrank import RerankRequest
+        ranker = get_ranker(model_name=model_name)
+        items = list(missing.items())
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            passages = [{"id": i, "text": text} for i, (_, text) in enumerate(batch)]
+            for passage in ranker.rerank(RerankRequest(query=query, passages=passages)):
+                scores[batch[passage["id"]][0]] = float(passage["score"])
+        with _SCORE_CACHE_LOCK:
+            _SCORE_CACHE_STATS["misses"] += len(missing)
+            for key in missing:
+                _SCORE_CACHE[key] = scores[key]
+            while len(_SCORE_CACHE) > cache_size:
+                _SCORE_CACHE.popitem(last=False)
+    return [scores[key] for key in keys]
+
+
+def rerank_stats():
+    with _SCORE_CACHE_LOCK:
+        return {**_SCORE_CACHE_STATS, "cached_pairs": len(_SCORE_CACHE), "loaded_models": list(_RANKERS)}
+
+
+class SharedRerank(BaseDocumentCompressor):
+    """
+    Document compressor backed by the process wide reranking model and pair score cache.
+
+    In "on_disagreement" mode the cross-encoder is skipped when the collections searched by the FusionRetriever
+    already agree on their top results, the fused order is kept as is in that case.
+    """
+
+    model_name: str = DEFAULT_RERANK_MODEL
+    top_n: int = 3
+    score_threshold: float = 0.0
+    batch_size: int = 32
+    cache_size: int = 4096
+    rerank_mode: str = "always"
+    agreement_k: int = 3
+    agreement_threshold: float = 0.6
+
+    model_config = ConfigDict(extra="forbid")
+
+    @field_validator("rerank_mode")
+    @classmethod
+    def validate_rerank_mode(cls, value):
+        if value not in RERANK_MODES:
+            raise ValueError(f"Unsupported rerank mode {value}, expected one of {RERANK_MODES}")
+        return value
+
+    def collections_agree(self, documents):
+        top_docs = {}
+        for doc in documents:
+            for collection, rank in doc.metadata.get("retrieval_ranks", {}).items():
+                if rank < self.agreement_k:
+                    top_docs.setdefault(collection, set()).add(_text_hash(doc.page_content))
+        if not top_docs:
+            # Documents without fusion metadata, e.g. from the EnsembleRetriever, can not be compared
+            return False
+        for first, second in combinations(top_docs.values(), 2):
+            if len(first & second) / len(first | second) < self.agreement_threshold:
+                return False
+        return True
+
+    def compress_documents(
+            self,
+            documents: Sequence[Document],
+            query: str,
+            callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        documents = list(documents)
+        if not documents:
+            return []
+        if self.rerank_mode == "on_disagreement" and self.collections_agree(documents):
+            with _SCORE_CACHE_LOCK:
+                _SCORE_CACHE_STATS["skipped"] += 1
+            logging.info("---COLLECTIONS AGREE, SKIPPING RERANK---")
+            return documents[:self.top_n]
+
+        scores = score_pairs(query=query, texts=[doc.page_content for doc in documents], model_name=self.model_name,
+                             batch_size=self.batch_size, cache_size=self.cache_size)
+        ranked = sorted(zip(scores, range(len(documents))), reverse=True)[:self.top_n]
+        return [Document(page_content=documents[i].page_content,
+                         metadata={"id": i, "relevance_score": score, **documents[i].metadata})
+                for score, i in ranked if score >= self.score_threshold]
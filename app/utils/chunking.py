@@ -0,0 +1,144 @@
+import re
+from typing import Optional, Sequence
+from datasketch import MinHash, MinHashLSH
+from langchain_core.callbacks.manager import Callbacks
+from langchain_core.documents import BaseDocumentCompressor, Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter, TextSplitter
+
+CHUNKERS = ("recursive", "legal")
+# Default (chunk_size, chunk_overlap) of every chunker
+CHUNKER_DEFAULTS = {"recursive": (2500, 1400), "legal": (1500, 150)}
+
+# Chapter, part, section and rule headings and numbered paragraphs such as "05.03" start a new section of the manuals
+SECTION_PATTERN = re.compile(
+    r"^(?=[ \t]*(?:chapter[ \t]+[\dIVXLC]+|part[ \t]+[\dIVXLC]+|section[ \t]+\d+[A-Z]?\b|rule[ \t]+\d+[A-Z]?\b"
+    r"|\d{1,3}(?:\.\d{1,3})+\.?[ \t]))",
+    re.IGNORECASE | re.MULTILINE)
+# Numbered clauses and sub-clauses: "1.", "(1)", "(a)", "(iv)"
+CLAUSE_PATTERN = re.compile(r"^(?=[ \t]*(?:\d{1,3}\.[ \t]|\(\d{1,3}\)[ \t]|\([a-z]{1,4}\)[ \t]))", re.MULTILINE)
+
+
+class LegalTextSplitter(TextSplitter):
+    """
+    Structure-aware splitter for the IP law manuals.
+
+    Text is split on chapter, section, rule and numbered paragraph headings first, sections longer than chunk_size on
+    their numbered clauses, and only clauses which are still too long fall back to the recursive character splitter.
+    Consecutive sections are merged up to chunk_size, the overlap between chunks is made of whole trailing sections or
+    clauses no longer than chunk_overlap.
+    """
+
+    def __init__(self, chunk_size=1500, chunk_overlap=150, **kwargs):
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, strip_whitespace=True, **kwargs)
+        self.fallback_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                                                length_function=self._length_function,
+                                                                separators=["\n\n", "\n", " ", ""])
+
+    def split_units(self, text):
+        """
+        Yield (text, mergeable) units, units which are not mergeable are already chunks of the fallback splitter
+        """
+        for section in SECTION_PATTERN.split(text):
+            if not section.strip():
+                continue
+            if self._length_function(section) <= self._chunk_size:
+                yield section, True
+                continue
+            for clause in CLAUSE_PATTERN.split(section):
+                if not clause.strip():
+                    continue
+                if self._length_function(clause) <= self._chunk_size:
+                    yield clause, True
+                else:
+                    for chunk in self.fallback_splitter.split_text(clause):
+                        yield chunk, False
+
+    def split_text(self, text):
+        chunks = []
+        mergeable = []
+        for unit, is_mergeable in self.split_units(text):
+            if is_mergeable:
+                mergeable.append(unit)
+                continue
+            chunks.extend(self._merge_splits(mergeable, ""))
+            mergeable = []
+            chunks.append(unit)
+        chunks.extend(self._merge_splits(mergeable, ""))
+        return chunks
+
+
+def get_splitter(chunker="legal", chunk_size=None, chunk_overlap=None):
+    """
+    Text splitter used to chunk the manuals at ingest time
+
+    Args:
+        chunker (str): "legal" for the structure-aware splitter, "recursive" for the character splitter
+        chunk_size (int): Defaults to the chunker default of CHUNKER_DEFAULTS
+        chunk_overlap (int): Defaults to the chunker default of CHUNKER_DEFAULTS
+
+    Returns:
+        TextSplitter: Splitter adding the start index of every chunk to its metadata
+    """
+    if chunker not in CHUNKERS:
+        raise ValueError(f"Unsupported chunker {chunker}, expected one of {CHUNKERS}")
+    default_size, default_overlap = CHUNKER_DEFAULTS[chunker]
+    chunk_size = chunk_size or default_size
+    chunk_overlap = default_overlap if chunk_overlap is None else chunk_overlap
+    if chunker == "legal":
+        return LegalTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+    return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len,
+                                          separators=["\n\n", "\n", " ", ""], add_start_index=True)
+
+
+class NearDuplicateFilter:
+    """
+    MinHash LSH index over word shingles, flags texts whose estimated Jaccard similarity with an already seen text
+    reaches threshold
+    """
+
+    def __init__(self, threshold=0.85, num_perm=128, shingle_size=5):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        self.size = 0
+
+    def minhash(self, text):
+        words = re.findall(r"\w+", text.lower())
+        shingles = {" ".join(words[i:i + self.shingle_size])
+                    for i in range(max(len(words) - self.shingle_size + 1, 1))}
+        minhash = MinHash(num_perm=self.num_perm, seed=1)
+        minhash.update_batch([shingle.encode("utf-8") for shingle in shingles])
+        return minhash
+
+    def is_duplicate(self, text):
+        """
+        Check text against the index and add it when it is not a near-duplicate
+        """
+        minhash = self.minhash(text)
+        if self.lsh.query(minhash):
+            return True
+        self.lsh.insert(str(self.size), minhash)
+        self.size += 1
+        return False
+
+    def filter(self, documents):
+        return [doc for doc in documents if not self.is_duplicate(doc.page_content)]
+
+
+class NearDuplicateCompressor(BaseDocumentCompressor):
+    """
+    Drops retrieved documents which are near-duplicates of a higher ranked one, e.g. overlapping chunks or the same
+    passage retrieved from several collections
+    """
+
+    threshold: float = 0.85
+    num_perm: int = 128
+
+    def compress_documents(
+            self,
+            documents: Sequence[Document],
+            query: str,
+            callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        return NearDuplicateFilter(threshold=self.threshold, num_perm=self.num_perm).filter(documents)
@@ -1,20 +1,146 @@
+import os
+import json
+import time
 from langchain_milvus import Milvus, BM25BuiltInFunction
+from app.core.milvus_registry import get_milvus_registry
+from app.core.constants import COLLECTION_VERSIONS_FILE, TARGET_COLLECTIONS, INDEX_CONFIG_FILE, INDEX_PRESETS, \
+    DEFAULT_INDEX_TYPE
 
 
-def get_interim_retrievers(ip_embedding, target_collections=["ip_laws", "ip_laws_extended", "ip_laws_hindi"]
-                           , uri="/Users/sourabpanchanan/PycharmProjects/lma-major-project-raggers/milvus_db.db",
-                           num_docs=10):
-    for collection_name in target_collections:
-        yield Milvus(
+SEARCH_MODES = ("hybrid", "dense")
+SPARSE_SEARCH_PARAM = {"metric_type": "BM25", "params": {}}
+
+
+def get_search_kwargs(search_mode="hybrid", num_docs=10, ranker_type="rrf", ranker_params=None, fetch_k=None):
+    """
+    Search kwargs for a Milvus retriever.
+
+    In hybrid mode Milvus runs one hybrid_search request with an ANN request on the dense field and a BM25 request on
+    the sparse field, merged by the RRF or weighted ranker. fetch_k is the number of candidates taken from each field.
+    """
+    if search_mode not in SEARCH_MODES:
+        raise ValueError(f"Unsupported search mode {search_mode}, expected one of {SEARCH_MODES}")
+    if search_mode == "dense":
+        return {"k": num_docs}
+    if ranker_params is None:
+        ranker_params = {"k": 60} if ranker_type == "rrf" else {"weights": [0.6, 0.4]}
+    return {"k": num_docs,
+            "fetch_k": fetch_k or num_docs * 2,
+            "ranker_type": ranker_type,
+            "ranker_params": ranker_params}
+
+
+def get_dense_index_param(index_type=DEFAULT_INDEX_TYPE, index_params=None):
+    """
+    Index params of the dense field, the preset build params of index_type updated with index_params
+    """
+    if index_type not in INDEX_PRESETS:
+        raise ValueError(f"Unsupported index type {index_type}, expected one of {tuple(INDEX_PRESETS)}")
+    return {"metric_type": "COSINE",
+            "index_type": index_type,
+            "params": INDEX_PRESETS[index_type]["index_params"] | (index_params or {})}
+
+
+def get_dense_search_param(index_type=DEFAULT_INDEX_TYPE, search_params=None, limit=None):
+    """
+    Search params of the dense field, the preset search params of index_type updated with search_params.
+    HNSW needs ef >= the number of results, ef is raised to limit if needed.
+    """
+    if index_type not in INDEX_PRESETS:
+        raise ValueError(f"Unsupported index type {index_type}, expected one of {tuple(INDEX_PRESETS)}")
+    params = INDEX_PRESETS[index_type]["search_params"] | (search_params or {})
+    if "ef" in params and limit:
+        params["ef"] = max(params["ef"], limit)
+    return {"metric_type": "COSINE", "params": params}
+
+
+def read_index_config(index_config_file=INDEX_CONFIG_FILE):
+    try:
+        with open(index_config_file, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def write_index_config(collection_name, index_type=DEFAULT_INDEX_TYPE, index_params=None, search_params=None,
+                       index_config_file=INDEX_CONFIG_FILE):
+    """
+    Record the dense index a collection was created with, the retrievers search it with matching search params
+    """
+    index_config = read_index_config(index_config_file=index_config_file)
+    index_config[collection_name] = {"index_type": index_type,
+                                     "index_params": get_dense_index_param(index_type, index_params)["params"],
+                                     "search_params": get_dense_search_param(index_type, search_params)["params"]}
+    tmp_file = f"{index_config_file}.tmp"
+    with open(tmp_file, "w") as file:
+        json.dump(index_config, file, indent=2)
+    os.replace(tmp_file, index_config_file)
+    return index_config
+
+
+def embedding_identity(ip_embedding):
+    """
+    Stable key of an embedding model, unlike id() it is never reused by another object after garbage collection
+    """
+    model = getattr(ip_embedding, "model", None) or getattr(ip_embedding, "dimensions", None)
+    return f"{type(ip_embedding).__name__}:{model}"
+
+
+def get_milvus_store(ip_embedding, collection_name, uri=None, search_mode="hybrid", search_params=None):
+    """
+    Shared Milvus store of a collection, search_params are the dense search params, Milvus defaults to the
+    langchain-milvus defaults of the collection index when they are not given
+    """
+    registry = get_milvus_registry()
+    connection_args = registry.connection_args(uri)
+
+    def create_store():
+        if search_mode == "dense":
+            return Milvus(
+                embedding_function=ip_embedding,
+                connection_args=connection_args,
+                collection_name=collection_name,
+                partition_key_field=None,
+                vector_field="dense",
+                search_params=search_params,
+            )
+        return Milvus(
             embedding_function=ip_embedding,
             builtin_function=BM25BuiltInFunction(),
-            connection_args={"uri": uri},
+            connection_args=connection_args,
             collection_name=collection_name,
             partition_key_field=None,
             vector_field=["dense", "sparse"],
-        ).as_retriever(
+            search_params=[search_params, SPARSE_SEARCH_PARAM] if search_params else None,
+        )
+
+    key = (connection_args["uri"], collection_name, search_mode, json.dumps(search_params, sort_keys=True),
+           embedding_identity(ip_embedding))
+    return registry.get_store(key, create_store)
+
+
+def get_interim_retrievers(ip_embedding, target_collections=TARGET_COLLECTIONS, uri=None,
+                           num_docs=10, search_mode="hybrid", ranker_type="rrf", ranker_params=None, fetch_k=None,
+                           index_config=None):
+    """
+    Retrievers of the target collections, index_config maps collection names to their index type and search params
+    as written by write_index_config, collections without an entry are searched with the langchain-milvus defaults
+    """
+    search_kwargs = get_search_kwargs(search_mode=search_mode, num_docs=num_docs, ranker_type=ranker_type,
+                                      ranker_params=ranker_params, fetch_k=fetch_k)
+    if index_config is None:
+        index_config = read_index_config()
+    for collection_name in target_collections:
+        collection_index = index_config.get(collection_name)
+        search_params = None
+        if collection_index is not None:
+            search_params = get_dense_search_param(index_type=collection_index["index_type"],
+                                                   search_params=collection_index.get("search_params"),
+                                                   limit=search_kwargs.get("fetch_k", search_kwargs["k"]))
+        yield get_milvus_store(ip_embedding=ip_embedding, collection_name=collection_name, uri=uri,
+                               search_mode=search_mode, search_params=search_params).as_retriever(
             search_type="similarity",
-            k=num_docs,
+            search_kwargs=search_kwargs,
         )
 
 
@@ -24,3 +150,24 @@ def format_docs(documents):
 
 def format_docs(docs):
     return "".join(doc.page_content for doc in docs)
+
+
+def read_collection_versions(versions_file=COLLECTION_VERSIONS_FILE):
+    try:
+        with open(versions_file, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def bump_collection_version(collection_name, versions_file=COLLECTION_VERSIONS_FILE):
+    """
+    Record that a collection was (re)loaded, so that caches built on top of it can be invalidated
+    """
+    versions = read_collection_versions(versions_file=versions_file)
+    versions[collection_name] = time.time_ns()
+    tmp_file = f"{versions_file}.tmp"
+    with open(tmp_file, "w") as file:
+        json.dump(versions, file)
+    os.replace(tmp_file, versions_file)
+    return versions
@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+from app.services.embedding_service import HashingEmbeddings, VectorStore
+from app.services.ingestion_service import IngestionPipeline, expand_pdf_paths
+from app.utils.chunking import NearDuplicateCompressor
+from app.utils.utility import get_search_kwargs
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "samples")
+# (name, chunker, chunk_size, chunk_overlap, ingest dedupe threshold)
+CONFIGS = [("recursive 2500/1400", "recursive", 2500, 1400, None),
+           ("legal 1500/150", "legal", 1500, 150, None),
+           ("legal 1500/150 + dedupe", "legal", 1500, 150, 0.85)]
+
+
+def normalize(text):
+    # PDF text extraction wraps lines, answers are matched on whitespace-normalized text
+    return " ".join(text.split())
+
+
+def db_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def run(pdf_paths, queries, chunker, chunk_size, chunk_overlap, dedupe_threshold, k, workdir):
+    """
+    Ingest the PDFs into a fresh Milvus Lite database with one chunker configuration and measure its footprint and
+    the recall@k of the answer keys of the queries.
+    A query is recalled when one of the k retrieved chunks contains its answer key, the number of characters sent to
+    the LLM is measured after dropping near-duplicate retrieved chunks, as the workflow does.
+    """
+    milvus_uri = os.path.join(workdir, f"{chunker}_{chunk_size}_{chunk_overlap}_{dedupe_threshold}.db")
+    embedding = HashingEmbeddings()
+    vector_store = VectorStore().get_ingestion_store(embedding=embedding, milvus_uri=milvus_uri,
+                                                     target_collection="benchmark", partition_key=None,
+                                                     drop_old=True)
+    chunk_chars = []
+    original_embed = embedding.embed_documents
+
+    def embed_documents(texts):
+        chunk_chars.extend(len(text) for text in texts)
+        return original_embed(texts)
+
+    embedding.embed_documents = embed_documents
+    pipeline = IngestionPipeline(embedding=embedding, chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                 chunker=chunker, dedupe_threshold=dedupe_threshold, parse_workers=2)
+    started = time.perf_counter()
+    stats = pipeline.run(pdf_paths, vector_store)
+    ingest_seconds = time.perf_counter() - started
+
+    retriever = vector_store.as_retriever(search_type="similarity",
+                                          search_kwargs=get_search_kwargs(search_mode="hybrid", num_docs=k))
+    compressor = NearDuplicateCompressor()
+    hits = 0
+    context_chars = 0
+    for query in queries:
+        documents = compressor.compress_documents(retriever.invoke(query["question"]), query["question"])
+        hits += any(normalize(query["answer"]) in normalize(doc.page_content) for doc in documents)
+        context_chars += sum(len(doc.page_content) for doc in documents)
+    return {"chunks": stats["chunks"],
+            "duplicates_skipped": stats["duplicates"],
+            "embedded_chars": sum(chunk_chars),
+            "db_kb": db_size(milvus_uri) / 1024,
+            "ingest_s": ingest_seconds,
+            f"recall@{k}": hits / len(queries),
+            "context_chars_per_query": context_chars / len(queries)}
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Compare chunking strategies on chunk count, storage, ingest time "
+                                                 "and retrieval recall.")
+    parser.add_argument("--pdf_path", help="PDF file, directory or glob pattern to ingest",
+                        default=os.path.join(SAMPLES_DIR, "sample_ip_manual.pdf"))
+    parser.add_argument("--queries_path", help="JSON list of {question, answer} objects, answer being a passage "
+                                               "the retrieved chunks must contain",
+                        default=os.path.join(SAMPLES_DIR, "sample_ip_manual_queries.json"))
+    parser.add_argument("--k", help="Number of chunks retrieved per query", type=int, default=5)
+    parser.add_argument("--workdir", help="Directory for the Milvus Lite databases, a temporary one by default",
+                        default=None)
+    args = parser.parse_args()
+
+    with open(args.queries_path, "r") as file:
+        queries = json.load(file)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="benchmark_chunking_")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        for name, chunker, chunk_size, chunk_overlap, dedupe_threshold in CONFIGS:
+            result = run(pdf_paths=expand_pdf_paths(args.pdf_path), queries=queries, chunker=chunker,
+                         chunk_size=chunk_size, chunk_overlap=chunk_overlap, dedupe_threshold=dedupe_threshold,
+                         k=args.k, workdir=workdir)
+            print(" | ".join([f"config: {name}"] + [f"{key}: {value:.3f}" if isinstance(value, float)
+                                                     else f"{key}: {value}" for key, value in result.items()]))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import numpy as np
+from pymilvus import MilvusClient, DataType, MilvusException
+from app.services.embedding_service import HashingEmbeddings
+from app.services.ingestion_service import expand_pdf_paths, parse_page_range, count_pages
+from app.utils.chunking import get_splitter
+from app.utils.utility import get_dense_index_param, get_dense_search_param
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "samples")
+# (index type, build params overriding the preset, search params swept over)
+CONFIGS = [("FLAT", None, [{}]),
+           ("IVF_FLAT", None, [{"nprobe": 8}, {"nprobe": 16}, {"nprobe": 64}]),
+           ("IVF_SQ8", None, [{"nprobe": 16}, {"nprobe": 64}]),
+           ("IVF_PQ", None, [{"nprobe": 16}, {"nprobe": 64}]),
+           ("HNSW", None, [{"ef": 32}, {"ef": 64}, {"ef": 128}])]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def load_vectors(pdf_path, queries_path, dimensions, num_vectors, num_queries, seed=7):
+    """
+    Embed the chunks of the sample documents and the sample questions.
+    The sample corpus is far smaller than a real collection, it is padded to num_vectors with noisy copies of the chunk
+    vectors, which keeps the clustered distribution of the chunks, and the questions with noisy copies of chunks.
+    """
+    rng = np.random.default_rng(seed)
+    embedding = HashingEmbeddings(dimensions=dimensions)
+    splitter = get_splitter()
+    texts = [chunk.page_content for pdf_path in expand_pdf_paths(pdf_path)
+             for chunk in splitter.split_documents(parse_page_range(pdf_path, 0, count_pages(pdf_path)))]
+    with open(queries_path, "r") as file:
+        questions = [query["question"] for query in json.load(file)]
+    corpus = np.array(embedding.embed_documents(texts), dtype=np.float32)
+    queries = np.array(embedding.embed_documents(questions), dtype=np.float32)[:num_queries]
+
+    def noisy_copies(vectors, count, scale):
+        copies = vectors[rng.integers(0, len(vectors), count)] + rng.normal(0, scale, (count, dimensions))
+        return (copies / np.linalg.norm(copies, axis=1, keepdims=True)).astype(np.float32)
+
+    if len(corpus) < num_vectors:
+        corpus = np.vstack([corpus, noisy_copies(corpus, num_vectors - len(corpus), 0.03)])
+    if len(queries) < num_queries:
+        queries = np.vstack([queries, noisy_copies(corpus, num_queries - len(queries), 0.05)])
+    return corpus, queries
+
+
+def exact_top_k(corpus, queries, k):
+    # Vectors are L2 normalized, the dot product is the cosine similarity
+    scores = queries @ corpus.T
+    return [set(row) for row in np.argsort(-scores, axis=1)[:, :k]]
+
+
+def create_collection(client, collection_name, dimensions, index_type, index_params):
+    if client.has_collection(collection_name):
+        client.drop_collection(collection_name)
+    schema = client.create_schema(auto_id=False)
+    schema.add_field(field_name="pk", datatype=DataType.INT64, is_primary=True)
+    schema.add_field(field_name="dense", datatype=DataType.FLOAT_VECTOR, dim=dimensions)
+    dense_index_param = get_dense_index_param(index_type=index_type, index_params=index_params)
+    milvus_index_params = client.prepare_index_params()
+    milvus_index_params.add_index(field_name="dense", metric_type=dense_index_param["metric_type"],
+                                  index_type=dense_index_param["index_type"], params=dense_index_param["params"])
+    client.create_collection(collection_name=collection_name, schema=schema, index_params=milvus_index_params)
+
+
+def run(client, corpus, queries, truth, index_type, index_params, search_params_list, k):
+    """
+    Build one index over the corpus and measure recall@k against the exact neighbours and the per-query latency for
+    every search params of search_params_list
+    """
+    collection_name = f"benchmark_{index_type.lower()}"
+    started = time.perf_counter()
+    create_collection(client, collection_name, corpus.shape[1], index_type, index_params)
+    for start in range(0, len(corpus), 1000):
+        client.insert(collection_name=collection_name,
+                      data=[{"pk": start + i, "dense": vector.tolist()}
+                            for i, vector in enumerate(corpus[start:start + 1000])])
+    client.flush(collection_name=collection_name)
+    client.load_collection(collection_name=collection_name)
+    build_seconds = time.perf_counter() - started
+    results = []
+    for search_params in search_params_list:
+        search_param = get_dense_search_param(index_type=index_type, search_params=search_params, limit=k)
+        latency = []
+        recall = []
+        for query, expected in zip(queries, truth):
+            query_started = time.perf_counter()
+            hits = client.search(collection_name=collection_name, data=[query.tolist()], anns_field="dense",
+                                 limit=k, search_params=search_param)[0]
+            latency.append((time.perf_counter() - query_started) * 1000)
+            recall.append(len(expected & {hit["id"] for hit in hits}) / k)
+        results.append({"index": index_type,
+                        "search_params": json.dumps(search_param["params"]),
+                        "build_s": build_seconds,
+                        f"recall@{k}": float(np.mean(recall)),
+                        "latency_p50_ms": percentile(latency, 50),
+                        "latency_p99_ms": percentile(latency, 99)})
+    client.drop_collection(collection_name=collection_name)
+    return results
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Compare dense index types and search params on recall and query "
+                                                 "latency.")
+    parser.add_argument("--milvus_uri", help="Milvus URI, a temporary Milvus Lite file by default. Milvus Lite only "
+                                             "builds FLAT and IVF_FLAT, the other index types need a Milvus server",
+                        default=None)
+    parser.add_argument("--pdf_path", help="PDF file, directory or glob pattern of the sample documents",
+                        default=os.path.join(SAMPLES_DIR, "sample_ip_manual.pdf"))
+    parser.add_argument("--queries_path", help="JSON list of {question, answer} objects used as queries",
+                        default=os.path.join(SAMPLES_DIR, "sample_ip_manual_queries.json"))
+    parser.add_argument("--num_vectors", help="Size the corpus is padded to", type=int, default=20000)
+    parser.add_argument("--num_queries", help="Number of queries per configuration", type=int, default=200)
+    parser.add_argument("--dimensions", help="Embedding dimension, 768 like the production embedding model",
+                        type=int, default=768)
+    parser.add_argument("--k", help="Number of neighbours retrieved per query", type=int, default=10)
+    args = parser.parse_args()
+
+    corpus, queries = load_vectors(pdf_path=args.pdf_path, queries_path=args.queries_path,
+                                   dimensions=args.dimensions, num_vectors=args.num_vectors,
+                                   num_queries=args.num_queries)
+    truth = exact_top_k(corpus, queries, args.k)
+    workdir = None
+    milvus_uri = args.milvus_uri
+    if milvus_uri is None:
+        workdir = tempfile.mkdtemp(prefix="benchmark_index_")
+        milvus_uri = os.path.join(workdir, "benchmark.db")
+    client = MilvusClient(milvus_uri)
+    try:
+        for index_type, index_params, search_params_list in CONFIGS:
+            try:
+                results = run(client=client, corpus=corpus, queries=queries, truth=truth, index_type=index_type,
+                              index_params=index_params, search_params_list=search_params_list, k=args.k)
+            except MilvusException as err_msg:
+                print(f"index: {index_type} | skipped: {err_msg.message}")
+                continue
+            for result in results:
+                print(" | ".join(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}"
+                                 for key, value in result.items()))
+    finally:
+        client.close()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,67 @@
+import time
+import logging
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.documents.compressor import BaseDocumentCompressor
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from app.services.llm_service import IpExpertLLM
+
+
+class StaticRetriever(BaseRetriever):
+    def _get_relevant_documents(self, query, *, run_manager):
+        return [Document(page_content=f"Section {i}A of the Patents Act, 1970", metadata={"page": i}) for i in range(10)]
+
+
+class PassThroughCompressor(BaseDocumentCompressor):
+    def compress_documents(self, documents, query, callbacks=None):
+        return documents[:3]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def run(llm_obj, rebuild, num_requests, concurrency):
+    """
+    Invoke the RAG chain num_requests times from concurrency threads.
+    With rebuild=True every request constructs the chain first, as invoke_llm used to do.
+    """
+
+    def request(i):
+        start = time.perf_counter()
+        chain = llm_obj.build_rag_chain() if rebuild else llm_obj.rag_chain
+        built = time.perf_counter()
+        chain.invoke({"question": f"What does section {i % 10}A say?", "chat_history": []})
+        return built - start, time.perf_counter() - start
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        timings = list(executor.map(request, range(num_requests)))
+    elapsed = time.perf_counter() - started
+    construction = [timing[0] * 1000 for timing in timings]
+    latency = [timing[1] * 1000 for timing in timings]
+    return {"mode": "rebuild per request" if rebuild else "reuse prebuilt",
+            "throughput_rps": num_requests / elapsed,
+            "construction_mean_ms": statistics.mean(construction),
+            "latency_p50_ms": percentile(latency, 50),
+            "latency_p99_ms": percentile(latency, 99)}
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Measure the per-request cost of rebuilding the RAG chain.")
+    parser.add_argument("--num_requests", help="Number of requests to run per mode", type=int, default=2000)
+    parser.add_argument("--concurrency", help="Number of concurrent requests", type=int, default=16)
+    args = parser.parse_args()
+
+    llm_obj = IpExpertLLM(retriever=StaticRetriever(), model="fake",
+                          llm=FakeListChatModel(responses=["Answer: Section 92A deals with compulsory licences."]),
+                          compressor=PassThroughCompressor())
+    for rebuild in (True, False):
+        result = run(llm_obj=llm_obj, rebuild=rebuild, num_requests=args.num_requests, concurrency=args.concurrency)
+        print(" | ".join(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}"
+                         for key, value in result.items()))
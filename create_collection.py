@@ -1,9 +1,27 @@
-from pymilvus import Collection, MilvusClient, DataType
+import json
+import argparse
+from pymilvus import DataType
+from app.core.constants import INDEX_PRESETS, DEFAULT_INDEX_TYPE
+from app.utils.utility import get_dense_index_param, write_index_config
+from app.core.settings import get_settings
+from app.core.milvus_registry import get_milvus_registry
 
-client = MilvusClient("/Users/sourabpanchanan/PycharmProjects/lma-major-project-raggers/milvus_db.db")
+parser = argparse.ArgumentParser(description="Create a collection with the given dense index.")
+parser.add_argument("--milvus_uri", help="Milvus URI, defaults to IP_TUTOR_MILVUS_URI",
+                    default=get_settings().milvus_uri)
+parser.add_argument("--collection_name", help="Collection to create", default="ip_laws")
+parser.add_argument("--index_type", help="Dense index type", choices=list(INDEX_PRESETS), default=DEFAULT_INDEX_TYPE)
+parser.add_argument("--index_params", help="JSON build params overriding the index type preset, e.g. '{\"M\": 32}'",
+                    default=None, type=json.loads)
+parser.add_argument("--search_params", help="JSON search params overriding the index type preset, "
+                                            "e.g. '{\"ef\": 128}'",
+                    default=None, type=json.loads)
+args = parser.parse_args()
+
+client = get_milvus_registry().get_client(args.milvus_uri)
 
 # Specify the name of the collection
-collection_name = "ip_laws"
+collection_name = args.collection_name
 
 schema = client.create_schema(
     auto_id=True,
@@ -26,9 +44,13 @@ schema.add_field(field_name="page_label", datatype=DataType.VARCHAR, default_val
 schema.add_field(field_name="start_index", datatype=DataType.INT64, default_value=-1111111111111)
 
 index_params = client.prepare_index_params()
-index_params.add_index(field_name="dense", metric_type="COSINE", index_type="IVF_FLAT")
+dense_index_param = get_dense_index_param(index_type=args.index_type, index_params=args.index_params)
+index_params.add_index(field_name="dense", metric_type=dense_index_param["metric_type"],
+                       index_type=dense_index_param["index_type"], params=dense_index_param["params"])
 index_params.add_index(field_name="sparse", metric_type="BM25", index_type="SPARSE_INVERTED_INDEX")
 
 client.create_collection(collection_name=collection_name, schema=schema, index_params=index_params)
+write_index_config(collection_name=collection_name, index_type=args.index_type, index_params=args.index_params,
+                   search_params=args.search_params)
 
 print("Collection created Successfully")
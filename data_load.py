@@ -1,12 +1,20 @@
+import json
 import logging
 import argparse
 from app.services.embedding_service import PdfEmbeder, VectorStore
+from app.services.ingestion_service import IngestionPipeline, IngestionManifest, expand_pdf_paths
+from app.utils.chunking import CHUNKERS
+from app.core.constants import INDEX_PRESETS, DEFAULT_INDEX_TYPE
+from app.utils.utility import bump_collection_version, write_index_config
+from app.core.settings import get_settings
 
 
 class DataEmbedding(PdfEmbeder, VectorStore):
-    def __init__(self, pdf_path, milvus_uri, target_collection, chunk_size=2500, chunk_overlap=1400,
+    def __init__(self, pdf_path, milvus_uri, target_collection, chunk_size=None, chunk_overlap=None,
                  embedding_model="models/text-embedding-004",
-                 search_key=None, partition_key=None):
+                 search_key=None, partition_key=None, parse_workers=None, embed_batch_size=64, embed_concurrency=4,
+                 drop_old=False, manifest_path=None, chunker="legal", dedupe_threshold=0.85,
+                 index_type=DEFAULT_INDEX_TYPE, index_params=None, search_params=None):
         super().__init__()
         logging.info("Starting Embedding creation")
         self.pdf_path = pdf_path
@@ -17,40 +25,135 @@ class DataEmbedding(PdfEmbeder, VectorStore):
         self.embedding_model = embedding_model
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.parse_workers = parse_workers
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        self.drop_old = drop_old
+        self.chunker = chunker
+        self.dedupe_threshold = dedupe_threshold
+        self.manifest_path = manifest_path or f"ingest_manifest_{target_collection}.json"
+        self.index_type = index_type
+        self.index_params = index_params
+        self.search_params = search_params
         self.embedding_obj = None
 
+    def get_target_store(self, embedding, drop_old):
+        vector_store = self.get_ingestion_store(embedding=embedding, milvus_uri=self.milvus_uri,
+                                                target_collection=self.milvus_collection,
+                                                partition_key=self.partition_key, drop_old=drop_old,
+                                                index_type=self.index_type, index_params=self.index_params)
+        # The index is only built when the collection is created by the first insert
+        if vector_store.col is None:
+            write_index_config(collection_name=self.milvus_collection, index_type=self.index_type,
+                               index_params=self.index_params, search_params=self.search_params)
+        elif self.index_type != DEFAULT_INDEX_TYPE or self.index_params or self.search_params:
+            logging.warning(f"{self.milvus_collection} exists, its index is unchanged, use --drop_old to rebuild it")
+        return vector_store
+
     def insert_vector_data(self):
-        self.embedding_obj = PdfEmbeder(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
-        docs = self.embedding_obj.read_docs(pdf_path=self.pdf_path)
-        texts = self.chunk(docs)
-        embedding = self.create_embeddings(model=self.embedding_model, texts=texts)
-        self.insert_into_vector_store(texts=texts, embedding=embedding, milvus_uri=self.milvus_uri,
-                                      target_collection=self.milvus_collection,
-                                      partition_key=self.partition_key)
+        """
+        Stream the PDFs matched by pdf_path (a file, a directory or a glob) into the target collection
+        """
+        pdf_paths = expand_pdf_paths(self.pdf_path)
+        logging.info(f"Ingesting {len(pdf_paths)} PDF files into {self.milvus_collection}")
+        embedding = self.create_embeddings(model=self.embedding_model)
+        vector_store = self.get_target_store(embedding=embedding, drop_old=self.drop_old)
+        pipeline = IngestionPipeline(embedding=embedding, chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap,
+                                     parse_workers=self.parse_workers, embed_batch_size=self.embed_batch_size,
+                                     embed_concurrency=self.embed_concurrency, chunker=self.chunker,
+                                     dedupe_threshold=self.dedupe_threshold)
+        stats = pipeline.run(pdf_paths=pdf_paths, vector_store=vector_store)
+        bump_collection_version(collection_name=self.milvus_collection)
+        return stats
+
+    def sync_vector_data(self):
+        """
+        Incrementally sync the target collection with the PDFs matched by pdf_path, only new and changed chunks are
+        embedded and chunks which disappeared are deleted
+        """
+        pdf_paths = expand_pdf_paths(self.pdf_path)
+        manifest = IngestionManifest(path=self.manifest_path)
+        drop_old = self.drop_old or not manifest.exists
+        if not manifest.exists:
+            logging.warning(f"No manifest at {self.manifest_path}, rebuilding {self.milvus_collection} from scratch")
+        # A dropped collection holds none of the chunks of the manifest
+        if drop_old:
+            manifest.entries = {}
+        embedding = self.create_embeddings(model=self.embedding_model)
+        vector_store = self.get_target_store(embedding=embedding, drop_old=drop_old)
+        pipeline = IngestionPipeline(embedding=embedding, chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap,
+                                     parse_workers=self.parse_workers, embed_batch_size=self.embed_batch_size,
+                                     embed_concurrency=self.embed_concurrency, chunker=self.chunker,
+                                     dedupe_threshold=self.dedupe_threshold)
+        counts = pipeline.sync(pdf_paths=pdf_paths, vector_store=vector_store, manifest=manifest)
+        if counts["added"] or counts["updated"] or counts["removed"]:
+            bump_collection_version(collection_name=self.milvus_collection)
+        logging.info(f"Added {counts['added']}, updated {counts['updated']} and removed {counts['removed']} chunks, "
+                     f"{counts['unchanged']} unchanged")
+        return counts
 
 
 if __name__ == "__main__":
     logging.getLogger().setLevel(level=logging.INFO)
     parser = argparse.ArgumentParser(description="A simple script demonstrating argparse.")
-    parser.add_argument("--milvus_uri", help="Milvus URI", default="./milvus_db.db")
-    parser.add_argument("--doc_path", help="Path of the document to load",
+    parser.add_argument("--milvus_uri", help="Milvus URI, defaults to IP_TUTOR_MILVUS_URI",
+                        default=get_settings().milvus_uri)
+    parser.add_argument("--doc_path", help="Path of the document to load, a directory or a glob of PDF files",
                         default="resources/ip_laws/Manual_for_Patent_Office_Practice_and_Procedure_.pdf")
     parser.add_argument("--target_collection", help="Milvus target collection",
                         default="ip_laws")
     parser.add_argument("--embedding_model", help="Text embedding model to be used",
                         default="models/gemini-embedding-001")
-    parser.add_argument("--chunk_size", help="Chunk Size to be used",
-                        default=2500)
-    parser.add_argument("--chunk_overlap", help="Chunk overlap to be used",
-                        default=1400)
+    parser.add_argument("--chunker", help="Chunking strategy", choices=CHUNKERS, default="legal")
+    parser.add_argument("--chunk_size", help="Chunk Size to be used, defaults to the chunker default",
+                        default=None, type=int)
+    parser.add_argument("--chunk_overlap", help="Chunk overlap to be used, defaults to the chunker default",
+                        default=None, type=int)
+    parser.add_argument("--dedupe_threshold", help="Jaccard similarity above which chunks are skipped as "
+                                                   "near-duplicates, 0 disables the filter",
+                        default=0.85, type=float)
+    parser.add_argument("--parse_workers", help="Processes parsing PDF pages, defaults to the number of CPUs",
+                        default=None, type=int)
+    parser.add_argument("--embed_batch_size", help="Chunks per embedding request",
+                        default=64, type=int)
+    parser.add_argument("--embed_concurrency", help="Embedding requests in flight",
+                        default=4, type=int)
+    parser.add_argument("--drop_old", help="Drop the target collection before loading", action="store_true")
+    parser.add_argument("--sync", help="Only embed new or changed chunks and delete removed ones", action="store_true")
+    parser.add_argument("--manifest_path", help="Chunk manifest used by --sync, "
+                                                "defaults to ingest_manifest_<target_collection>.json",
+                        default=None)
+    parser.add_argument("--index_type", help="Dense index type of a new collection", choices=list(INDEX_PRESETS),
+                        default=DEFAULT_INDEX_TYPE)
+    parser.add_argument("--index_params", help="JSON build params overriding the index type preset, "
+                                               "e.g. '{\"M\": 32}'",
+                        default=None, type=json.loads)
+    parser.add_argument("--search_params", help="JSON search params overriding the index type preset, "
+                                                "e.g. '{\"ef\": 128}'",
+                        default=None, type=json.loads)
     args = parser.parse_args()
     try:
         data_load_obj = DataEmbedding(
             pdf_path=args.doc_path,
             milvus_uri=args.milvus_uri,
-            target_collection=args.target_collection
+            target_collection=args.target_collection,
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            chunker=args.chunker,
+            dedupe_threshold=args.dedupe_threshold,
+            parse_workers=args.parse_workers,
+            embed_batch_size=args.embed_batch_size,
+            embed_concurrency=args.embed_concurrency,
+            drop_old=args.drop_old,
+            manifest_path=args.manifest_path,
+            index_type=args.index_type,
+            index_params=args.index_params,
+            search_params=args.search_params
         )
-        data_load_obj.insert_vector_data()
+        if args.sync:
+            data_load_obj.sync_vector_data()
+        else:
+            data_load_obj.insert_vector_data()
     except Exception as err_msg:
         logging.error(err_msg)
         raise err_msg
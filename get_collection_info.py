@@ -1,8 +1,7 @@
-from pymilvus import MilvusClient
+from app.core.milvus_registry import get_milvus_registry
 
-# Connect to your Milvus instance (e.g., Milvus Lite)
-client = MilvusClient(
-    "/Users/sourabpanchanan/PycharmProjects/lma-major-project-raggers/milvus_db.db")  # Replace with your Milvus Lite file or connection details
+# Connect to the Milvus instance of IP_TUTOR_MILVUS_URI (e.g., Milvus Lite)
+client = get_milvus_registry().get_client()
 
 collection_name = "ip_laws"  # Replace with the actual name of your collection
 
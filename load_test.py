@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import statistics
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "samples")
+EMBEDDING_MODEL = "models/text-embedding-004"
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def configure(workdir, latency_seconds, jitter_seconds):
+    """
+    Point the settings at the local stand-ins and a Milvus Lite database in workdir.
+    Must run before the app is imported, the settings are read once per process.
+    """
+    os.environ.update({"LLM_PROVIDER": "fake",
+                       "EMBEDDING_PROVIDER": "hashing",
+                       "RERANK_PROVIDER": "lexical",
+                       "FAKE_LLM_LATENCY_SECONDS": str(latency_seconds),
+                       "FAKE_LLM_JITTER_SECONDS": str(jitter_seconds),
+                       "IP_TUTOR_MILVUS_URI": os.path.join(workdir, "load_test.db"),
+                       "INDEX_CONFIG_FILE": os.path.join(workdir, "index_config.json"),
+                       "STARTUP_MODE": "blocking"})
+    # Read when the clients are built, never used with the stand-ins
+    os.environ.setdefault("GEMINI_API_KEY", "offline")
+    os.environ.setdefault("TAVILY_API_KEY", "offline")
+
+
+def ingest(pdf_path):
+    """
+    Load the sample documents into every collection searched by the workflow, embedded with the hashing embedder
+    """
+    from app.core.constants import TARGET_COLLECTIONS
+    from app.core.settings import get_settings
+    from app.services.embedding_service import VectorStore, get_cached_embeddings
+    from app.services.ingestion_service import IngestionPipeline, expand_pdf_paths
+
+    embedding = get_cached_embeddings(model=EMBEDDING_MODEL)
+    for collection_name in TARGET_COLLECTIONS:
+        vector_store = VectorStore().get_ingestion_store(embedding=embedding, milvus_uri=get_settings().milvus_uri,
+                                                         target_collection=collection_name, partition_key=None,
+                                                         drop_old=True)
+        stats = IngestionPipeline(embedding=embedding, parse_workers=1).run(expand_pdf_paths(pdf_path), vector_store)
+        logging.info(f"Loaded {stats['chunks']} chunks into {collection_name}")
+
+
+async def run(client, questions, num_requests, concurrency, users):
+    """
+    Send num_requests chat requests from concurrency workers and measure their latency
+
+    Requests are spread over users sessions in turn, with users >= concurrency a session never has two requests in
+    flight, as with a user of the UI.
+    """
+    queue = asyncio.Queue()
+    for index in range(num_requests):
+        queue.put_nowait(index)
+    latency = []
+    errors = []
+
+    async def worker():
+        while not queue.empty():
+            index = queue.get_nowait()
+            payload = {"user_id": f"load-test-{index % users}", "message_id": str(index),
+                       "query": questions[index % len(questions)]}
+            started = time.perf_counter()
+            try:
+                response = await client.post("/chat/", json=payload)
+                if response.status_code != 200:
+                    errors.append(f"HTTP {response.status_code}: {response.text[:200]}")
+                    continue
+            except Exception as err_msg:
+                errors.append(f"{type(err_msg).__name__}: {err_msg}")
+                continue
+            latency.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    if errors:
+        logging.warning(f"{len(errors)} requests failed, first error: {errors[0]}")
+    return {"concurrency": concurrency,
+            "requests": num_requests,
+            "errors": len(errors),
+            "throughput_rps": len(latency) / elapsed,
+            "latency_mean_ms": statistics.mean(latency) if latency else float("nan"),
+            "latency_p50_ms": percentile(latency, 50) if latency else float("nan"),
+            "latency_p99_ms": percentile(latency, 99) if latency else float("nan")}
+
+
+async def main(args):
+    import httpx
+    from app.main import app
+
+    # The chat routes turn on info logging on import, which would flood the output and skew the latencies
+    logging.getLogger().setLevel(level=logging.WARNING)
+    with open(args.queries_path, "r") as file:
+        questions = [query["question"] for query in json.load(file)]
+    # The lifespan builds the services, ASGITransport does not run it itself
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=None) as client:
+            response = await client.get("/health/ready")
+            if response.status_code != 200:
+                raise RuntimeError(f"Services are not ready: {response.text}")
+            if args.warm_up:
+                await run(client=client, questions=questions, num_requests=args.warm_up,
+                          concurrency=min(args.warm_up, max(args.concurrency)), users=args.users)
+            for concurrency in args.concurrency:
+                result = await run(client=client, questions=questions, num_requests=args.num_requests,
+                                   concurrency=concurrency, users=max(args.users, concurrency))
+                print(" | ".join(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}"
+                                 for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Measure throughput and latency percentiles of the /chat endpoint "
+                                                 "offline, against the fake LLM, the hashing embedder and a Milvus "
+                                                 "Lite database of the sample documents.")
+    parser.add_argument("--pdf_path", help="PDF file, directory or glob pattern loaded into the collections",
+                        default=os.path.join(SAMPLES_DIR, "sample_ip_manual.pdf"))
+    parser.add_argument("--queries_path", help="JSON list of {question} objects sent as chat queries",
+                        default=os.path.join(SAMPLES_DIR, "sample_ip_manual_queries.json"))
+    parser.add_argument("--num_requests", help="Requests per concurrency level", type=int, default=200)
+    parser.add_argument("--concurrency", help="Concurrent clients, several values run one after the other",
+                        type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--users", help="Chat sessions the requests are spread over", type=int, default=64)
+    parser.add_argument("--warm_up", help="Requests sent before measuring", type=int, default=10)
+    parser.add_argument("--llm_latency", help="Seconds every fake LLM call takes", type=float, default=0.05)
+    parser.add_argument("--llm_jitter", help="Extra seconds, up to, added to a fake LLM call, derived from the "
+                                             "prompt so runs are repeatable", type=float, default=0.02)
+    parser.add_argument("--workdir", help="Directory for the Milvus Lite database, a temporary one by default",
+                        default=None)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="load_test_")
+    os.makedirs(workdir, exist_ok=True)
+    configure(workdir=workdir, latency_seconds=args.llm_latency, jitter_seconds=args.llm_jitter)
+    try:
+        ingest(pdf_path=args.pdf_path)
+        asyncio.run(main(args))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,151 @@
+import sys
+import time
+import asyncio
+import socket
+import logging
+import argparse
+from app.core.settings import Settings
+from app.services.mail_service import MailDispatcher
+
+REFUSED_PREFIX = "refused"
+
+
+class RecordingHandler:
+    """
+    aiosmtpd handler keeping the delivered messages and the SMTP sessions they came over, recipients starting with
+    REFUSED_PREFIX are rejected
+    """
+
+    def __init__(self, data_delay_seconds=0.0):
+        self.data_delay_seconds = data_delay_seconds
+        self.messages = []
+        self.sessions = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith(REFUSED_PREFIX):
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        # Slows the first batch down, so the following jobs queue up and are sent together
+        await asyncio.sleep(self.data_delay_seconds)
+        if not any(known is session for known in self.sessions):
+            self.sessions.append(session)
+        self.messages.append((list(envelope.rcpt_tos), envelope.content))
+        return "250 OK"
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def dispatcher_for(port, batch_size):
+    return MailDispatcher(settings=Settings(smtp_host="127.0.0.1", smtp_port=port, smtp_starttls=False,
+                                            smtp_timeout_seconds=5, email_address="ip-tutor@example.com",
+                                            email_password=None, mail_batch_size=batch_size))
+
+
+def wait_for(dispatcher, job_ids, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        statuses = [dispatcher.get_job(job_id) for job_id in job_ids]
+        if all(status["finished_at"] is not None for status in statuses):
+            return statuses
+        time.sleep(0.05)
+    raise TimeoutError(f"Mail jobs did not finish within {timeout}s")
+
+
+def check_batching(port, handler, num_jobs, batch_size):
+    """
+    Jobs queued while a batch is being sent share the next connection, every recipient gets the attachment
+    """
+    dispatcher = dispatcher_for(port, batch_size)
+    job_ids = [dispatcher.submit(recipients=[f"learner{index}@example.com"], subject="Quiz", body="Your quiz",
+                                 attachment=b"%PDF-1.3 quiz", attachment_name="QUIZ.pdf")
+               for index in range(num_jobs)]
+    statuses = wait_for(dispatcher, job_ids)
+    dispatcher.close()
+    connections = dispatcher.stats()["connections"]
+    failures = []
+    if any(status["state"] != "sent" for status in statuses):
+        failures.append(f"states {[status['state'] for status in statuses]}")
+    if len(handler.messages) != num_jobs:
+        failures.append(f"{len(handler.messages)} messages delivered for {num_jobs} jobs")
+    if any(b"QUIZ.pdf" not in content for _, content in handler.messages):
+        failures.append("attachment missing")
+    if connections >= num_jobs or len(handler.sessions) != connections:
+        failures.append(f"{connections} connections and {len(handler.sessions)} SMTP sessions for {num_jobs} jobs")
+    return failures, f"{num_jobs} jobs sent over {connections} connections"
+
+
+def check_refused_recipient(port):
+    """
+    A recipient refused by the server fails alone, the job is partial
+    """
+    dispatcher = dispatcher_for(port, batch_size=20)
+    job_id = dispatcher.submit(recipients=["learner@example.com", f"{REFUSED_PREFIX}@example.com"],
+                               subject="Quiz", body="Your quiz")
+    status = wait_for(dispatcher, [job_id])[0]
+    dispatcher.close()
+    failures = []
+    if status["state"] != "partial":
+        failures.append(f"state {status['state']}, expected partial")
+    if status["sent"] != ["learner@example.com"] or list(status["failed"]) != [f"{REFUSED_PREFIX}@example.com"]:
+        failures.append(f"sent {status['sent']}, failed {list(status['failed'])}")
+    return failures, f"state {status['state']}, failed {list(status['failed'])}"
+
+
+def check_unreachable_server():
+    """
+    A server which can not be reached fails the whole job with the connection error
+    """
+    dispatcher = dispatcher_for(free_port(), batch_size=20)
+    job_id = dispatcher.submit(recipients=["learner@example.com"], subject="Quiz", body="Your quiz")
+    status = wait_for(dispatcher, [job_id])[0]
+    dispatcher.close()
+    failures = []
+    if status["state"] != "failed" or not status["error"]:
+        failures.append(f"state {status['state']}, error {status['error']}")
+    return failures, f"state {status['state']}, error {status['error']}"
+
+
+def main(args):
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        raise SystemExit("mail_check.py needs aiosmtpd, install it with pip install aiosmtpd")
+
+    handler = RecordingHandler(data_delay_seconds=args.data_delay)
+    port = free_port()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    try:
+        results = {"batching": check_batching(port=port, handler=handler, num_jobs=args.num_jobs,
+                                              batch_size=args.batch_size),
+                   "refused_recipient": check_refused_recipient(port=port),
+                   "unreachable_server": check_unreachable_server()}
+    finally:
+        controller.stop()
+
+    failed = False
+    for name, (failures, summary) in results.items():
+        print(f"{name}: {'FAIL' if failures else 'ok'} | {summary}")
+        for failure in failures:
+            print(f"  {failure}")
+        failed = failed or bool(failures)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Check the quiz email delivery against a local aiosmtpd server: "
+                                                 "batching over pooled connections, a refused recipient and an "
+                                                 "unreachable server.")
+    parser.add_argument("--num_jobs", help="Emails queued for the batching check", type=int, default=10)
+    parser.add_argument("--batch_size", help="Jobs sent over one SMTP connection", type=int, default=20)
+    parser.add_argument("--data_delay", help="Seconds the server takes to accept a message", type=float,
+                        default=0.2)
+    sys.exit(main(parser.parse_args()))
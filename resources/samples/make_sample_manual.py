@@ -0,0 +1,95 @@
+"""
+Generates sample_ip_manual.pdf and sample_ip_manual_queries.json, a synthetic manual laid out like the IP office
+manuals (chapters, numbered paragraphs, clauses and boilerplate repeated in every chapter) with one question per fact.
+
+    python resources/samples/make_sample_manual.py
+"""
+import os
+import json
+import random
+from fpdf import FPDF
+
+SAMPLES_DIR = os.path.dirname(os.path.abspath(__file__))
+CHAPTERS = ["Filing of Applications", "Publication and Examination", "Pre-grant and Post-grant Opposition",
+            "Grant and Maintenance", "Compulsory Licences", "Registration of Trade Marks", "Registration of Designs",
+            "Copyright Office Procedures"]
+PURPOSES = ["request for examination", "early publication", "restoration of a lapsed patent", "grant of a licence",
+            "amendment of the specification", "extension of time", "registration of an assignment",
+            "filing a divisional application", "withdrawal of an application", "inspection of documents",
+            "certified copies of priority documents", "entry in the register", "mention as inventor",
+            "review of an order", "condonation of delay", "transmission of an international application",
+            "statement of working", "renewal of registration", "rectification of the register",
+            "opposition to registration", "cancellation of a design", "search of the register",
+            "correction of clerical errors", "change of address for service"]
+EVENTS = ["the date of priority", "the date of filing", "the date of publication", "the date of the order",
+          "the date of receipt of the first examination report", "the date of grant"]
+FILLER = ["The Controller shall dispose of the matter on the basis of the documents on record.",
+          "Every document shall be signed by the applicant or an authorised agent.",
+          "Where the document is filed electronically, the date of electronic transmission is the date of filing.",
+          "The applicant may be heard before any adverse order is passed.",
+          "Reasons for the decision shall be communicated to the parties in writing.",
+          "Fees once paid are not refundable except as provided in the Rules.",
+          "The Office may call for any further information it considers necessary.",
+          "A copy of every notice shall be served on the agent on record, if any."]
+BOILERPLATE = ("General note for Chapter {chapter}: The practice described in this chapter is intended for guidance "
+               "of the officers of the Office and of the applicants. It does not supersede the provisions of the Act "
+               "and the Rules, and in case of any conflict the provisions of the Act and the Rules shall prevail. "
+               "Officers shall record reasons for every decision taken under this chapter, and the Office may revise "
+               "this practice from time to time by notification on its official website.")
+
+
+def build(seed=7):
+    rng = random.Random(seed)
+    forms = list(range(1, 49))
+    rng.shuffle(forms)
+    chapters, queries = [], []
+    for c, title in enumerate(CHAPTERS, start=1):
+        sections = []
+        for s in range(1, 7):
+            form = forms.pop()
+            purpose = PURPOSES[(c * 7 + s) % len(PURPOSES)]
+            fee = rng.randrange(8, 400) * 10
+            months = rng.randrange(2, 49)
+            event = rng.choice(EVENTS)
+            clauses = [f"(a) The fee payable on Form {form} for {purpose} is Rs {fee} for a natural person or a "
+                       f"startup and Rs {fee * 5} for any other applicant.",
+                       f"(b) Form {form} shall be filed within {months} months from {event}.",
+                       f"(c) {' '.join(rng.sample(FILLER, 3))}"]
+            body = " ".join(rng.sample(FILLER, 4))
+            sections.append((f"{c:02d}.{s:02d} Form {form}: {purpose.capitalize()}", body, clauses))
+            queries.append({"question": f"What is the fee payable on Form {form} for {purpose}?",
+                            "answer": f"Form {form} for {purpose} is Rs {fee} "})
+            queries.append({"question": f"Within what time must Form {form} be filed?",
+                            "answer": f"Form {form} shall be filed within {months} months"})
+        chapters.append((f"CHAPTER {c}: {title.upper()}", BOILERPLATE.format(chapter=c), sections))
+    return chapters, queries
+
+
+def write_pdf(chapters, path):
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    for heading, note, sections in chapters:
+        pdf.add_page()
+        pdf.set_font("Arial", "B", 13)
+        pdf.multi_cell(0, 8, heading)
+        pdf.set_font("Arial", size=10)
+        pdf.multi_cell(0, 5, note)
+        for title, body, clauses in sections:
+            pdf.ln(2)
+            pdf.set_font("Arial", "B", 10)
+            pdf.multi_cell(0, 6, title)
+            pdf.set_font("Arial", size=10)
+            pdf.multi_cell(0, 5, body)
+            for clause in clauses:
+                pdf.multi_cell(0, 5, clause)
+        # The note is repeated on a page of its own closing every chapter, as in the manuals
+        pdf.add_page()
+        pdf.multi_cell(0, 5, note)
+    pdf.output(path)
+
+
+if __name__ == "__main__":
+    chapters, queries = build()
+    write_pdf(chapters, os.path.join(SAMPLES_DIR, "sample_ip_manual.pdf"))
+    with open(os.path.join(SAMPLES_DIR, "sample_ip_manual_queries.json"), "w") as file:
+        json.dump(queries, file, indent=1)
@@ -0,0 +1,81 @@
+import json
+import time
+import asyncio
+import logging
+import argparse
+import statistics
+from collections import defaultdict
+from app.core.container import ServiceContainer
+from app.services.batch_service import BatchRunner, read_questions
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+async def run(runner, questions, output_path):
+    """
+    Answer the questions and write every result to output_path as soon as it is ready
+
+    Returns:
+        list: Results in completion order
+    """
+    results = []
+    with open(output_path, "w") as file:
+        async for result in runner.astream(questions):
+            file.write(json.dumps(result) + "\n")
+            file.flush()
+            results.append(result)
+            logging.info(f"Answered {len(results)}/{len(questions)}")
+    return results
+
+
+def summarize(results, elapsed):
+    latency = [result["latency_ms"] for result in results if result["latency_ms"] is not None]
+    node_latency = defaultdict(list)
+    for result in results:
+        for node, timing in result["node_latency"].items():
+            # LLM calls made outside of the graph nodes have counters but no timing
+            if timing["calls"]:
+                node_latency[node].append(timing["ms"])
+    print(f"questions: {len(results)} | failed: {sum(1 for result in results if result['error'])} | "
+          f"elapsed_s: {elapsed:.1f} | throughput_qps: {len(results) / elapsed:.2f}")
+    print(f"llm_calls: {sum(result['llm_calls'] for result in results)} | "
+          f"input_tokens: {sum(result['input_tokens'] for result in results)} | "
+          f"output_tokens: {sum(result['output_tokens'] for result in results)} | "
+          f"cost_usd: {sum(result['cost_usd'] for result in results):.4f}")
+    if latency:
+        print(f"latency_p50_ms: {percentile(latency, 50):.1f} | latency_p95_ms: {percentile(latency, 95):.1f}")
+    for node, values in sorted(node_latency.items(), key=lambda item: -statistics.mean(item[1])):
+        print(f"node: {node} | runs: {len(values)} | mean_ms: {statistics.mean(values):.1f} | "
+              f"p95_ms: {percentile(values, 95):.1f}")
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Run a JSONL question set through the graph and write the answers, "
+                                                 "source documents and per-node latency to JSONL.")
+    parser.add_argument("--input_path", help="JSONL file, one object per line with a question and an optional id",
+                        required=True)
+    parser.add_argument("--output_path", help="JSONL file the results are written to",
+                        default="batch_results.jsonl")
+    parser.add_argument("--max_concurrency", help="Questions in flight", type=int, default=8)
+    parser.add_argument("--question_field", help="Field holding the question, question or query by default",
+                        default=None)
+    parser.add_argument("--id_field", help="Field holding the question id, id, question_id or message_id by default",
+                        default=None)
+    args = parser.parse_args()
+
+    with open(args.input_path, "r") as file:
+        questions = read_questions(file, question_field=args.question_field, id_field=args.id_field)
+    services = ServiceContainer()
+    if services.start() != "ready":
+        raise RuntimeError(f"Unable to start the services: {services.error}")
+    try:
+        runner = BatchRunner(flow_obj=services.flow_obj, flow=services.flow, max_concurrency=args.max_concurrency)
+        started = time.perf_counter()
+        results = asyncio.run(run(runner=runner, questions=questions, output_path=args.output_path))
+        summarize(results=results, elapsed=time.perf_counter() - started)
+    finally:
+        services.close()